@@ -6,7 +6,7 @@ from colorama import init, Fore, Style
 import sys
 from typing import Union
 import subprocess
-from time import time, sleep
+from time import time, sleep, perf_counter
 from concurrent.futures import ThreadPoolExecutor
 import threading
 
@@ -31,13 +31,38 @@ def format_response(**kwargs):
        return "".join(msg_parts)
 
 class MotionPlatformInterface():
-    def __init__(self, logging=True):
+    def __init__(self, logging=True, check_processes=True, trace_latency=False, binary_frames=False):
+        """
+        check_processes=False skips checking that the gui and server processes are running,
+        trace_latency=True numbers every rotate and records the per stage latencies
+        the server acknowledges in latency_samples,
+        binary_frames=True sends rotates as binary frames once the server accepts them
+        """
         self.logging = logging
+        self.binary_frames = binary_frames
+        self.check_processes = check_processes
+        self.trace_latency = trace_latency
         self.error = False
         self.warnings = {}
         self._loop = None
         self._loop_thread = None
         self.stopped = False
+        self._seq = 0
+        self._sent = {}
+        self.latency_samples = []
+        self.dropped_setpoints = 0
+        self.rate_limited_setpoints = 0
+        self.coalesced_setpoints = 0
+        self.trajectory_state = None
+        self.trajectory_position = 0.0
+        self.trajectory_duration = 0.0
+        self._trajectory_changed = threading.Condition()
+        self.attitude = None
+        self._attitude_changed = threading.Condition()
+        self.calibration = None
+        self._calibration_changed = threading.Condition()
+        self.telemetry = {}
+        self._telemetry_callbacks = {}
 
     async def _init(self):
         """
@@ -45,12 +70,14 @@ class MotionPlatformInterface():
         Connects to websocket server.
         """
         try:
-            if not get_process_info(self,"gui"):
-                raise Exception("Run motionplatform.bat file first!")
-            if not get_process_info(self,"main"):
-                raise Exception("Start server first!")
+            if self.check_processes:
+                if not get_process_info(self,"gui"):
+                    raise Exception("Run motionplatform.bat file first!")
+                if not get_process_info(self,"main"):
+                    raise Exception("Start server first!")
             self.logger.info("_init ran")
-            self.wsclient = WebSocketClient(logger=self.logger, identity="interface", on_message=self._handle_client_message)
+            self.wsclient = WebSocketClient(logger=self.logger, identity="interface", on_message=self._handle_client_message,
+                                            binary_frames=self.binary_frames)
             self.logger.info("Ws client obj made")
             await self.wsclient.connect()
         except Exception as e:
@@ -66,10 +93,32 @@ class MotionPlatformInterface():
                 if self.error:
                     self.logger.error(f"Error rotating motionplatform. Error: {self.error}")
                     raise ValueError(f"Error rotating motionplatform. Error: {self.error}")
-                await self.wsclient.send(f"action=rotate|pitch={pitch}|roll={roll}|")
+                if self.trace_latency:
+                    self._seq += 1
+                    self._sent[self._seq] = perf_counter()
+                    await self.wsclient.send_rotate(pitch, roll, seq=self._seq, timestamp=self._sent[self._seq])
+                else:
+                    await self.wsclient.send_rotate(pitch, roll)
             except Exception as e:
                 self.logger.error(f"Error while calling rotate function.{e}")
 
+    async def _trajectory(self, command, **fields):
+            """Sends a trajectory command, fields are appended as key=value|"""
+            try:
+                message = f"action=trajectory|command={command}|" + "".join(f"{key}={val}|" for key, val in fields.items())
+                await self.wsclient.send(message)
+            except Exception as e:
+                self.logger.error(f"Error while sending trajectory command {command}.{e}")
+
+    async def _upload_trajectory(self, samples, chunk_size):
+            """Sends the samples in chunks of chunk_size, the server loads the trajectory after the last one"""
+            for start in range(0, len(samples), chunk_size):
+                chunk = ";".join(f"{t},{pitch},{roll}" for t, pitch, roll in samples[start:start + chunk_size])
+                if start + chunk_size < len(samples):
+                    await self._trajectory("upload", samples=chunk, more=1)
+                else:
+                    await self._trajectory("upload", samples=chunk)
+
     async def _stop(self):
             """
             Tries to stop both motors
@@ -103,6 +152,36 @@ class MotionPlatformInterface():
         Handles messages recevied from server.
         """
         event = extract_part("event=", message=message)
+        if event == "ack" or event == "dropped":
+            self._handle_trace(event, message)
+            return
+        if event == "trajectory":
+            self._handle_trajectory(message)
+            return
+        if event == "attitude":
+            self._handle_attitude(message)
+            return
+        if event == "telemetry":
+            self._handle_telemetry(message)
+            return
+        if event == "subscribed":
+            return
+        ### handled by the websocket client
+        if event == "protocol":
+            return
+        if event == "ratelimit":
+            ### at most one summary per second of the rotates the server coalesced
+            coalesced = int(extract_part("coalesced=", message=message))
+            self.coalesced_setpoints += coalesced
+            self.logger.warning(f"Server coalesced {coalesced} rotates over its {extract_part('rate=', message=message)} hz limit "
+                                f"in the last {extract_part('interval=', message=message)} s")
+            return
+        if event == "calibration":
+            with self._calibration_changed:
+                self.calibration = {"state": extract_part("state=", message=message), "samples": int(extract_part("samples=", message=message)),
+                                    "file": extract_part("file=", message=message) or None}
+                self._calibration_changed.notify_all()
+            return
         clientmessage = extract_part("message=", message=message)
         if not event:
             self.logger.error("No event specified in message.")
@@ -116,6 +195,57 @@ class MotionPlatformInterface():
             if not clientmessage in self.warnings:
                 self.warnings[clientmessage] = clientmessage
                 self.logger.warning(clientmessage)
+    def _handle_trace(self, event, message):
+        """Turns the servers stage timestamps into per stage latencies in seconds"""
+        acked_at = perf_counter()
+        seq = extract_part("seq=", message=message)
+        sent_at = self._sent.pop(int(seq), None) if seq else None
+        if sent_at is None:
+            return
+        if event == "dropped":
+            if extract_part("reason=", message=message) == "ratelimit":
+                self.rate_limited_setpoints += 1
+            else:
+                self.dropped_setpoints += 1
+            return
+        stamps = {name: float(extract_part(f"{name}=", message=message)) for name in ("received", "parsed", "dequeued", "kinematics", "written")}
+        self.latency_samples.append({
+            "client_send": stamps["received"] - sent_at,
+            "hub_parse": stamps["parsed"] - stamps["received"],
+            "mailbox": stamps["dequeued"] - stamps["parsed"],
+            "kinematics": stamps["kinematics"] - stamps["dequeued"],
+            "modbus_write": stamps["written"] - stamps["kinematics"],
+            "ack": acked_at - stamps["written"],
+            "total": acked_at - sent_at,
+            "success": extract_part("success=", message=message) == "True",
+        })
+
+    def _handle_trajectory(self, message):
+        with self._trajectory_changed:
+            self.trajectory_state = extract_part("state=", message=message)
+            self.trajectory_position = float(extract_part("position=", message=message))
+            self.trajectory_duration = float(extract_part("duration=", message=message))
+            self._trajectory_changed.notify_all()
+
+    def _handle_attitude(self, message):
+        fields = (part.split("=", 1) for part in message.split("|") if "=" in part)
+        with self._attitude_changed:
+            self.attitude = {key: float(val) for key, val in fields if key != "event"}
+            self._attitude_changed.notify_all()
+
+    def _handle_telemetry(self, message):
+        fields = dict(part.split("=", 1) for part in message.split("|") if "=" in part)
+        del fields["event"]
+        topic = fields.pop("topic")
+        self.telemetry[topic] = fields
+        callback = self._telemetry_callbacks.get(topic)
+        if callback:
+            callback(topic, fields)
+
+    def unanswered_setpoints(self) -> int:
+        """Traced setpoints the server has neither acknowledged nor dropped"""
+        return len(self._sent)
+
     def init(self):
         """Initialize with background event loop"""
         if self._loop_thread is None:
@@ -142,9 +272,102 @@ class MotionPlatformInterface():
         if self._loop is None:
             raise RuntimeError("Must call init() first")
             
-        future = asyncio.run_coroutine_threadsafe(self._rotate(pitch, roll), self._loop)
+        future = asyncio.run_coroutine_threadsafe(self._rotate(r1, r2), self._loop)
         future.result()  # Wait for completion
     
+    def _call(self, coroutine):
+        if self._loop is None:
+            raise RuntimeError("Must call init() first")
+        future = asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+        future.result()
+
+    def upload_trajectory(self, samples, chunk_size=1000, timeout=10):
+        """
+        Uploads a [(time_s, pitch, roll), ...] trajectory that the server plays on its own schedule.
+        Returns True once the server has loaded it
+        """
+        samples = [(float(t), float(pitch), float(roll)) for t, pitch, roll in samples]
+        with self._trajectory_changed:
+            self.trajectory_state = None
+        self._call(self._upload_trajectory(samples, chunk_size))
+        return self.wait_trajectory(("loaded",), timeout) == "loaded"
+
+    def start_trajectory(self):
+        """Starts or resumes the uploaded trajectory"""
+        self._call(self._trajectory("start"))
+
+    def pause_trajectory(self):
+        self._call(self._trajectory("pause"))
+
+    def seek_trajectory(self, position):
+        """Moves the playback to position seconds from the start"""
+        self._call(self._trajectory("seek", position=float(position)))
+
+    def abort_trajectory(self):
+        self._call(self._trajectory("abort"))
+
+    def get_attitude(self, timeout=1.0):
+        """
+        Actual platform pitch/roll from the drives position feedback, with the
+        target and tracking error of the last setpoint. Returns a dict or None on timeout
+        """
+        with self._attitude_changed:
+            self.attitude = None
+        self._call(self.wsclient.send(format_response(action="readattitude")))
+        with self._attitude_changed:
+            self._attitude_changed.wait_for(lambda: self.attitude is not None, timeout)
+            return self.attitude
+
+    def subscribe(self, topic, rate=1.0, callback=None):
+        """
+        The server pushes samples of topic (telemetry, positions or status) at rate Hz, the newest
+        is kept in telemetry[topic] and passed to callback(topic, fields) on the websocket thread
+        """
+        if callback:
+            self._telemetry_callbacks[topic] = callback
+        self._call(self.wsclient.send(f"action=subscribe|topic={topic}|rate={rate}|"))
+
+    def unsubscribe(self, topic=None):
+        """From topic or from every topic"""
+        if topic:
+            self._telemetry_callbacks.pop(topic, None)
+            self._call(self.wsclient.send(f"action=unsubscribe|topic={topic}|"))
+        else:
+            self._telemetry_callbacks.clear()
+            self._call(self.wsclient.send("action=unsubscribe|"))
+
+    def _calibration(self, timeout, **fields):
+        with self._calibration_changed:
+            self.calibration = None
+        self._call(self.wsclient.send("action=calibration|" + "".join(f"{key}={val}|" for key, val in fields.items())))
+        with self._calibration_changed:
+            self._calibration_changed.wait_for(lambda: self.calibration is not None, timeout)
+            return self.calibration
+
+    def set_modbus_values(self, left, right):
+        """Drives the actuators to raw modbuscntrl values (0-10000), for calibration captures"""
+        self._call(self.wsclient.send(f"action=modbusvalues|modbus_left={int(left)}|modbus_right={int(right)}|"))
+
+    def start_calibration(self, name=None, timeout=1.0):
+        """Starts a kinematics calibration capture on the server"""
+        return self._calibration(timeout, command="start", **({"name": name} if name else {}))
+
+    def calibration_sample(self, pitch, roll, timeout=1.0):
+        """Records the IMU pitch/roll with the drives position feedback, returns the sample count or None"""
+        state = self._calibration(timeout, command="sample", pitch=float(pitch), roll=float(roll))
+        return state["samples"] if state else None
+
+    def stop_calibration(self, timeout=5.0):
+        """Saves the capture, returns the file path on the server or None"""
+        state = self._calibration(timeout, command="stop")
+        return state["file"] if state else None
+
+    def wait_trajectory(self, states=("finished", "aborted"), timeout=None):
+        """Blocks until the trajectory reaches one of the states, returns the state"""
+        with self._trajectory_changed:
+            self._trajectory_changed.wait_for(lambda: self.trajectory_state in states, timeout)
+            return self.trajectory_state
+
     def stop(self):
         """Synchronous method that uses background event loop"""
         if self._loop is None:
@@ -351,13 +574,20 @@ class Config:
     CONNECTION_TRY_COUNT = 5
 
 import asyncio
+import struct
 import websockets
 from websockets.exceptions import ConnectionClosed
 
 config = Config()
 
+### binary rotate frame, same layout as src/utils/binary_frames.py:
+### opcode, seq (0 = untraced), client send time (perf_counter), pitch, roll
+OP_ROTATE = 1
+ROTATE_FRAME = struct.Struct("<B3xIdff")
+
 class WebSocketClient():
-    def __init__(self, logger, identity="unknown", uri=f"ws://localhost:{config.WEBSOCKET_SRV_PORT}", on_message=None, reconnect_interval=2.5, max_reconnect_attempt=10):
+    def __init__(self, logger, identity="unknown", uri=f"ws://localhost:{config.WEBSOCKET_SRV_PORT}", on_message=None, reconnect_interval=2.5, max_reconnect_attempt=10, binary_frames=False):
+        """binary_frames=True asks the server for binary rotate frames at identify"""
         self.uri = uri
         self.socket = None
         self.is_running = False
@@ -368,6 +598,8 @@ class WebSocketClient():
         self.reconnect_count = 0
         self.logger = logger
         self.identity = identity
+        self.binary_frames = binary_frames
+        self.binary = False
         self._connection_lock = asyncio.Lock()
         
     async def connect(self):
@@ -384,7 +616,8 @@ class WebSocketClient():
                     ping_interval=None,  # Disable automatic ping
                     ping_timeout=None    # Disable ping timeout
                 )
-                await self.socket.send(f"action=identify|identity={self.identity}|")
+                self.binary = False
+                await self.socket.send(f"action=identify|identity={self.identity}|" + ("binary=1|" if self.binary_frames else ""))
                 self.is_running = True
                 self.reconnect_count = 0
                 self.logger.info(f"client connected to server: {self.uri}")
@@ -418,6 +651,8 @@ class WebSocketClient():
             while self.is_running and self.socket:
                 try:
                     response = await self.socket.recv()
+                    if response.startswith("event=protocol|"):
+                        self.binary = extract_part("binary=", response) == "1"
                     if self.on_message:
                         self.on_message(response)
                 except ConnectionClosed:
@@ -462,6 +697,12 @@ class WebSocketClient():
             await self._handle_connection_failure(f"Send error: {e}")
             return False
 
+    async def send_rotate(self, pitch, roll, seq=0, timestamp=None):
+        """Binary rotate frame once the server has confirmed binary frames, text rotate otherwise"""
+        if self.binary:
+            return await self.send(ROTATE_FRAME.pack(OP_ROTATE, seq, timestamp or perf_counter(), pitch, roll))
+        return await self.send(f"action=rotate|pitch={pitch}|roll={roll}|" + (f"seq={seq}|" if seq else ""))
+
     async def _cleanup_connection(self):
         """Clean up existing connection and tasks."""
         # Cancel and wait for listen task
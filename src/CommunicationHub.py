@@ -5,12 +5,23 @@ from ModbusClients import ModbusClients
 from services.process_manager import ProcessManager
 from utils.launch_params import handle_launch_params
 from utils.setup_logging import setup_logging
-from utils.utils import format_response, extract_part
+from utils.utils import format_response, parse_message
+from utils.binary_frames import decode_rotate
 from services.MotorApi import MotorApi
-from handlers import actions
+from settings.motors_config import MotorConfig
+from services.setpoint_mailbox import SetpointMailbox
+from services.trajectory_player import TrajectoryPlayer
+from services.setpoint_interpolator import SetpointInterpolator
+from services.motion_cueing import MotionCueingFilter
+from services.deadband_filter import DeadbandFilter
+from services.setpoint_predictor import SetpointPredictor
+from services.calibration_recorder import CalibrationRecorder
+from handlers.dispatch import dispatch, enqueue, run
+from services.command_queues import CommandQueues
+from utils import instrumentation
 from helpers import communication_hub_helpers as helpers
 from pathlib import Path
-from time import time
+from time import perf_counter
 
 class CommunicationHub: 
     def __init__(self):
@@ -21,12 +32,20 @@ class CommunicationHub:
         self.motor_config = None
         self.clients = None
         self.motor_api = None
+        self.bus_owner = None
+        self.bus_gateway = None
+        self.setpoint_mailbox = None
+        self.trajectory_player = None
+        self.setpoint_interpolator = None
+        self.motion_cueing = None
+        self.setpoint_predictor = None
+        self.calibration_recorder = None
+        self.telemetry_subscriptions = None
+        self.trajectory_client = None
         self.is_process_done = False
         self.server = None
         self.motors_initialized = False
         self.shutdown = False
-        self.start_time = None
-        self.counter = 0
     async def init(self, gui_socket):
         try:
             # Connect to both drivers
@@ -60,6 +79,16 @@ class CommunicationHub:
         """stops and disables motors and closes sub processes"""
         self.logger.info("Shutdown request received. Cleaning up...")
         self.server_shutdown = True
+        if self.setpoint_mailbox is not None:
+            self.setpoint_mailbox.stop()
+        if self.trajectory_player is not None:
+            self.trajectory_player.abort()
+        if self.setpoint_interpolator is not None:
+            self.setpoint_interpolator.stop()
+        if self.motion_cueing is not None:
+            self.motion_cueing.stop()
+        if self.telemetry_subscriptions is not None:
+            self.telemetry_subscriptions.stop()
         try:
             success = await self.motor_api.stop()
             if not success:
@@ -78,10 +107,12 @@ class CommunicationHub:
         #########################################################################################
 
         helpers.close_tasks(self)
+        self.logger.info(f"Register shadow cache stats: {self.motor_api.get_shadow_stats()}")
         await self.motor_api.reset_motors()
 
         self.process_manager.cleanup_all()
 
+        helpers.stop_bus_owner(self)
         if self.clients is not None:
             self.clients.cleanup()
         await asyncio.sleep(20)
@@ -101,68 +132,22 @@ class CommunicationHub:
 
     async def handle_client(self, wsclient, path=None):
         # Store client metadata
-        client_info = {"identity": "unknown", "last_call": 0}
+        client_info = {"identity": "unknown", "rate_limiter": helpers.create_rate_limiter(self, wsclient),
+                       "command_queues": CommandQueues(lambda item: run(self, item), depths=self.config.COMMAND_QUEUE_DEPTHS, logger=self.logger)}
+        client_info["command_queues"].start()
         self.wsclients[wsclient] = client_info
         self.logger.info(f"Client {wsclient.remote_address} connected! Path: {path or '/'}")
 
         try:
             async for message in wsclient:
-                self.start_time = time()
-                print(f"Received: {message}")
-                action = extract_part("action=", message)
-                pitch = extract_part("pitch=", message)
-                roll = extract_part("roll=", message)
-                modbus_left = extract_part("modbus_left=", message)
-                modbus_right = extract_part("modbus_right=", message)
-                
-                if action == "rotate" and not helpers.rate_limit(self.wsclients[wsclient]["last_call"], max_freq=self.config.RATELIMIT):
-                    await wsclient.send(format_response(event="warning", message=f"Motorapi only support: {self.config.RATELIMIT} hz."))
+                received_at = perf_counter()
+                self.logger.debug("Received: %s", message)
+                if isinstance(message, bytes):
+                    await self.handle_binary_frame(wsclient, message, received_at)
                     continue
-
-                if action and action == "rotate":
-                    await actions.rotate(self, pitch, roll, wsclient)
-                    self.wsclients[wsclient]["last_call"] = time()
-                    continue
-
-                (receiver, identity, message,acceleration,velocity) = helpers.extract_parts(message)
-
-                if action != "identify" and action != "clearfault" and not self.motors_initialized or self.shutdown:
-                    await wsclient.send(format_response(event="error", message="message=Motors are not initialized or server has been given an order to shutdown"))    
-                    continue
-                    
-                if not action:
-                    await wsclient.send(format_response(event="error", message="message=No action given, example action=<action>"))
-                else:
-                    # "endpoints"
-                    self.logger.info(f"processing action: {action}")
-                    if action == "write":
-                        await actions.write(self, pitch, roll, wsclient)
-                    elif action == "identify":
-                        await actions.identify(self, identity, wsclient)
-                    elif action == "shutdown":
-                        await self.shutdown_server(wsclient)
-                    elif action == "stop":
-                        await actions.stop_motors(self)
-                    elif action == "continue":
-                        await actions.continue_motors(self)
-                    # For dataset
-                    elif action == "modbusvalues":
-                        await actions.set_modbusvalues(self, modbus_left, modbus_right)
-                    # elif action == "updatevalues":
-                    #     await actions.update_input_values(self,acceleration,velocity)
-                    elif action == "message":
-                        await actions.message(self, receiver, wsclient, message)
-                    elif action == "clearfault":
-                        await actions.clear_fault(self, wsclient=wsclient)
-                    elif action == "absolutefault":
-                        await actions.absolutefault(self)
-                    elif action == "readtelemetry":
-                        await actions.read_telemetry(self, wsclient)
-                    elif action == "closefile":
-                        self.ow_file.close()
-                        self.logger.warning("Closed file!")
-                    else:
-                        await wsclient.send(format_response(event="error", message="message=no action found here is all the actions"))
+                fields = parse_message(message)
+                instrumentation.record("hub.parse", perf_counter() - received_at)
+                await dispatch(self, wsclient, fields, received_at)
         except websockets.ConnectionClosed as e:
             self.logger.error(f"Client {wsclient.remote_address} (identity: {client_info['identity']}) disconnected with code {e.code}, reason: {e.reason}")
         except Exception as e:
@@ -171,27 +156,98 @@ class CommunicationHub:
             self.logger.info(f"Cleaning up for client {wsclient.remote_address} (identity: {client_info['identity']})")
             await self.cleanup_client(wsclient)
 
+    async def handle_binary_frame(self, wsclient, frame, received_at):
+        """Rotate frames of clients that negotiated binary frames at identify, one struct unpack instead of the text parsing"""
+        client_info = self.wsclients.get(wsclient)
+        ### identify may have evicted the client while its frames were buffered
+        if client_info is None:
+            return
+        if not client_info.get("binary"):
+            await wsclient.send(format_response(event="error", message="Binary frames were not negotiated, identify with binary=1"))
+            return
+        try:
+            seq, sent_at, pitch, roll = decode_rotate(frame)
+        except ValueError as e:
+            self.logger.error(f"Invalid binary frame: {e}")
+            await wsclient.send(format_response(event="error", message="Invalid binary frame"))
+            return
+        instrumentation.record("hub.parse", perf_counter() - received_at)
+        ### client and hub share the host clock
+        if sent_at:
+            instrumentation.record("hub.transit", received_at - sent_at)
+        await enqueue(self, wsclient, "rotate", {"pitch": pitch, "roll": roll, "seq": seq or None, "wsclient": wsclient, "received_at": received_at})
+
+    def release_client(self, client_socket):
+        """Stops the per client rate limiter and command queues and drops its subscriptions,
+        also for clients identify already removed from wsclients"""
+        client_info = self.wsclients.pop(client_socket, None)
+        if client_info is not None:
+            client_info["rate_limiter"].stop()
+            client_info["command_queues"].close()
+        self.telemetry_subscriptions.unsubscribe(client_socket)
+
     async def cleanup_client(self, client_socket):
         # print(f"Cleaning up client: {client_socket.remote_address} (identity: {self.clients[client_socket]["identity"]})")
-        if client_socket in self.wsclients:
-            del self.wsclients[client_socket]
+        self.release_client(client_socket)
+        if client_socket is self.trajectory_client:
+            self.trajectory_client = None
         try:
             await client_socket.close()
         except Exception as e:
             self.logger.error(f"Error closing connection for {client_socket.remote_address}: {e}")
 
-    async def start_server(self):
+    async def start_server(self, config=None, motor_config=None):
+        """Configs default to the launch parameters"""
         try:
-            self.ow_file = open("overhead.txt" , "w")
-            self.config , self.motor_config = handle_launch_params(b_motor_config=True)
+            if config is None:
+                config, motor_config = handle_launch_params(b_motor_config=True)
+            self.config, self.motor_config = config, motor_config or MotorConfig()
+            if self.motor_config.KINEMATICS_MODEL is None:
+                self.motor_config.KINEMATICS_MODEL = helpers.load_kinematics_model(self)
+            instrumentation.configure(enabled=self.config.INSTRUMENTATION, ring_size=self.config.INSTRUMENTATION_RING_SIZE)
             self.clients = ModbusClients(self.config, self.logger)
             await self.clients.connect()
             self.process_manager = ProcessManager(self.logger, target_dir=Path(__file__).parent)
+            motor_clients = await helpers.start_bus_owner(self)
             self.motor_api = MotorApi(logger=self.logger,
-                            modbus_clients=self.clients,
+                            modbus_clients=motor_clients,
                             config = self.motor_config,
+                            on_stop_escalate=lambda description: helpers.send_stop_escalation(self, description),
                             )
-            self.motor_api.ow_file = self.ow_file
+            if self.config.DEADBAND:
+                self.motor_api.deadband = DeadbandFilter(self.motor_config, self.motor_api.write_revs_sides, logger=self.logger)
+            ### with interpolation the mailbox feeds the interpolator instead of writing to the drives
+            setpoint_sink = self.motor_api
+            if self.config.INTERPOLATION:
+                self.setpoint_interpolator = SetpointInterpolator(self.motor_api, logger=self.logger, rate=self.config.INTERPOLATION_RATE,
+                                                                  mode=self.config.INTERPOLATION_MODE)
+                self.setpoint_interpolator.start()
+                setpoint_sink = self.setpoint_interpolator
+            if self.config.WASHOUT:
+                self.motion_cueing = MotionCueingFilter(setpoint_sink, logger=self.logger, rate=self.config.WASHOUT_RATE,
+                                                        params_file=self.config.WASHOUT_FILE, reload_interval=self.config.WASHOUT_RELOAD_INTERVAL,
+                                                        feedback=self.motor_api.get_attitude)
+                self.motion_cueing.start()
+                setpoint_sink = self.motion_cueing
+            if self.config.PREDICTION:
+                self.setpoint_predictor = SetpointPredictor(setpoint_sink, self.motor_api, logger=self.logger,
+                                                            extra_latency=self.config.PREDICTION_EXTRA_LATENCY,
+                                                            max_horizon=self.config.PREDICTION_MAX_HORIZON,
+                                                            clamp=self.config.PREDICTION_CLAMP,
+                                                            history=self.config.PREDICTION_HISTORY,
+                                                            order=self.config.PREDICTION_ORDER)
+                setpoint_sink = self.setpoint_predictor
+            self.setpoint_mailbox = SetpointMailbox(setpoint_sink, logger=self.logger,
+                                                    on_done=lambda trace: helpers.send_setpoint_ack(self, trace),
+                                                    on_dropped=lambda trace: helpers.send_setpoint_dropped(self, trace))
+            self.setpoint_mailbox.start()
+            self.telemetry_subscriptions = helpers.create_telemetry_subscriptions(self)
+            self.calibration_recorder = CalibrationRecorder(self.motor_api, logger=self.logger, directory=self.config.CALIBRATION_DIR)
+            self.trajectory_player = TrajectoryPlayer(self.motor_api, logger=self.logger,
+                                                      on_progress=lambda *progress: helpers.send_trajectory_progress(self, *progress),
+                                                      progress_interval=self.config.TRAJECTORY_PROGRESS_INTERVAL,
+                                                      max_samples=self.config.TRAJECTORY_MAX_SAMPLES,
+                                                      stages=helpers.get_setpoint_stages(self))
             self.server = await websockets.serve(self.handle_client, "localhost", self.config.WEBSOCKET_SRV_PORT, ping_timeout=None)
             self.logger.info(f"WebSocket serverwebsocket running on ws://localhost:{self.config.WEBSOCKET_SRV_PORT}")
         except Exception as e:
@@ -1,15 +1,47 @@
 
 from pymodbus.client import AsyncModbusTcpClient
-from typing import Optional
+from typing import Optional, Union
 from utils.utils import setup_logger
+from services.modbus_transport import PipelinedModbusClient
+from services.lean_transport import LeanModbusClient
 
 class ModbusClients:
     def __init__(self, config, logger=None):
         self.config = config
         self.logger = setup_logger(logger)
-        self.client_left: Optional[AsyncModbusTcpClient] = None
-        self.client_right: Optional[AsyncModbusTcpClient] = None
+        self.client_left: Optional[Union[AsyncModbusTcpClient, PipelinedModbusClient, LeanModbusClient]] = None
+        self.client_right: Optional[Union[AsyncModbusTcpClient, PipelinedModbusClient, LeanModbusClient]] = None
         self.max_retries = 10
+        ### incremented on every successful connect so users can drop state tied to the old connection
+        self.connection_generation = 0
+
+    def _get_endpoints(self):
+        """Returns ((left_host, left_port), (right_host, right_port)),
+        the bus owners gateway ports are used in place of the drives if enabled"""
+        if self.config.USE_BUS_OWNER:
+            return ((self.config.BUS_OWNER_HOST, self.config.BUS_OWNER_PORT_LEFT),
+                    (self.config.BUS_OWNER_HOST, self.config.BUS_OWNER_PORT_RIGHT))
+        return ((self.config.SERVER_IP_LEFT, self.config.SERVER_PORT),
+                (self.config.SERVER_IP_RIGHT, self.config.SERVER_PORT))
+
+    def _create_client(self, host, port):
+        if self.config.PIPELINED_TRANSPORT:
+            return PipelinedModbusClient(
+                host=host,
+                port=port,
+                max_in_flight=self.config.MAX_IN_FLIGHT,
+                logger=self.logger
+            )
+        if self.config.LEAN_TRANSPORT:
+            return LeanModbusClient(
+                host=host,
+                port=port,
+                logger=self.logger
+            )
+        return AsyncModbusTcpClient(
+            host=host,
+            port=port
+        )
 
     async def connect(self):
         """
@@ -18,15 +50,9 @@ class ModbusClients:
         and returns None if error
         """
         try:
-            self.client_left = AsyncModbusTcpClient(
-                host=self.config.SERVER_IP_LEFT,
-                port=self.config.SERVER_PORT 
-            )
-
-            self.client_right = AsyncModbusTcpClient(
-                host=self.config.SERVER_IP_RIGHT,
-                port=self.config.SERVER_PORT  
-            )
+            (left_host, left_port), (right_host, right_port) = self._get_endpoints()
+            self.client_left = self._create_client(left_host, left_port)
+            self.client_right = self._create_client(right_host, right_port)
 
             left_connected = False
             right_connected = False
@@ -50,6 +76,7 @@ class ModbusClients:
                 
             if left_connected and right_connected:
                 self.logger.info("Both clients connected succesfully")
+                self.connection_generation += 1
 
                 # if "fault_poller.py" in self.config.MODULE_NAME:
                 #     self.client_left.ctx.next_tid = self.config.START_TID
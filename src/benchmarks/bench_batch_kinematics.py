@@ -0,0 +1,43 @@
+"""
+Scalar calculate_target_revs + calculate_motor_modbuscntrl_vals loop against
+the vectorized batch kinematics for a recorded motion of n samples.
+Run from the src directory:
+    python -m benchmarks.bench_batch_kinematics --samples 100000
+"""
+import argparse
+import json
+import logging
+from time import perf_counter
+from types import SimpleNamespace
+import numpy as np
+from helpers.motor_api_helper import calculate_target_revs, calculate_motor_modbuscntrl_vals
+from helpers.batch_kinematics import calculate_motion_batch
+from settings.motors_config import MotorConfig
+
+def bench(samples):
+    config = MotorConfig()
+    motor_api = SimpleNamespace(config=config, logger=logging.getLogger("bench"))
+    t = np.linspace(0, samples / 100, samples)
+    pitch = 9 * np.sin(t)
+    roll = 16 * np.cos(0.7 * t)
+
+    start = perf_counter()
+    scalar = []
+    for p, r in zip(pitch.tolist(), roll.tolist()):
+        revs = calculate_target_revs(motor_api, p, r)
+        scalar.append(calculate_motor_modbuscntrl_vals(motor_api, revs[0], revs[1]))
+    scalar_time = perf_counter() - start
+
+    start = perf_counter()
+    batch = calculate_motion_batch(pitch, roll, config)
+    batch_time = perf_counter() - start
+
+    matches = scalar == list(zip(batch["left_modbuscntrl"].tolist(), batch["right_modbuscntrl"].tolist()))
+    return {"samples": samples, "scalar_s": scalar_time, "batch_s": batch_time,
+            "speedup": scalar_time / batch_time, "matches": matches}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--samples", type=int, default=100000)
+    args = parser.parse_args()
+    print(json.dumps(bench(args.samples), indent=2))
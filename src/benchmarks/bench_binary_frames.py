@@ -0,0 +1,61 @@
+"""
+Rotate parsing in the hub: text frames with one extract_part scan per field
+(the handle_client parsing before the tokenizer), text frames with the single
+pass parse_message tokenizer, and the binary frame decode. Each includes the
+float conversion of the rotate action.
+Run from the src directory:
+    python -m benchmarks.bench_binary_frames --frames 200000
+"""
+import argparse
+import json
+from time import perf_counter
+from helpers.communication_hub_helpers import validate_pitch_and_roll_values
+from utils.binary_frames import encode_rotate, decode_rotate
+from utils.utils import extract_part, parse_message
+
+def parse_extract(message):
+    action = extract_part("action=", message)
+    pitch = extract_part("pitch=", message)
+    roll = extract_part("roll=", message)
+    extract_part("modbus_left=", message)
+    extract_part("modbus_right=", message)
+    seq = extract_part("seq=", message)
+    pitch, roll = validate_pitch_and_roll_values(pitch, roll)
+    return action, seq, pitch, roll
+
+def parse_tokenized(message):
+    fields = parse_message(message)
+    pitch, roll = validate_pitch_and_roll_values(fields["pitch"], fields["roll"])
+    return fields["action"], fields.get("seq"), pitch, roll
+
+def timed(parse, frames) -> float:
+    start = perf_counter()
+    for frame in frames:
+        parse(frame)
+    return perf_counter() - start
+
+def bench(frames):
+    poses = [(5 * ((i % 200) / 100 - 1), -3.25 + (i % 50) / 10) for i in range(frames)]
+    text = [f"action=rotate|pitch={pitch}|roll={roll}|seq={i + 1}|" for i, (pitch, roll) in enumerate(poses)]
+    binary = [encode_rotate(pitch, roll, i + 1, 1.0) for i, (pitch, roll) in enumerate(poses)]
+
+    extract_time = timed(parse_extract, text)
+    tokenized_time = timed(parse_tokenized, text)
+    binary_time = timed(decode_rotate, binary)
+
+    max_error = max(max(abs(decode_rotate(frame)[2] - pitch), abs(decode_rotate(frame)[3] - roll))
+                    for frame, (pitch, roll) in zip(binary, poses))
+    return {"frames": frames,
+            "text_extract_us_per_frame": extract_time / frames * 1e6,
+            "text_tokenized_us_per_frame": tokenized_time / frames * 1e6,
+            "binary_us_per_frame": binary_time / frames * 1e6,
+            "binary_frames_per_s": frames / binary_time,
+            "binary_speedup_over_extract": extract_time / binary_time,
+            "text_bytes": sum(len(message) for message in text) / frames, "binary_bytes": len(binary[0]),
+            "max_float32_error_deg": max_error}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=200000)
+    args = parser.parse_args()
+    print(json.dumps(bench(args.frames), indent=2))
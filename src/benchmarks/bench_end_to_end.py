@@ -0,0 +1,149 @@
+"""
+End to end setpoint latency: MotionPlatformInterface.set_angles -> CommunicationHub
+-> MotorApi -> local Tritex simulator and the ack back, at each of the given rates.
+Reports p50/p95/p99/max per stage in milliseconds, throughput and drop counts as JSON.
+Run from the src directory:
+    python -m benchmarks.bench_end_to_end --rates 30 60 120 --duration 5 --rtt 0.002
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import sys
+from pathlib import Path
+from time import perf_counter, sleep
+from CommunicationHub import CommunicationHub
+from helpers import communication_hub_helpers as helpers
+from settings.config import Config
+from settings.motors_config import MotorConfig
+from simulator.tritex_simulator import TritexSimulator
+from utils import instrumentation
+
+sys.path.append(str(Path(__file__).parent.parent.parent))
+from motionplatform_interface import MotionPlatformInterface
+
+STAGES = ("client_send", "hub_parse", "mailbox", "kinematics", "modbus_write", "ack", "total")
+
+def percentiles(values) -> dict:
+    if not values:
+        return {}
+    values = sorted(values)
+    def at(p):
+        return values[min(len(values) - 1, math.ceil(p * len(values)) - 1)] * 1000
+    return {"p50_ms": at(0.50), "p95_ms": at(0.95), "p99_ms": at(0.99), "max_ms": values[-1] * 1000}
+
+def drive(mpi: MotionPlatformInterface, rate, duration, settle_time) -> dict:
+    """Sends a pitch/roll sine sweep at rate Hz, runs in its own thread like an MPI user would"""
+    mpi.latency_samples = []
+    mpi.dropped_setpoints = 0
+    mpi.rate_limited_setpoints = 0
+    first_seq = mpi._seq
+    interval = 1.0 / rate
+    start = perf_counter()
+    next_send = start
+    while next_send - start < duration:
+        elapsed = next_send - start
+        mpi.set_angles(5 * math.sin(elapsed), 10 * math.cos(elapsed))
+        next_send += interval
+        delay = next_send - perf_counter()
+        if delay > 0:
+            sleep(delay)
+    sent = mpi._seq - first_seq
+    sleep(settle_time)
+
+    samples = mpi.latency_samples
+    result = {
+        "rate_hz": rate,
+        "duration_s": duration,
+        "sent": sent,
+        "acked": len(samples),
+        "dropped_coalesced": mpi.dropped_setpoints,
+        "dropped_rate_limited": mpi.rate_limited_setpoints,
+        "unanswered": mpi.unanswered_setpoints(),
+        "failed_writes": sum(1 for sample in samples if not sample["success"]),
+        "throughput_hz": len(samples) / duration,
+        "stages": {stage: percentiles([sample[stage] for sample in samples]) for stage in STAGES},
+    }
+    mpi._sent.clear()
+    return result
+
+async def bench(args):
+    simulator_args = {"port": args.port, "rtt": args.rtt, "jitter": args.jitter, "homing_vel": 50.0,
+                      "logger": logging.getLogger("simulator")}
+    simulators = [await TritexSimulator(host="127.0.0.1", **simulator_args).start(),
+                  await TritexSimulator(host="127.0.0.2", **simulator_args).start()]
+    config = Config()
+    config.SERVER_IP_LEFT = "127.0.0.1"
+    config.SERVER_IP_RIGHT = "127.0.0.2"
+    config.SERVER_PORT = args.port
+    config.RATELIMIT = args.rate_limit
+    config.PIPELINED_TRANSPORT = args.pipelined
+    config.LEAN_TRANSPORT = args.lean
+    config.INSTRUMENTATION = args.instrumentation
+    config.WASHOUT = args.washout
+    config.DEADBAND = args.deadband
+    config.PREDICTION = args.prediction
+    if args.interpolation:
+        config.INTERPOLATION = True
+        config.INTERPOLATION_MODE = args.interpolation
+        config.INTERPOLATION_RATE = args.control_rate
+
+    hub = CommunicationHub()
+    hub.logger.setLevel(logging.WARNING)
+    await hub.start_server(config, MotorConfig())
+    results = {"rtt_s": args.rtt, "jitter_s": args.jitter, "rate_limit_hz": args.rate_limit,
+               "pipelined": args.pipelined, "lean": args.lean, "runs": []}
+    mpi = None
+    try:
+        if not await hub.motor_api.initialize_motors(None):
+            raise RuntimeError("Could not initialize the simulated motors")
+        hub.motors_initialized = True
+
+        loop = asyncio.get_running_loop()
+        mpi = MotionPlatformInterface(logging=False, check_processes=False, trace_latency=True)
+        await loop.run_in_executor(None, mpi.init)
+        for rate in args.rates:
+            results["runs"].append(await loop.run_in_executor(None, drive, mpi, rate, args.duration, args.settle_time))
+        results["setpoint_mailbox"] = hub.setpoint_mailbox.get_stats()
+        if hub.setpoint_interpolator is not None:
+            results["interpolator"] = hub.setpoint_interpolator.get_stats()
+        if hub.motion_cueing is not None:
+            results["washout"] = hub.motion_cueing.get_stats()
+        if hub.setpoint_predictor is not None:
+            results["predictor"] = hub.setpoint_predictor.get_stats()
+        if hub.motor_api.deadband is not None:
+            results["deadband"] = hub.motor_api.get_deadband_stats()
+        if args.instrumentation:
+            results["spans"] = instrumentation.get_stats()["spans"]
+    finally:
+        if mpi is not None and mpi._loop is not None:
+            await loop.run_in_executor(None, mpi.close)
+        hub.setpoint_mailbox.stop()
+        hub.server.close()
+        await hub.server.wait_closed()
+        helpers.stop_bus_owner(hub)
+        hub.clients.cleanup()
+        for simulator in simulators:
+            await simulator.stop()
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rates", type=float, nargs="+", default=[30, 60, 120], help="setpoint rates in Hz")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per rate")
+    parser.add_argument("--settle_time", type=float, default=0.5, help="seconds to wait for the last acks")
+    parser.add_argument("--rtt", type=float, default=0.002, help="simulated network round trip in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0005, help="max extra uniform random delay in seconds")
+    parser.add_argument("--port", type=int, default=5020)
+    parser.add_argument("--rate_limit", type=int, default=Config.RATELIMIT, help="hub rotate rate limit in Hz")
+    parser.add_argument("--pipelined", action="store_true", help="use the pipelined modbus transport")
+    parser.add_argument("--lean", action="store_true", help="use the lean modbus transport")
+    parser.add_argument("--interpolation", choices=["linear", "hermite"], help="upsample the setpoints in the hub")
+    parser.add_argument("--control_rate", type=int, default=Config.INTERPOLATION_RATE, help="interpolated setpoint rate in Hz")
+    parser.add_argument("--washout", action="store_true", help="motion cueing filter in front of the kinematics")
+    parser.add_argument("--prediction", action="store_true", help="latency compensating setpoint predictor")
+    parser.add_argument("--deadband", action="store_true", help="skip rotate writes inside the deadband")
+    parser.add_argument("--instrumentation", action="store_true", help="include the hubs timing spans")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(bench(args)), indent=2))
@@ -0,0 +1,46 @@
+"""
+Forward kinematics (revs -> pitch/roll) per sample with the scalar solver,
+as in a polling loop, and per sample for a batch. The revs come from
+calculate_target_revs so the round trip error is reported too.
+Run from the src directory:
+    python -m benchmarks.bench_forward_kinematics --samples 100000
+"""
+import argparse
+import json
+from time import perf_counter
+import numpy as np
+from helpers.batch_kinematics import calculate_target_revs_batch
+from helpers.forward_kinematics import ForwardKinematics
+from settings.motors_config import MotorConfig
+
+def bench(samples):
+    config = MotorConfig()
+    start = perf_counter()
+    solver = ForwardKinematics(config)
+    table_time = perf_counter() - start
+
+    t = np.linspace(0, samples / 100, samples)
+    pitch = 5 * np.sin(t)
+    roll = 5 * np.cos(0.7 * t)
+    left_revs, right_revs = calculate_target_revs_batch(pitch, roll, config)
+
+    start = perf_counter()
+    scalar = [solver.solve(left, right) for left, right in zip(left_revs.tolist(), right_revs.tolist())]
+    scalar_time = perf_counter() - start
+
+    start = perf_counter()
+    batch_pitch, batch_roll = solver.solve_batch(left_revs, right_revs)
+    batch_time = perf_counter() - start
+
+    scalar_pitch = np.array([sample[0] for sample in scalar])
+    return {"samples": samples, "table_s": table_time,
+            "scalar_us_per_sample": scalar_time / samples * 1e6,
+            "batch_us_per_sample": batch_time / samples * 1e6,
+            "max_error_deg": float(max(np.max(np.abs(batch_pitch - pitch)), np.max(np.abs(batch_roll - roll)))),
+            "scalar_matches_batch": bool(np.allclose(scalar_pitch, batch_pitch, rtol=0, atol=1e-9))}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--samples", type=int, default=100000)
+    args = parser.parse_args()
+    print(json.dumps(bench(args.samples), indent=2))
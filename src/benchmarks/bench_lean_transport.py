@@ -0,0 +1,92 @@
+"""
+Setpoint hot path cost of the pymodbus client vs the lean transport.
+The codec part times building an FC16 ANALOG_MODBUS_CNTRL frame and parsing
+an FC3 PFEEDBACK response, the client part times sequential setpoint writes
+and feedback reads against the local Tritex simulator with no simulated delay.
+Run from the src directory:
+    python -m benchmarks.bench_lean_transport --iterations 20000
+"""
+import argparse
+import asyncio
+import json
+import tracemalloc
+from time import perf_counter
+from pymodbus.client import AsyncModbusTcpClient
+from pymodbus.framer import FramerSocket
+from pymodbus.pdu import DecodePDU
+from pymodbus.pdu.register_message import WriteMultipleRegistersRequest
+from simulator.tritex_simulator import TritexSimulator
+from services.lean_transport import (LeanModbusClient, WRITE_ONE_FRAME, WRITE_ONE_FIELDS, WRITE_VALUE_OFFSET,
+                                     TID_FIELD, _get_unpacker)
+from services.modbus_transport import encode_read_response, MBAP_HEADER_SIZE
+from settings.motors_config import MotorConfig
+
+def measure(func, iterations) -> dict:
+    start = perf_counter()
+    for i in range(iterations):
+        func(i)
+    elapsed = perf_counter() - start
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for i in range(1000):
+        func(i)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"ns_per_op": elapsed / iterations * 1e9, "peak_alloc_bytes_per_1000_ops": peak - before}
+
+def bench_codec(iterations, config) -> dict:
+    framer = FramerSocket(DecodePDU(False))
+    response = encode_read_response(1, config.SLAVE_ID, [1234, 5])
+
+    def pymodbus_op(i):
+        request = WriteMultipleRegistersRequest(dev_id=config.SLAVE_ID, transaction_id=i % 65535 + 1,
+                                                address=config.ANALOG_MODBUS_CNTRL_REGISTER, registers=[i % 10000])
+        framer.buildFrame(request)
+        _, pdu = framer.processIncomingFrame(response)
+        list(pdu.registers)
+
+    frame = bytearray(WRITE_ONE_FRAME.size)
+    WRITE_ONE_FRAME.pack_into(frame, 0, 0, 0, 9, config.SLAVE_ID, 16, config.ANALOG_MODBUS_CNTRL_REGISTER, 1, 2, 0)
+    response_view = memoryview(response)
+
+    def lean_op(i):
+        TID_FIELD.pack_into(frame, 0, i % 65535 + 1)
+        WRITE_ONE_FIELDS.pack_into(frame, WRITE_VALUE_OFFSET, i % 10000)
+        _get_unpacker(response_view[MBAP_HEADER_SIZE + 1] // 2).unpack_from(response_view, MBAP_HEADER_SIZE + 2)
+
+    return {"pymodbus": measure(pymodbus_op, iterations), "lean": measure(lean_op, iterations)}
+
+async def run_client(client, iterations, config) -> float:
+    await client.connect()
+    start = perf_counter()
+    for i in range(iterations):
+        await client.write_registers(address=config.ANALOG_MODBUS_CNTRL_REGISTER, values=[i % 10000], slave=config.SLAVE_ID)
+        await client.read_holding_registers(address=config.PFEEDBACK_POSITION_REGISTER, count=2, slave=config.SLAVE_ID)
+    elapsed = perf_counter() - start
+    client.close()
+    return elapsed
+
+async def bench_clients(iterations, port, config) -> dict:
+    drive = await TritexSimulator(port=port, rtt=0.0, service_time=0.0).start()
+    try:
+        results = {}
+        for name, client in (("pymodbus", AsyncModbusTcpClient(host="127.0.0.1", port=port)),
+                             ("lean", LeanModbusClient(host="127.0.0.1", port=port))):
+            elapsed = await run_client(client, iterations, config)
+            results[name] = {"us_per_setpoint_and_feedback": elapsed / iterations * 1e6}
+        return results
+    finally:
+        await drive.stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=20000, help="codec iterations, the client part runs a tenth of them")
+    parser.add_argument("--port", type=int, default=5020)
+    args = parser.parse_args()
+    config = MotorConfig()
+    results = {"codec": bench_codec(args.iterations, config),
+               "client": asyncio.run(bench_clients(args.iterations // 10, args.port, config))}
+    results["codec"]["speedup"] = results["codec"]["pymodbus"]["ns_per_op"] / results["codec"]["lean"]["ns_per_op"]
+    results["client"]["speedup"] = results["client"]["pymodbus"]["us_per_setpoint_and_feedback"] / results["client"]["lean"]["us_per_setpoint_and_feedback"]
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,63 @@
+"""
+Throughput of the pymodbus client vs the pipelined transport against the local Tritex simulator.
+Run from the src directory:
+    python -m benchmarks.bench_pipelined_transport --requests 1000 --rtt 0.002
+"""
+import argparse
+import asyncio
+import json
+from time import perf_counter
+from pymodbus.client import AsyncModbusTcpClient
+from simulator.tritex_simulator import TritexSimulator
+from services.modbus_transport import PipelinedModbusClient
+
+async def run_requests(client, requests):
+    """Issues alternating reads and writes concurrently, the way MotorApi gathers them"""
+    coros = []
+    for i in range(requests):
+        if i % 2:
+            coros.append(client.read_holding_registers(address=378, count=2, slave=1))
+        else:
+            coros.append(client.write_registers(address=7188, values=[i % 10000], slave=1))
+    start = perf_counter()
+    results = await asyncio.gather(*coros)
+    elapsed = perf_counter() - start
+    errors = sum(1 for result in results if result.isError())
+    return elapsed, errors
+
+async def bench(args):
+    drive = await TritexSimulator(port=args.port, rtt=args.rtt, jitter=args.jitter, service_time=args.service_time).start()
+    results = {"requests": args.requests, "rtt_s": args.rtt, "jitter_s": args.jitter, "service_time_s": args.service_time, "runs": []}
+    try:
+        client = AsyncModbusTcpClient(host="127.0.0.1", port=args.port)
+        await client.connect()
+        elapsed, errors = await run_requests(client, args.requests)
+        client.close()
+        results["runs"].append({"transport": "pymodbus", "in_flight": 1, "elapsed_s": elapsed,
+                                "requests_per_s": args.requests / elapsed, "errors": errors})
+
+        for in_flight in args.in_flight:
+            client = PipelinedModbusClient(host="127.0.0.1", port=args.port, max_in_flight=in_flight)
+            await client.connect()
+            elapsed, errors = await run_requests(client, args.requests)
+            client.close()
+            results["runs"].append({"transport": "pipelined", "in_flight": in_flight, "elapsed_s": elapsed,
+                                    "requests_per_s": args.requests / elapsed, "errors": errors})
+    finally:
+        await drive.stop()
+
+    baseline = results["runs"][0]["requests_per_s"]
+    for run in results["runs"]:
+        run["speedup"] = run["requests_per_s"] / baseline
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--rtt", type=float, default=0.002, help="simulated network round trip in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="max extra uniform random delay in seconds")
+    parser.add_argument("--service_time", type=float, default=0.0002, help="drive processing time per request")
+    parser.add_argument("--port", type=int, default=5020)
+    parser.add_argument("--in_flight", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(bench(args)), indent=2))
@@ -0,0 +1,13 @@
+# bus_priority.py
+### Lower value is served first by the bus owner
+SAFETY_STOP = 0
+SETPOINT = 1
+FAULT_POLL = 2
+TELEMETRY = 3
+
+BUS_PRIORITIES = {
+    SAFETY_STOP: "safety stop",
+    SETPOINT: "setpoint",
+    FAULT_POLL: "fault poll",
+    TELEMETRY: "telemetry"
+}
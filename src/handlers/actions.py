@@ -1,34 +1,49 @@
 
 from utils.utils import convert_acc_rpm_revs, convert_to_revs, convert_vel_rpm_revs,format_response
 from helpers import communication_hub_helpers as helpers
+from utils import instrumentation
+from helpers.kinematics_model import get_model
+import json
 import math
-from time import time
+from time import perf_counter
 async def write(self, pitch, roll, wsclient):
     try:
+        if self.trajectory_player.is_playing():
+            await wsclient.send("event=warning|message=Write ignored while a trajectory is playing|")
+            return
         result = helpers.validate_pitch_and_roll_values(pitch,roll)
         if result:
-            await self.motor_api.rotate(pitch, roll)
+            (pitch, roll) = result
+            self.setpoint_mailbox.post(pitch, roll)
     except ValueError:
         
         await wsclient.send(format_response(event="error", message="message=No identity was given, example action=identify|identity=<identity>|"))
     except Exception as e:
         self.logger.error(f"Something went wrong in validating pitch and roll values: {e}")
         
-async def identify(self, identity, wsclient):
+async def identify(self, wsclient, identity=None, binary=False):
     try:
         if identity:
             # Check if there is already client with the same identity, if so remove the old one
 
             identity = identity.lower()
-            for client_socket, client_info in self.wsclients.items():
-                if identity == client_info["identity"]:
-                    self.logger.warning("Found an already existing client removing it...")
-                    self.logger.info("?")
-                    await client_socket.close()
-                    del self.wsclients[client_socket]
+            old_clients = [client_socket for client_socket, client_info in self.wsclients.items()
+                           if identity == client_info["identity"] and client_socket is not wsclient]
+            for client_socket in old_clients:
+                self.logger.warning("Found an already existing client removing it...")
+                self.logger.info("?")
+                ### its limiter timers, queues and subscriptions go with it
+                self.release_client(client_socket)
+                await client_socket.close()
 
             self.wsclients[wsclient]["identity"] = identity.lower()
+            self.wsclients[wsclient]["rate_limiter"].set_limits(*helpers.get_rate_limits(self, identity))
             self.logger.info(f"Updated identity for {wsclient.remote_address}: {identity}")
+            if binary:
+                ### only binary=1 asks for them, the client sends binary rotate frames only after this confirmation
+                enabled = binary == "1" and self.config.BINARY_FRAMES
+                self.wsclients[wsclient]["binary"] = enabled
+                await wsclient.send(f"event=protocol|binary={int(enabled)}|")
         else:
             await wsclient.send("event=error|message=No identity was given, example action=identify|identity=<identity>|")
         if identity and identity == "gui":
@@ -39,14 +54,21 @@ async def identify(self, identity, wsclient):
     except Exception as e:
         self.logger.error(f"Something went wrong in identify action: {e}")
 
-async def rotate(self, pitch, roll, wsclient):
+@instrumentation.timed("actions.rotate")
+async def rotate(self, pitch, roll, wsclient, seq=None, received_at=None):
     try:
+        if self.trajectory_player.is_playing():
+            await wsclient.send("event=warning|message=Rotate ignored while a trajectory is playing|")
+            return
         result = helpers.validate_pitch_and_roll_values(pitch, roll)
         if result:
             (pitch, roll) = result
-            await self.motor_api.rotate(pitch,roll)
-            self.ow_file.write(f"{time() - self.start_time}\n")
-            self.ow_file.flush()
+            ### the receive time travels with the setpoint for the predictor, clients that send
+            ### a seq also get an ack with the stage timestamps once the setpoint is written
+            trace = {"seq": seq, "wsclient": wsclient, "received": received_at, "parsed": perf_counter()}
+            ### the clients token bucket posts it to the mailbox now or once a token is free,
+            ### the actuator task writes the newest setpoint, superseded ones are coalesced
+            self.wsclients[wsclient]["rate_limiter"].submit(pitch, roll, trace)
 
     except ValueError as e:
         self.logger.error(f"pitch and roll were not numbers: {e}")
@@ -81,8 +103,13 @@ async def clear_fault(self, wsclient):
         self.logger.error("Error clearing motors faults!")
         await wsclient.send(f"event=error|message=Error clearing motors faults {e}!|")
 
-async def message(self, receiver, wsclient, message):
+async def message(self, wsclient, receiver=None, message=None, event=None):
     try:
+        if receiver:
+            receiver = receiver.lower()
+        ### if message has event append it to it
+        if message and event:
+            message = f"event={event}|message={message}|"
         (success, receiver_client, msg) = helpers.validate_message(self,receiver,message)
         if success:
             await receiver_client.send(msg)
@@ -146,15 +173,25 @@ async def demo_control(self, pitch, roll):
         await self.motor_api.set_analog_modbus_cntrl((position_client_left, position_client_right))
     else:
         self.logger.error("Wrong parameter use direction (l | r)")
-async def set_modbusvalues(self, modbus_left,modbus_right):
+async def set_modbusvalues(self, modbus_left,modbus_right, wsclient):
     try:
+        if self.trajectory_player.is_playing():
+            await wsclient.send("event=warning|message=Modbusvalues ignored while a trajectory is playing|")
+            return
         modbus_left = int(float(modbus_left))
         modbus_right = int(float(modbus_right))
-        await self.motor_api.set_analog_modbus_cntrl((modbus_right,modbus_left))
+        for stage in helpers.get_setpoint_stages(self):
+            stage.reset()
+        await self.motor_api.set_analog_modbus_cntrl((modbus_left, modbus_right))
     except Exception as e:
         self.logger.error(f"Something went wrong while setting modbusvalues. e :{e}")
+async def shutdown(self, wsclient):
+    await self.shutdown_server(wsclient)
+
 async def stop_motors(self):
     try:
+        ### the playback would go on writing setpoints and continue would jump to where it got
+        self.trajectory_player.pause()
         success = await self.motor_api.stop()
         if not success:
             pass # do something crazy :O
@@ -207,4 +244,135 @@ async def read_telemetry(self, wsclient):
     except Exception as e:
         self.logger.error(f"Something went wrong while reading telemetry data: {e}")
         await wsclient.send(f"event=error|message=Something went wrong while reading telemetry data|")
-        
\ No newline at end of file
+
+async def subscribe(self, wsclient, topic, rate=None):
+    """
+    topic=telemetry|positions|status|rate=<hz>| pushes event=telemetry|topic=<topic>|time=..|<fields>| samples
+    at rate (1 Hz by default, limited by Config.SUBSCRIPTION_MAX_RATES), rate=0 unsubscribes
+    """
+    try:
+        rate = self.telemetry_subscriptions.subscribe(wsclient, topic, float(rate) if rate else 1.0)
+        await wsclient.send(f"event=subscribed|topic={topic}|rate={rate}|")
+    except ValueError as e:
+        await wsclient.send(f"event=error|message=Invalid subscription: {e}|")
+    except Exception as e:
+        self.logger.error(f"Something went wrong in subscribe action: {e}")
+        await wsclient.send("event=error|message=Something went wrong in subscribe action check logs server.log|")
+
+async def unsubscribe(self, wsclient, topic=None):
+    """topic=<topic>| or every topic without it"""
+    self.telemetry_subscriptions.unsubscribe(wsclient, topic)
+    await wsclient.send(f"event=subscribed|topic={topic or 'all'}|rate=0.0|")
+
+async def read_attitude(self, wsclient):
+    """Sends the actual pitch/roll solved from the position feedback and the tracking error"""
+    try:
+        attitude = await self.motor_api.get_attitude()
+        if not attitude:
+            await wsclient.send("event=error|message=Something went wrong while reading the attitude|")
+            return False
+        await wsclient.send("event=attitude|" + "".join(f"{key}={val}|" for key, val in attitude.items()))
+    except Exception as e:
+        self.logger.error(f"Something went wrong while reading the attitude: {e}")
+        await wsclient.send("event=error|message=Something went wrong while reading the attitude|")
+
+async def stats(self, wsclient, switch=None):
+    """Sends the span percentiles and counters as json, switch=on|off toggles the instrumentation"""
+    try:
+        if switch:
+            instrumentation.configure(enabled=switch.lower() == "on", ring_size=self.config.INSTRUMENTATION_RING_SIZE)
+        stats = instrumentation.get_stats()
+        stats["setpoint_mailbox"] = self.setpoint_mailbox.get_stats()
+        stats["trajectory"] = self.trajectory_player.get_stats()
+        stats["command_queues"] = [{"identity": info["identity"], **info["command_queues"].get_stats()} for info in self.wsclients.values()]
+        stats["subscriptions"] = self.telemetry_subscriptions.get_stats()
+        stats["rate_limit"] = [{"identity": info["identity"], **info["rate_limiter"].get_stats()} for info in self.wsclients.values()]
+        if self.setpoint_interpolator is not None:
+            stats["interpolator"] = self.setpoint_interpolator.get_stats()
+        if self.motion_cueing is not None:
+            stats["washout"] = self.motion_cueing.get_stats()
+        if self.setpoint_predictor is not None:
+            stats["predictor"] = self.setpoint_predictor.get_stats()
+        if self.motor_api.deadband is not None:
+            stats["deadband"] = self.motor_api.get_deadband_stats()
+        stats["retry"] = self.motor_api.get_retry_stats()
+        stats["shadow"] = self.motor_api.get_shadow_stats()
+        stats["modbus_rtt"] = self.motor_api.get_rtt_stats()
+        model = get_model(self.motor_config)
+        stats["kinematics"] = {"version": model.version, "source": model.source, "order": model.order}
+        stats["calibration"] = self.calibration_recorder.get_stats()
+        if self.bus_owner is not None:
+            stats["bus"] = self.bus_owner.get_stats()
+        await wsclient.send(f"event=stats|message={json.dumps(stats)}|")
+    except Exception as e:
+        self.logger.error(f"Something went wrong while collecting stats: {e}")
+        await wsclient.send("event=error|message=Something went wrong while collecting stats|")
+
+async def trajectory(self, wsclient, command, samples=None, more=None, position=None):
+    """
+    command=upload|samples=t,pitch,roll;t,pitch,roll;...|more=1| uploads a chunk, the chunk without more=1 loads the trajectory
+    command=start|pause|abort|seek|position=<s>| controls the playback, progress is sent as event=trajectory
+    """
+    try:
+        player = self.trajectory_player
+        self.trajectory_client = wsclient
+        if command == "upload":
+            player.append_samples(samples.replace(";", ",").split(",") if samples else [])
+            if more != "1":
+                player.load()
+        elif command == "start":
+            player.start()
+        elif command == "pause":
+            player.pause()
+        elif command == "seek":
+            player.seek(float(position))
+        elif command == "abort":
+            player.abort()
+        else:
+            await wsclient.send("event=error|message=Unknown trajectory command, use upload, start, pause, seek or abort|")
+    except ValueError as e:
+        await wsclient.send(f"event=error|message=Invalid trajectory: {e}|")
+    except Exception as e:
+        self.logger.error(f"Something went wrong in trajectory action: {e}")
+        await wsclient.send("event=error|message=Something went wrong in trajectory action check logs server.log|")
+
+async def calibration(self, wsclient, command, name=None, pitch=None, roll=None):
+    """
+    command=start|name=<file>| starts a kinematics calibration capture, set the pose with modbusvalues,
+    command=sample|pitch=<imu pitch>|roll=<imu roll>| records a sample, command=stop| saves the capture
+    """
+    try:
+        recorder = self.calibration_recorder
+        file = None
+        if command == "start":
+            recorder.start(name)
+        elif command == "sample":
+            if not await recorder.sample(float(pitch), float(roll)):
+                await wsclient.send("event=error|message=Could not read the position feedback for the calibration sample|")
+                return
+        elif command == "stop":
+            file = recorder.stop()
+        else:
+            await wsclient.send("event=error|message=Unknown calibration command, use start, sample or stop|")
+            return
+        message = f"event=calibration|state={'capturing' if recorder.capturing else 'stopped'}|samples={recorder.samples}|"
+        await wsclient.send(message + (f"file={file}|" if file else ""))
+    except (ValueError, TypeError) as e:
+        await wsclient.send(f"event=error|message=Invalid calibration command: {e}|")
+    except Exception as e:
+        self.logger.error(f"Something went wrong in calibration action: {e}")
+        await wsclient.send("event=error|message=Something went wrong in calibration action check logs server.log|")
+
+async def washout(self, wsclient, values):
+    """action=washout|hp_cutoff=0.4|tilt_gain=0.8|... updates the washout parameters on the fly"""
+    try:
+        if self.motion_cueing is None:
+            await wsclient.send("event=error|message=Washout is not enabled, start the server with --washout|")
+            return
+        if self.motion_cueing.set_parameters(values):
+            await wsclient.send("event=washout|message=Washout parameters updated|")
+        else:
+            await wsclient.send(f"event=error|message=Invalid washout parameters: {self.motion_cueing.last_reload_error}|")
+    except Exception as e:
+        self.logger.error(f"Something went wrong in washout action: {e}")
+        await wsclient.send("event=error|message=Something went wrong in washout action check logs server.log|")
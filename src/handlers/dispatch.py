@@ -0,0 +1,127 @@
+"""
+Action dispatch table of the hub. An action registers its handler, the
+message fields passed to it as keyword arguments (absent fields fall back
+to the handler defaults), the fields it requires, an optional validation,
+whether it needs initialized motors and its command queue.
+handle_client tokenizes a message once with parse_message and dispatches
+the fields here, dispatch validates them and queues a work item on the
+clients command queues, the queue workers run it with run. Inline actions
+(stop, continue) skip the queues and run right away in the receive loop,
+so a full queue or a backlog of setpoints never holds back a stop.
+"""
+import asyncio
+from dataclasses import dataclass
+from typing import Callable
+from handlers import actions
+from helpers import communication_hub_helpers as helpers
+from services.command_queues import WorkItem
+
+def numbers(*keys):
+    """Validation that the given fields are numbers, when present"""
+    def validate(fields):
+        try:
+            for key in keys:
+                if key in fields:
+                    float(fields[key])
+        except ValueError:
+            return f"{', '.join(keys)} must be numbers"
+    return validate
+
+@dataclass
+class Action:
+    handler: Callable
+    fields: tuple = () # message keys passed to the handler, or (key, parameter name) pairs
+    required: tuple = ()
+    validate: Callable = None # fields -> error message or None
+    requires_motors: bool = True
+    wsclient: bool = True # handler takes the requesting client
+    received_at: bool = False # handler takes the receive time of the message
+    values: bool = False # handler takes every field but action as a values dict
+    queue: str = "control" # motion | control | query | inline
+    log: bool = True
+
+    def __post_init__(self):
+        self.arguments = tuple((field, field) if isinstance(field, str) else field for field in self.fields)
+
+ACTIONS = {
+    "rotate": Action(actions.rotate, fields=("pitch", "roll", "seq"), required=("pitch", "roll"), requires_motors=False,
+                     received_at=True, queue="motion", log=False),
+    "stats": Action(actions.stats, fields=(("instrumentation", "switch"),), requires_motors=False, queue="query"),
+    "washout": Action(actions.washout, values=True, requires_motors=False),
+    "calibration": Action(actions.calibration, fields=("command", "name", "pitch", "roll"), required=("command",), requires_motors=False),
+    "trajectory": Action(actions.trajectory, fields=("command", "samples", "more", "position"), required=("command",)),
+    "identify": Action(actions.identify, fields=("identity", "binary"), requires_motors=False),
+    "clearfault": Action(actions.clear_fault, requires_motors=False),
+    "write": Action(actions.write, fields=("pitch", "roll"), required=("pitch", "roll"), validate=numbers("pitch", "roll"), queue="motion"),
+    "shutdown": Action(actions.shutdown),
+    ### never queued, a stop must not wait behind setpoints or be dropped by a full queue
+    "stop": Action(actions.stop_motors, wsclient=False, queue="inline"),
+    "continue": Action(actions.continue_motors, wsclient=False, queue="inline"),
+    ### For dataset
+    "modbusvalues": Action(actions.set_modbusvalues, fields=("modbus_left", "modbus_right"), required=("modbus_left", "modbus_right"),
+                           validate=numbers("modbus_left", "modbus_right"), queue="motion"),
+    # "updatevalues": Action(actions.update_input_values, fields=("acc", "vel"), wsclient=False),
+    "message": Action(actions.message, fields=("receiver", "message", "event")),
+    "absolutefault": Action(actions.absolutefault, wsclient=False),
+    "readtelemetry": Action(actions.read_telemetry, queue="query"),
+    "readattitude": Action(actions.read_attitude, queue="query"),
+    "subscribe": Action(actions.subscribe, fields=("topic", "rate"), required=("topic",), validate=numbers("rate"), queue="query"),
+    "unsubscribe": Action(actions.unsubscribe, fields=("topic",), requires_motors=False, queue="query"),
+}
+
+async def dispatch(self, wsclient, fields, received_at=None):
+    """Validates a tokenized message and queues its action, errors are sent back to the client"""
+    name = fields.get("action")
+    if not name:
+        await wsclient.send("event=error|message=No action given, example action=<action>|")
+        return
+    action = ACTIONS.get(name)
+    if action is None:
+        await wsclient.send(f"event=error|message=No action found with name {name}, actions: {', '.join(ACTIONS)}|")
+        return
+    missing = [key for key in action.required if not fields.get(key)]
+    if missing:
+        await wsclient.send(f"event=error|message=action={name} needs {', '.join(f'{key}=<{key}>' for key in missing)}|")
+        return
+    if action.validate is not None:
+        error = action.validate(fields)
+        if error:
+            await wsclient.send(f"event=error|message=Invalid action={name}: {error}|")
+            return
+
+    kwargs = {parameter: fields[key] for key, parameter in action.arguments if key in fields}
+    if action.values:
+        kwargs["values"] = {key: value for key, value in fields.items() if key != "action"}
+    if action.wsclient:
+        kwargs["wsclient"] = wsclient
+    if action.received_at:
+        kwargs["received_at"] = received_at
+    await enqueue(self, wsclient, name, kwargs)
+
+async def enqueue(self, wsclient, name, kwargs):
+    action = ACTIONS[name]
+    item = WorkItem(name, kwargs, wsclient)
+    if action.queue == "inline":
+        await run(self, item)
+        return
+    client_info = self.wsclients.get(wsclient)
+    ### identify may have evicted the client while its messages were buffered
+    if client_info is None:
+        return
+    if client_info["command_queues"].put(action.queue, item):
+        ### let the workers run between the frames the receive loop has buffered
+        await asyncio.sleep(0)
+        return
+    await wsclient.send(f"event=error|message=The {action.queue} queue is full, action={name} was dropped|")
+    if kwargs.get("seq"):
+        helpers.send_setpoint_dropped(self, {"seq": kwargs["seq"], "wsclient": wsclient}, reason="queue")
+
+async def run(self, item):
+    """Runs a queued action, the motors state is checked when it runs"""
+    action = ACTIONS[item.action]
+    if action.requires_motors and (not self.motors_initialized or self.shutdown):
+        await item.wsclient.send("event=error|message=Motors are not initialized or server has been given an order to shutdown|")
+        return
+    if action.log:
+        self.logger.info(f"processing action: {item.action}")
+    await action.handler(self, **item.kwargs)
@@ -0,0 +1,37 @@
+"""
+Vectorized versions of calculate_target_revs and calculate_motor_modbuscntrl_vals
+for whole motion files, pitch and roll are NumPy arrays of any (broadcastable) shape.
+Same clamping and limits as the scalar path, one pass over the arrays.
+"""
+import numpy as np
+from helpers.pose_envelope import get_envelope
+from helpers.kinematics_model import get_model
+
+def calculate_target_revs_batch(pitch, roll, config):
+    """
+    Args:
+        pitch (array): degrees -8.5-8.5
+        roll (array): degrees -15.0-15.0
+    Returns:
+        (left_revs, right_revs) float64 arrays
+    """
+    ### unreachable poses -> nearest reachable pose, like the scalar path
+    pitch, roll = get_envelope(config).project_batch(pitch, roll)
+    ### the compiled model evaluates arrays like the scalar path evaluates floats, bit for bit
+    return get_model(config).revs(pitch, roll)
+
+def calculate_modbuscntrl_vals_batch(left_revs, right_revs, config):
+    """Maps revs into the 0-MODBUSCTRL_MAX modbuscntrl range.
+    Returns (left, right) int64 arrays"""
+    span = config.POS_MAX_REVS - config.POS_MIN_REVS
+    left = np.clip((np.asarray(left_revs, dtype=np.float64) - config.POS_MIN_REVS) / span, 0, 1)
+    right = np.clip((np.asarray(right_revs, dtype=np.float64) - config.POS_MIN_REVS) / span, 0, 1)
+    return (np.floor(left * config.MODBUSCTRL_MAX).astype(np.int64),
+            np.floor(right * config.MODBUSCTRL_MAX).astype(np.int64))
+
+def calculate_motion_batch(pitch, roll, config) -> dict:
+    """Revs and modbuscntrl values for a whole pitch/roll recording or trajectory"""
+    left_revs, right_revs = calculate_target_revs_batch(pitch, roll, config)
+    left_modbuscntrl, right_modbuscntrl = calculate_modbuscntrl_vals_batch(left_revs, right_revs, config)
+    return {"left_revs": left_revs, "right_revs": right_revs,
+            "left_modbuscntrl": left_modbuscntrl, "right_modbuscntrl": right_modbuscntrl}
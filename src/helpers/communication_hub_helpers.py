@@ -1,5 +1,8 @@
-from utils.utils import extract_part
-from time import time
+from services.bus_owner import BusOwner, BusClients, BusGateway
+from helpers.kinematics_model import load_model
+from services.rate_limiter import RotateRateLimiter
+from services.telemetry_subscriptions import TelemetrySubscriptions
+from helpers.fault_helpers import has_faulted
 
 
 def validate_update_values(values):
@@ -38,21 +41,6 @@ def validate_message(self,receiver, message):
         
     return (False, None, f"event=error|message=No receiver was found in the server with this identity: {receiver}|")
 
-def extract_parts(msg): # example message: "action=STOP|receiver=startup|identity=fault_poller|message=CRITICAL FAULT!|pitch=40.3"
-    receiver = extract_part("receiver=", message=msg)
-    identity = extract_part("identity=", message=msg)
-    message = extract_part("message=", message=msg)
-    event = extract_part("event=", message=msg)
-    acceleration = extract_part("acc=", message=msg)
-    velocity = extract_part("vel=", message=msg)
-    if receiver:
-        receiver = receiver.lower()
-    ### if message has event append it to it
-    if message and event:
-        message = f"event={event}|message={message}|"
-
-    return (receiver, identity, message,acceleration,velocity)
-
 import asyncio
 import psutil
 
@@ -66,7 +54,7 @@ async def monitor_fault_poller(self):
             pid = self.fault_poller_pid
             if pid and not psutil.pid_exists(pid):
                 self.logger.warning(f"fault_poller (PID: {pid}) is not running, restarting...")
-                new_pid = self.process_manager.launch_process("fault_poller")
+                new_pid = self.process_manager.launch_process("fault_poller", args=get_process_args(self))
                 self.fault_poller_pid = new_pid
                 self.logger.info(f"Restarted fault_poller with PID: {new_pid}")
                 del self.process_manager.processes[pid]
@@ -82,7 +70,7 @@ async def monitor_velocity_controller(self):
             pid = self.velocity_controller_pid
             if pid and not psutil.pid_exists(pid):
                 self.logger.warning(f"velocity_controller (PID: {pid}) is not running, restarting...")
-                new_pid = self.process_manager.launch_process("velocity_controller")
+                new_pid = self.process_manager.launch_process("velocity_controller", args=get_process_args(self))
                 self.velocity_controller_pid = new_pid
                 self.logger.info(f"Restarted velocity_controller with PID: {new_pid}")
                 del self.process_manager.processes[pid]
@@ -105,6 +93,41 @@ async def monitor_socket_server(self):
                 del self.process_manager.processes[pid]
         await asyncio.sleep(60)
 
+async def start_bus_owner(self):
+    """Makes the hub the single owner of the drive connections.
+    Returns the clients MotorApi should use"""
+    if not self.config.BUS_OWNER:
+        return self.clients
+    self.bus_owner = BusOwner(self.clients, self.motor_config, self.config, self.logger)
+    await self.bus_owner.start()
+    self.bus_gateway = BusGateway(self.bus_owner, self.config, self.logger, on_write=lambda *write: follow_external_write(self, *write))
+    if not await self.bus_gateway.start():
+        ### the sub processes connect to the drives themselves without the gateway
+        self.logger.error("Bus owner gateway failed, sub processes will connect to the drives directly.")
+        self.bus_gateway.stop()
+        self.bus_gateway = None
+    return BusClients(self.bus_owner)
+
+def follow_external_write(self, side, address, values):
+    """A sub process wrote to a drive through the gateway, the hubs register shadow follows it"""
+    try:
+        if self.motor_api is not None:
+            self.motor_api.external_write(side, address, values)
+    except Exception as e:
+        self.logger.error(f"Could not follow the write of a sub process: {e}")
+
+def stop_bus_owner(self):
+    if self.bus_gateway is not None:
+        self.bus_gateway.stop()
+    if self.bus_owner is not None:
+        self.bus_owner.stop()
+
+def get_process_args(self):
+    """Launch arguments for the sub processes that talk to the drives"""
+    if self.bus_gateway is not None:
+        return ["--bus_owner"]
+    return None
+
 async def create_hearthbeat_monitor_tasks(self):
     self.monitor_fault_poller = asyncio.create_task(monitor_fault_poller(self))
 
@@ -115,17 +138,96 @@ def create_processes(self):
         return
     elif result:
         self.logger.info(f"No lingering process remaining.")
-    fault_poller_pid = self.process_manager.launch_process("fault_poller")
+    fault_poller_pid = self.process_manager.launch_process("fault_poller", args=get_process_args(self))
     self.fault_poller_pid = fault_poller_pid
     
-def rate_limit(lastcall, max_freq):
-    """
-    Limits rate of requests to server.
-    """
-    min_interval = 1.0 / max_freq
-    current_time = time()
-    delta_time = current_time - lastcall
-    
-    if delta_time < min_interval:
+def send_setpoint_ack(self, trace):
+    """Sends the stage timestamps (perf_counter) of a traced setpoint back to its client"""
+    if not trace["seq"]:
+        return
+    message = (f"event=ack|seq={trace['seq']}|received={trace['received']}|parsed={trace['parsed']}|"
+               f"dequeued={trace['dequeued']}|kinematics={trace.get('kinematics', trace['dequeued'])}|"
+               f"written={trace.get('written', trace['dequeued'])}|success={trace.get('success', False)}|")
+    asyncio.create_task(send_trace_message(self, trace["wsclient"], message))
+
+def send_setpoint_dropped(self, trace, reason="coalesced"):
+    if not trace["seq"]:
+        return
+    asyncio.create_task(send_trace_message(self, trace["wsclient"], f"event=dropped|seq={trace['seq']}|reason={reason}|"))
+
+async def send_trace_message(self, wsclient, message):
+    try:
+        await wsclient.send(message)
+    except Exception as e:
+        self.logger.debug(f"Could not send setpoint trace to client: {e}")
+
+def send_stop_escalation(self, description):
+    """The stop retries gave up, the gui shows it as a fault"""
+    message = f"event=fault|message=Failed to {description}, the motors may still be moving. Use the emergency stop!|"
+    for wsclient, client_info in self.wsclients.items():
+        if client_info["identity"] == "gui":
+            asyncio.create_task(send_trace_message(self, wsclient, message))
+
+def send_trajectory_progress(self, state, position, duration, index):
+    """Sends the playback progress to the client that started the trajectory"""
+    if self.trajectory_client is None:
+        return
+    message = f"event=trajectory|state={state}|position={position:.3f}|duration={duration:.3f}|index={index}|"
+    asyncio.create_task(send_trace_message(self, self.trajectory_client, message))
+
+def get_setpoint_stages(self) -> list:
+    """The washout and interpolator stages that write on their own, to reset before others move the drives"""
+    return [stage for stage in (self.motion_cueing, self.setpoint_interpolator) if stage is not None]
+
+def create_telemetry_subscriptions(self):
+    acquire = {"telemetry": lambda: acquire_telemetry(self),
+               "positions": self.motor_api.get_attitude,
+               "status": lambda: acquire_status(self)}
+    return TelemetrySubscriptions(acquire, send=lambda wsclient, message: send_trace_message(self, wsclient, message),
+                                  max_rates=self.config.SUBSCRIPTION_MAX_RATES, logger=self.logger)
+
+async def acquire_telemetry(self):
+    data = await self.motor_api.get_telemetry_data()
+    if not data:
         return False
-    return True
\ No newline at end of file
+    return {name: f"{left},{right}" for name, (left, right) in zip(("boardtemp", "actuatortemp", "ic", "vbus"), data)}
+
+async def acquire_status(self):
+    status = await self.motor_api.check_fault_stauts(log=False)
+    if not status:
+        return False
+    faulted = has_faulted(status)
+    ### the present fault register is only read once a drive reports a fault
+    fault = (0, 0)
+    if any(faulted):
+        fault = await self.motor_api.get_present_fault()
+        if not fault:
+            return False
+    return {"status": "{},{}".format(*status), "fault": "{},{}".format(*fault),
+            "faulted": f"{int(faulted[0])},{int(faulted[1])}"}
+
+def load_kinematics_model(self):
+    """Loads the configured kinematics coefficient set, None falls back to the built in model"""
+    try:
+        model = load_model(self.motor_config.KINEMATICS_FILE, self.motor_config.KINEMATICS_VERSION)
+        self.logger.info(f"Loaded kinematics model version {model.version} ({model.source}) from {self.motor_config.KINEMATICS_FILE}")
+        return model
+    except Exception as e:
+        self.logger.error(f"Could not load the kinematics model, using the built in one: {e}")
+        return None
+
+def get_rate_limits(self, identity) -> tuple:
+    """(rate hz, burst) of the clients rotates"""
+    return self.config.RATELIMIT_IDENTITIES.get(identity, (self.config.RATELIMIT, self.config.RATELIMIT_BURST))
+
+def create_rate_limiter(self, wsclient):
+    """Rotate token bucket of a client, identify sets the limits of its identity"""
+    return RotateRateLimiter(lambda pitch, roll, trace: self.setpoint_mailbox.post(pitch, roll, trace),
+                             *get_rate_limits(self, "unknown"),
+                             on_dropped=lambda trace: send_setpoint_dropped(self, trace, reason="ratelimit"),
+                             on_summary=lambda coalesced, rate, burst: send_rate_limit_summary(self, wsclient, coalesced, rate, burst),
+                             summary_interval=self.config.RATELIMIT_SUMMARY_INTERVAL)
+
+def send_rate_limit_summary(self, wsclient, coalesced, rate, burst):
+    message = f"event=ratelimit|coalesced={coalesced}|interval={self.config.RATELIMIT_SUMMARY_INTERVAL}|rate={rate}|burst={burst}|"
+    asyncio.create_task(send_trace_message(self, wsclient, message))
\ No newline at end of file
@@ -23,7 +23,10 @@ async def validate_fault_register(self, gui_socket) -> bool:
     Check if the fault register have critical or absolute fault. Returns True if there's none.
     """
     vals = await self.check_fault_stauts(log=True)
-    l_has_faulted, r_has_faulted = has_faulted(vals) 
+    if not vals:
+        self.logger.error("Getting the drive status was not succesful")
+        return False
+    l_has_faulted, r_has_faulted = has_faulted(vals)
     if (l_has_faulted or r_has_faulted):
 
         vals = await self.get_present_fault()
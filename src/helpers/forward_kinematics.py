@@ -0,0 +1,62 @@
+"""
+Forward kinematics, actuator revs back to platform pitch/roll. Inverts the
+kinematics model of calculate_target_revs with Newton's method started from a
+precomputed table of solutions over the POS_MIN_REVS-POS_MAX_REVS square, so a
+few iterations reach machine precision. The same step runs on floats
+and on NumPy arrays for batches.
+"""
+import numpy as np
+from helpers.kinematics_model import get_model
+
+def _newton_step(model, pitch, roll, left_revs, right_revs):
+    left, right = model.revs(pitch, roll)
+    left_error = left - left_revs
+    right_error = right - right_revs
+    left_pitch, left_roll, right_pitch, right_roll = model.jacobian(pitch, roll)
+    det = left_pitch*right_roll - left_roll*right_pitch
+    pitch_step = (right_roll*left_error - left_roll*right_error) / det
+    roll_step = (left_pitch*right_error - right_pitch*left_error) / det
+    return pitch - pitch_step, roll - roll_step
+
+class ForwardKinematics():
+    """table_size^2 initial guesses, iterations Newton steps per solve"""
+    def __init__(self, config, table_size=64, iterations=3):
+        self.model = get_model(config)
+        self.iterations = iterations
+        self.size = table_size
+        self.low = config.POS_MIN_REVS
+        self.step = (config.POS_MAX_REVS - config.POS_MIN_REVS) / (table_size - 1)
+        self.inv_step = 1 / self.step
+
+        revs = self.low + self.step * np.arange(table_size)
+        left, right = np.meshgrid(revs, revs, indexing="ij")
+        ### linear inverse as the start, then iterate to convergence once
+        pitch, roll = self.model.linear_inverse(left, right)
+        for _ in range(20):
+            pitch, roll = _newton_step(self.model, pitch, roll, left, right)
+        self.pitch_table = pitch
+        self.roll_table = roll
+        ### flat lists for the scalar path, indexing them is faster than indexing arrays
+        self._guesses = list(zip(pitch.ravel().tolist(), roll.ravel().tolist()))
+
+    def solve(self, left_revs, right_revs) -> tuple:
+        """Returns (pitch, roll) in degrees for one pair of actuator revs"""
+        size = self.size
+        i = min(max(int((left_revs - self.low) * self.inv_step + 0.5), 0), size - 1)
+        j = min(max(int((right_revs - self.low) * self.inv_step + 0.5), 0), size - 1)
+        pitch, roll = self._guesses[i * size + j]
+        for _ in range(self.iterations):
+            pitch, roll = _newton_step(self.model, pitch, roll, left_revs, right_revs)
+        return pitch, roll
+
+    def solve_batch(self, left_revs, right_revs) -> tuple:
+        """Returns (pitch, roll) float64 arrays for arrays of actuator revs"""
+        left_revs = np.asarray(left_revs, dtype=np.float64)
+        right_revs = np.asarray(right_revs, dtype=np.float64)
+        i = np.clip(np.rint((left_revs - self.low) * self.inv_step), 0, self.size - 1).astype(np.intp)
+        j = np.clip(np.rint((right_revs - self.low) * self.inv_step), 0, self.size - 1).astype(np.intp)
+        pitch = self.pitch_table[i, j]
+        roll = self.roll_table[i, j]
+        for _ in range(self.iterations):
+            pitch, roll = _newton_step(self.model, pitch, roll, left_revs, right_revs)
+        return pitch, roll
@@ -0,0 +1,131 @@
+"""
+The pitch/roll -> actuator revs polynomial. A KinematicsModel holds the left
+and right coefficients of every pitch^i * roll^j term up to the model order
+and compiles them once into plain expressions, so the same function serves
+floats in the rotate hot path and NumPy arrays in the batch code with bit for
+bit equal results. Coefficient sets are versioned in a json file, refit_model
+fits a new set to captured calibration data.
+"""
+import json
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+
+def get_terms(order) -> list:
+    """(pitch power, roll power) of the terms, 1, pitch, roll, pitch^2, pitch*roll, roll^2, ..."""
+    return [(degree - roll_power, roll_power) for degree in range(order + 1) for roll_power in range(degree + 1)]
+
+def _monomial(pitch_power, roll_power) -> str:
+    return "*".join(["pitch"] * pitch_power + ["roll"] * roll_power)
+
+def _polynomial(coefficients, terms) -> str:
+    parts = []
+    for coefficient, (pitch_power, roll_power) in zip(coefficients, terms):
+        if coefficient == 0:
+            continue
+        monomial = _monomial(pitch_power, roll_power)
+        parts.append(f"{coefficient!r}*{monomial}" if monomial else repr(coefficient))
+    ### 0.0*pitch keeps the shape of array arguments
+    return " + ".join(parts) if parts else "0.0*pitch"
+
+def _derivative(coefficients, terms, by_pitch) -> tuple:
+    """Coefficients and terms of the derivative by pitch or roll"""
+    derivative = []
+    for coefficient, (pitch_power, roll_power) in zip(coefficients, terms):
+        power = pitch_power if by_pitch else roll_power
+        if power:
+            derivative.append((coefficient * power, (pitch_power - 1, roll_power) if by_pitch else (pitch_power, roll_power - 1)))
+    return [coefficient for coefficient, _ in derivative], [term for _, term in derivative]
+
+class KinematicsModel():
+    def __init__(self, left, right, order=2, version=None, source=None, rms_revs=None, created=None):
+        self.order = order
+        self.terms = get_terms(order)
+        if len(left) != len(self.terms) or len(right) != len(self.terms):
+            raise ValueError(f"An order {order} model needs {len(self.terms)} coefficients per side")
+        self.left = [float(coefficient) for coefficient in left]
+        self.right = [float(coefficient) for coefficient in right]
+        self.version = version
+        self.source = source
+        self.rms_revs = rms_revs
+        self.created = created
+        self.key = (order, tuple(self.left), tuple(self.right))
+
+        left_pitch, left_roll = _derivative(self.left, self.terms, True), _derivative(self.left, self.terms, False)
+        right_pitch, right_roll = _derivative(self.right, self.terms, True), _derivative(self.right, self.terms, False)
+        source = (f"def revs(pitch, roll):\n    return ({_polynomial(self.left, self.terms)}, {_polynomial(self.right, self.terms)})\n"
+                  f"def jacobian(pitch, roll):\n    return ({_polynomial(*left_pitch)}, {_polynomial(*left_roll)}, "
+                  f"{_polynomial(*right_pitch)}, {_polynomial(*right_roll)})\n")
+        namespace = {}
+        exec(compile(source, f"<kinematics model {version}>", "exec"), namespace)
+        ### revs(pitch, roll) -> (left_revs, right_revs), floats or arrays, degrees in
+        self.revs = namespace["revs"]
+        ### jacobian(pitch, roll) -> (dleft/dpitch, dleft/droll, dright/dpitch, dright/droll)
+        self.jacobian = namespace["jacobian"]
+
+    def linear_inverse(self, left_revs, right_revs) -> tuple:
+        """(pitch, roll) from the constant and linear terms only, a starting point for solvers"""
+        a, b, c, d = self.left[1], self.left[2], self.right[1], self.right[2]
+        left_revs = left_revs - self.left[0]
+        right_revs = right_revs - self.right[0]
+        det = a*d - b*c
+        return (d*left_revs - b*right_revs) / det, (a*right_revs - c*left_revs) / det
+
+    def to_dict(self) -> dict:
+        return {"version": self.version, "order": self.order, "left": self.left, "right": self.right,
+                "source": self.source, "rms_revs": self.rms_revs, "created": self.created}
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(values["left"], values["right"], order=values.get("order", 2), version=values.get("version"),
+                   source=values.get("source"), rms_revs=values.get("rms_revs"), created=values.get("created"))
+
+### final1 mirrored, the quadratic regression the platform shipped with
+DEFAULT_MODEL = KinematicsModel(left=[13.6775, 1.8464, -0.8026, 0.0053, -0.0050, 0.0011],
+                                right=[13.6775, 1.8464, 0.8026, 0.0053, 0.0050, 0.0011],
+                                order=2, version=2, source="final1 mirrored")
+
+def get_model(config) -> KinematicsModel:
+    """The model loaded into the motor config at startup, or the built in one"""
+    return getattr(config, "KINEMATICS_MODEL", None) or DEFAULT_MODEL
+
+def load_model(path, version=None) -> KinematicsModel:
+    """Loads the given version, or the active one, from a coefficient file"""
+    with open(path) as file:
+        models = json.load(file)
+    version = models["active"] if version is None else version
+    for values in models["versions"]:
+        if values["version"] == version:
+            return KinematicsModel.from_dict(values)
+    raise ValueError(f"No kinematics model version {version} in {path}")
+
+def save_model(path, model, activate=False) -> int:
+    """Adds the model to the coefficient file as the next version, returns the version"""
+    path = Path(path)
+    if path.exists():
+        with open(path) as file:
+            models = json.load(file)
+    else:
+        models = {"active": DEFAULT_MODEL.version, "versions": [DEFAULT_MODEL.to_dict()]}
+    model.version = max(values["version"] for values in models["versions"]) + 1
+    model.created = model.created or datetime.now().isoformat(timespec="seconds")
+    models["versions"].append(model.to_dict())
+    if activate:
+        models["active"] = model.version
+    with open(path, "w") as file:
+        json.dump(models, file, indent=2)
+    return model.version
+
+def refit_model(pitch, roll, left_revs, right_revs, order=2, source=None) -> KinematicsModel:
+    """Least squares fit of the revs to the measured pitch/roll"""
+    pitch = np.asarray(pitch, dtype=np.float64)
+    roll = np.asarray(roll, dtype=np.float64)
+    terms = get_terms(order)
+    if len(pitch) < len(terms):
+        raise ValueError(f"An order {order} fit needs at least {len(terms)} samples")
+    design = np.column_stack([pitch**pitch_power * roll**roll_power for pitch_power, roll_power in terms])
+    coefficients, _, _, _ = np.linalg.lstsq(design, np.column_stack([left_revs, right_revs]), rcond=None)
+    model = KinematicsModel(coefficients[:, 0].tolist(), coefficients[:, 1].tolist(), order=order, source=source)
+    left, right = model.revs(pitch, roll)
+    model.rms_revs = float(np.sqrt(np.mean(np.concatenate([left - left_revs, right - right_revs])**2)))
+    return model
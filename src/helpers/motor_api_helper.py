@@ -1,6 +1,9 @@
 import math
 from utils.utils import unnormalize_decimal
 from typing import Union
+from utils.instrumentation import timed
+from helpers.pose_envelope import get_envelope
+from helpers.kinematics_model import get_model
 
 def calculate_motor_modbuscntrl_vals(self, left_revs, right_revs):
         try:
@@ -21,15 +24,7 @@ def calculate_motor_modbuscntrl_vals(self, left_revs, right_revs):
 
 def get_register_values(data):
     left_data, right_data = data
-    left_vals = []
-    right_vals = []
-    for register in left_data.registers:
-        left_vals.append(register)
-
-    for register in right_data.registers:
-        right_vals.append(register)
-        
-    return (left_vals, right_vals)
+    return (list(left_data.registers), list(right_data.registers))
 
 def clamp_target_revs(left_revs, right_revs, config) -> list[list, list]:
     """Clamps the motors revs within the safety limits (2-147mm)
@@ -70,6 +65,7 @@ def clamp_target_revs(left_revs, right_revs, config) -> list[list, list]:
 
     return [[left_pos_low, left_whole], [right_pos_low, right_whole]]
 
+@timed("calculate_target_revs")
 def calculate_target_revs(self, pitch_value, roll_value) -> Union[list, None]:
     """Calculates the target revolutions and unnormalizes the decimal part
     while respecting the  motors safety limits
@@ -81,38 +77,24 @@ def calculate_target_revs(self, pitch_value, roll_value) -> Union[list, None]:
         if success, None if something went wrong
     """
     try:
-        if abs(pitch_value) >= self.config.MAX_ANGLE_COMBO and abs(roll_value) >= self.config.MAX_ANGLE_COMBO:
-             if pitch_value < 0:
-                  pitch_value = -self.config.MAX_ANGLE_COMBO
-             else:
-                  pitch_value = self.config.MAX_ANGLE_COMBO
-                  
-             if roll_value < 0:
-                  roll_value = -self.config.MAX_ANGLE_COMBO
-             else:
-                roll_value = self.config.MAX_ANGLE_COMBO
-        roll_value = max(-17, min(roll_value, 17))
-        pitch_value = max(-9, min(pitch_value, 9))
-        #final1 & final2
-        # VasenServo = 13.7504 + 1.8306*pitch_value - 0.8116*roll_value + 0.0046*math.pow(pitch_value, 2) - 0.0060*pitch_value*roll_value + 0.0009*math.pow(roll_value, 2)
-        # OikeaServo = 13.5803 + 1.8614*pitch_value + 0.7981*roll_value + 0.0058*math.pow(pitch_value, 2) + 0.0052*pitch_value*roll_value + 0.0012*math.pow(roll_value, 2)
-        # final1 mirrored
-        VasenServo = 13.6775 + 1.8464*pitch_value - 0.8026*roll_value + 0.0053*math.pow(pitch_value, 2) - 0.0050*pitch_value*roll_value +  0.0011*math.pow(roll_value, 2)
-        OikeaServo = 13.6775 + 1.8464*pitch_value + 0.8026*roll_value + 0.0053*math.pow(pitch_value, 2) + 0.0050*pitch_value*roll_value +  0.0011*math.pow(roll_value, 2)
-       
-        return VasenServo, OikeaServo
+        ### unreachable poses -> nearest pose both actuators can reach
+        pitch_value, roll_value = get_envelope(self.config).project(pitch_value, roll_value)
+        ### coefficient sets are versioned in settings/kinematics.json
+        return get_model(self.config).revs(pitch_value, roll_value)
     except Exception as e:
         self.logger.error(f"soemthing went wrong in trying to calculate modbuscntrl vals")
         return None
 
-def validate_dead_bandwidth(self,delta_revs) -> bool:
-    """Returns True if delta revs is more than specified dead bandwidth"""
+def validate_dead_bandwidth(self,delta_revs, bandwidths=None) -> bool:
+    """Returns True if delta revs is more than specified dead bandwidth,
+    bandwidths is an optional (left, right) override of DEADBANDREVS"""
     left_delta_revs, right_delta_revs = delta_revs
+    left_bandwidth, right_bandwidth = bandwidths or (self.config.DEADBANDREVS, self.config.DEADBANDREVS)
     updated_values = [False,False]
 
-    if self.config.DEADBANDREVS < left_delta_revs:
+    if left_bandwidth < left_delta_revs:
         updated_values[0] = True
-    if self.config.DEADBANDREVS < right_delta_revs:
+    if right_bandwidth < right_delta_revs:
         updated_values[1] = True
     return updated_values
 
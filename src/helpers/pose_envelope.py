@@ -0,0 +1,155 @@
+"""
+Feasible pose envelope, the pitch/roll region where both actuators stay within
+POS_MIN_REVS-POS_MAX_REVS under the kinematics model, inside the
+MAX_PITCH/MAX_ROLL box. The nearest feasible pose of every point of a grid over
+the box is computed once, infeasible poses are then projected in O(1) by
+bilinear interpolation of the grid. Feasible poses pass unchanged.
+"""
+import numpy as np
+from helpers.kinematics_model import get_model
+
+FEASIBLE_TOLERANCE = 1e-9
+
+def _constraints(config) -> list:
+    """g(pitch, roll) <= 0 constraints as functions returning (g, dg/dpitch, dg/droll)"""
+    model = get_model(config)
+    constraints = []
+    for actuator in (0, 1): # left, right
+        for side, limit in ((-1, config.POS_MIN_REVS), (1, config.POS_MAX_REVS)):
+            def constraint(pitch, roll, actuator=actuator, side=side, limit=limit):
+                revs = model.revs(pitch, roll)[actuator]
+                jacobian = model.jacobian(pitch, roll)
+                return side*(revs - limit), side*jacobian[2*actuator], side*jacobian[2*actuator + 1]
+            constraints.append(constraint)
+    for limit, is_pitch in ((config.MAX_PITCH, True), (config.MAX_ROLL, False)):
+        for side in (-1, 1):
+            def constraint(pitch, roll, limit=limit, is_pitch=is_pitch, side=side):
+                value = pitch if is_pitch else roll
+                one = np.ones_like(value)
+                return (side*value - limit, side*one if is_pitch else 0*one, 0*one if is_pitch else side*one)
+            constraints.append(constraint)
+    return constraints
+
+def _is_feasible(pitch, roll, constraints):
+    feasible = np.ones(np.shape(pitch), dtype=bool)
+    for constraint in constraints:
+        feasible &= constraint(pitch, roll)[0] <= FEASIBLE_TOLERANCE
+    return feasible
+
+def _foot(pitch, roll, constraint, iterations=6):
+    """Closest point of the g = 0 curve, the limits are near straight lines
+    so relinearizing a few times converges"""
+    x_pitch, x_roll = pitch, roll
+    for _ in range(iterations):
+        value, gradient_pitch, gradient_roll = constraint(x_pitch, x_roll)
+        scale = (value + gradient_pitch*(pitch - x_pitch) + gradient_roll*(roll - x_roll)) / (gradient_pitch*gradient_pitch + gradient_roll*gradient_roll)
+        x_pitch, x_roll = pitch - scale*gradient_pitch, roll - scale*gradient_roll
+    return x_pitch, x_roll
+
+def _vertices(constraints) -> list:
+    """Feasible intersections of two constraint curves"""
+    vertices = []
+    for a in range(len(constraints)):
+        for b in range(a + 1, len(constraints)):
+            pitch, roll = np.zeros(1), np.zeros(1)
+            for _ in range(30):
+                value_a, pitch_a, roll_a = constraints[a](pitch, roll)
+                value_b, pitch_b, roll_b = constraints[b](pitch, roll)
+                det = pitch_a*roll_b - roll_a*pitch_b
+                if abs(det[0]) < 1e-12:
+                    break
+                pitch, roll = pitch - (value_a*roll_b - roll_a*value_b) / det, roll - (pitch_a*value_b - value_a*pitch_b) / det
+            else:
+                if _is_feasible(pitch, roll, constraints)[0]:
+                    vertices.append((pitch[0], roll[0]))
+    return vertices
+
+def _nearest_feasible(pitch, roll, config):
+    """The nearest feasible point is either the closest point of a single
+    constraint curve or a vertex of the envelope, the nearest feasible candidate wins"""
+    constraints = _constraints(config)
+    feasible = _is_feasible(pitch, roll, constraints)
+    best_pitch = np.where(feasible, pitch, np.nan)
+    best_roll = np.where(feasible, roll, np.nan)
+    best = np.where(feasible, 0.0, np.inf)
+    candidates = [_foot(pitch, roll, constraint) for constraint in constraints]
+    candidates += [(np.full_like(pitch, vertex[0]), np.full_like(roll, vertex[1])) for vertex in _vertices(constraints)]
+    for candidate_pitch, candidate_roll in candidates:
+        distance = (candidate_pitch - pitch)**2 + (candidate_roll - roll)**2
+        better = (distance < best) & _is_feasible(candidate_pitch, candidate_roll, constraints)
+        best = np.where(better, distance, best)
+        best_pitch = np.where(better, candidate_pitch, best_pitch)
+        best_roll = np.where(better, candidate_roll, best_roll)
+    return best_pitch, best_roll
+
+class PoseEnvelope():
+    """step is the grid resolution in degrees"""
+    def __init__(self, config, step=0.1):
+        self.model = get_model(config)
+        self.min_revs = config.POS_MIN_REVS
+        self.max_revs = config.POS_MAX_REVS
+        self.max_pitch = config.MAX_PITCH
+        self.max_roll = config.MAX_ROLL
+        self.step = step
+        self.inv_step = 1 / step
+        self.pitch_size = int(round(2 * self.max_pitch / step)) + 1
+        self.roll_size = int(round(2 * self.max_roll / step)) + 1
+
+        pitch = -self.max_pitch + step * np.arange(self.pitch_size)
+        roll = -self.max_roll + step * np.arange(self.roll_size)
+        pitch, roll = np.meshgrid(pitch, roll, indexing="ij")
+        self.pitch_table, self.roll_table = _nearest_feasible(pitch, roll, config)
+        ### flat lists for the scalar path
+        self._pitch = self.pitch_table.ravel().tolist()
+        self._roll = self.roll_table.ravel().tolist()
+
+    def is_feasible(self, pitch, roll) -> bool:
+        left, right = self.model.revs(pitch, roll)
+        return self.min_revs <= left <= self.max_revs and self.min_revs <= right <= self.max_revs
+
+    def project(self, pitch, roll) -> tuple:
+        """Nearest feasible (pitch, roll), the pose itself when it is feasible"""
+        pitch = max(-self.max_pitch, min(pitch, self.max_pitch))
+        roll = max(-self.max_roll, min(roll, self.max_roll))
+        if self.is_feasible(pitch, roll):
+            return pitch, roll
+        fi = (pitch + self.max_pitch) * self.inv_step
+        fj = (roll + self.max_roll) * self.inv_step
+        i = min(int(fi), self.pitch_size - 2)
+        j = min(int(fj), self.roll_size - 2)
+        t = fi - i
+        u = fj - j
+        k = i * self.roll_size + j
+        k1 = k + self.roll_size
+        table = self._pitch
+        pitch = (table[k]*(1 - t) + table[k1]*t)*(1 - u) + (table[k + 1]*(1 - t) + table[k1 + 1]*t)*u
+        table = self._roll
+        roll = (table[k]*(1 - t) + table[k1]*t)*(1 - u) + (table[k + 1]*(1 - t) + table[k1 + 1]*t)*u
+        return pitch, roll
+
+    def project_batch(self, pitch, roll) -> tuple:
+        """project for arrays, same results as the scalar path"""
+        pitch = np.clip(np.asarray(pitch, dtype=np.float64), -self.max_pitch, self.max_pitch)
+        roll = np.clip(np.asarray(roll, dtype=np.float64), -self.max_roll, self.max_roll)
+        left, right = self.model.revs(pitch, roll)
+        feasible = (self.min_revs <= left) & (left <= self.max_revs) & (self.min_revs <= right) & (right <= self.max_revs)
+        fi = (pitch + self.max_pitch) * self.inv_step
+        fj = (roll + self.max_roll) * self.inv_step
+        i = np.minimum(fi.astype(np.intp), self.pitch_size - 2)
+        j = np.minimum(fj.astype(np.intp), self.roll_size - 2)
+        t = fi - i
+        u = fj - j
+        projected = []
+        for table in (self.pitch_table, self.roll_table):
+            projected.append((table[i, j]*(1 - t) + table[i + 1, j]*t)*(1 - u) + (table[i, j + 1]*(1 - t) + table[i + 1, j + 1]*t)*u)
+        return np.where(feasible, pitch, projected[0]), np.where(feasible, roll, projected[1])
+
+_envelopes = {}
+
+def get_envelope(config) -> PoseEnvelope:
+    """Envelope cached per set of limits and kinematics model"""
+    key = (config.POS_MIN_REVS, config.POS_MAX_REVS, config.MAX_PITCH, config.MAX_ROLL, get_model(config).key)
+    envelope = _envelopes.get(key)
+    if envelope is None:
+        envelope = _envelopes[key] = PoseEnvelope(config)
+    return envelope
@@ -0,0 +1,35 @@
+"""
+Refits the kinematics polynomial to calibration captures (action=calibration)
+and adds it to the coefficient file as a new version. The hub loads the active
+version at startup.
+Run from the src directory:
+    python refit_kinematics.py calibration/capture_1.npz calibration/capture_2.npz --order 2 --activate
+"""
+import argparse
+import json
+from pathlib import Path
+import numpy as np
+from helpers.kinematics_model import load_model, refit_model, save_model
+from services.calibration_recorder import load_captures
+from settings.motors_config import MotorConfig
+
+def refit(paths, order, file, activate) -> dict:
+    samples = load_captures(paths)
+    model = refit_model(samples["pitch"], samples["roll"], samples["left_revs"], samples["right_revs"],
+                        order=order, source=", ".join(Path(path).name for path in paths))
+    active = load_model(file)
+    left, right = active.revs(samples["pitch"], samples["roll"])
+    active_rms = float(np.sqrt(np.mean(np.concatenate([left - samples["left_revs"], right - samples["right_revs"]])**2)))
+    version = save_model(file, model, activate=activate)
+    return {"samples": len(samples["time"]), "version": version, "order": order, "activated": activate,
+            "rms_revs": model.rms_revs, "active_version": active.version, "active_rms_revs": active_rms,
+            "left": model.left, "right": model.right}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("captures", nargs="+", help="calibration capture .npz files")
+    parser.add_argument("--order", type=int, default=2, help="polynomial order")
+    parser.add_argument("--file", default=MotorConfig.KINEMATICS_FILE, help="coefficient file")
+    parser.add_argument("--activate", action="store_true", help="make the new version the active one")
+    args = parser.parse_args()
+    print(json.dumps(refit(args.captures, args.order, args.file, args.activate), indent=2))
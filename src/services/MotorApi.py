@@ -4,15 +4,28 @@ from utils.utils import IEG_MODE_bitmask_default
 import asyncio
 from utils.utils import setup_logger
 from helpers.fault_helpers import validate_fault_register
-from time import time
-from utils.utils import is_nth_bit_on, convert_to_revs, convert_vel_rpm_revs, convert_acc_rpm_revs, bit_high_low_both, registers_convertion, convert_val_into_format
+from time import time, perf_counter
+from utils.utils import is_nth_bit_on, convert_to_revs, convert_vel_rpm_revs, convert_acc_rpm_revs, bit_high_low_both
+from helpers.forward_kinematics import ForwardKinematics
+from helpers.pose_envelope import get_envelope
 from helpers.motor_api_helper import should_update_vel, calc_vel_proportional_scale, calc_delta_revs, update_previous_revs, validate_dead_bandwidth,calculate_target_revs, get_register_values, calculate_motor_modbuscntrl_vals, clamp_target_revs
+from services.read_planner import plan_reads, slice_block
+from services.register_shadow import RegisterShadow
+from services.retry_policies import DeadlinePolicy, BackoffPolicy, EscalatePolicy
+from services.modbus_transport import ModbusResponse, WRITE_MULTIPLE_REGISTERS
+from utils.instrumentation import span, timed
+from utils.fixed_point import UCUR16, UCUR32, VOLT32
 import math
 import logging
 
+### returned in place of a drive response when the write was elided
+ELIDED_WRITE = ModbusResponse(WRITE_MULTIPLE_REGISTERS)
+RTT_ALPHA = 0.1 # smoothing of the measured modbus round trip
+
 class MotorApi():
-    def __init__(self, modbus_clients,config=MotorConfig(), retry_delay = 0.2, max_retries = 10, logger=None):
+    def __init__(self, modbus_clients,config=MotorConfig(), retry_delay = 0.2, max_retries = 10, logger=None, on_stop_escalate=None):
         self.logger = setup_logger(logger)
+        self.modbus_clients = modbus_clients
         self.client_right = modbus_clients.client_right
         self.client_left = modbus_clients.client_left
         self.retry_delay = retry_delay
@@ -20,150 +33,239 @@ class MotorApi():
         self.config = config
         self.analog_mode=True
         self.previous_revs = [14,14] # Left, right
+        self.deadband = None # DeadbandFilter of the rotate path
+        self.forward_kinematics = ForwardKinematics(self.config)
+        ### built here so the first rotate doesn't pay for it
+        self.pose_envelope = get_envelope(self.config)
+        self.last_target_revs = [None, None] # revs of the last written position setpoint of any path, left, right
+        self.last_modbuscntrl = [None, None] # last written analog modbus control values, left, right
+        self.modbus_rtt = 0.0 # smoothed round trip of the requests that reached the drives
+        self.max_modbus_rtt = 0.0
+        self.rtt_samples = 0
         self.prev_vels = [None, None]
+        self._read_plans = {}
+        self.telemetry_registers = {
+            "board_tmp": (self.config.BOARD_TMP, 1),
+            "actuator_tmp": (self.config.ACTUATOR_TMP, 1),
+            "icontinuous": (self.config.ICONTINUOUS, 2),
+            "vbus": (self.config.VBUS, 2),
+        }
+        self.analog_parameter_registers = {
+            "input_channel": (self.config.ANALOG_INPUT_CHANNEL_REGISTER, 1),
+            "pos_min": (self.config.ANALOG_POSITION_MINIMUM_REGISTER, 2),
+            "pos_max": (self.config.ANALOG_POSITION_MAXIMUM_REGISTER, 2),
+            "vel_max": (self.config.ANALOG_VEL_MAXIMUM_REGISTER, 2),
+            "acc_max": (self.config.ANALOG_ACCELERATION_MAXIMUM_REGISTER, 2),
+        }
+        ### registers that hold state, writes matching the last known value are skipped.
+        ### ANALOG_VEL_MAXIMUM is left out, the velocity controller process writes it too
+        self.shadow = RegisterShadow(shadowed_addresses=[
+            self.config.ANALOG_INPUT_CHANNEL_REGISTER,
+            self.config.ANALOG_POSITION_MINIMUM_REGISTER,
+            self.config.ANALOG_POSITION_MAXIMUM_REGISTER,
+            self.config.ANALOG_ACCELERATION_MAXIMUM_REGISTER,
+            self.config.ANALOG_MODBUS_CNTRL_REGISTER,
+            self.config.COMMAND_MODE,
+            self.config.HOST_VEL_MAXIMUM_REGISTER,
+            self.config.HOST_ACCELERATION_MAXIMUM_REGISTER,
+            self.config.HOST_CURRENT_MAXIMUM_REGISTER,
+            self.config.HOST_POSITION_REGISTER,
+        ])
+        self._connection_generation = getattr(modbus_clients, "connection_generation", 0)
+        ### each operation class declares how its failures are retried
+        self.retry_policies = {
+            "setpoint": DeadlinePolicy(deadline=self.config.SETPOINT_DEADLINE, retry_delay=self.config.SETPOINT_RETRY_DELAY, logger=self.logger),
+            "config": BackoffPolicy(base_delay=self.config.BACKOFF_BASE_DELAY, max_delay=self.config.BACKOFF_MAX_DELAY, max_retries=5, jitter=self.config.BACKOFF_JITTER, logger=self.logger),
+            "homing": BackoffPolicy(base_delay=self.config.BACKOFF_BASE_DELAY, max_delay=self.config.BACKOFF_MAX_DELAY, max_retries=max_retries, jitter=self.config.BACKOFF_JITTER, logger=self.logger),
+            "read": BackoffPolicy(base_delay=self.config.BACKOFF_BASE_DELAY, max_delay=self.config.BACKOFF_MAX_DELAY, max_retries=max_retries, jitter=self.config.BACKOFF_JITTER, logger=self.logger),
+            "stop": EscalatePolicy(immediate_retries=self.config.STOP_IMMEDIATE_RETRIES, on_escalate=on_stop_escalate, logger=self.logger),
+        }
     
-    async def _write_registers_left(self, address, vals):
-        return await self.client_left.write_registers(
-            address=address,
-            values=vals,
-            slave=self.config.SLAVE_ID
-        )
-    async def _write_registers_right(self, address, vals):
-        return await self.client_right.write_registers(
-            address=address,
-            values=vals,
-            slave=self.config.SLAVE_ID
-        )
-    async def _read_registers_left(self, address, count):
-        return await self.client_left.read_holding_registers(
+    def invalidate_shadow(self, reason):
+        self.logger.info(f"Invalidating register shadow cache: {reason}")
+        self.shadow.invalidate()
+
+    def get_shadow_stats(self) -> dict:
+        return self.shadow.get_stats()
+
+    def _check_connection_generation(self):
+        """Drops the shadow cache if the clients have reconnected since the last write"""
+        generation = getattr(self.modbus_clients, "connection_generation", 0)
+        if generation != self._connection_generation:
+            self._connection_generation = generation
+            self.invalidate_shadow("reconnect")
+
+    async def _write_registers(self, side, address, vals):
+        self._check_connection_generation()
+        if self.shadow.matches(side, address, vals):
+            return ELIDED_WRITE
+        client = self.client_left if side == "left" else self.client_right
+        started = perf_counter()
+        with span("modbus.write"):
+            response = await client.write_registers(
                 address=address,
-                count=count,
+                values=vals,
                 slave=self.config.SLAVE_ID
             )
+        if not response.isError():
+            self._record_rtt(started)
+            self._written(side, address, vals)
+        return response
+
+    def external_write(self, side, address, vals):
+        """Another process wrote vals to the drive through the bus owner gateway"""
+        if address == self.config.IEG_MODE_REGISTER and vals[0] & self.config.RESET_FAULT_VALUE:
+            self.invalidate_shadow("fault reset by another process")
+        self._written(side, address, vals)
+
+    def _written(self, side, address, vals):
+        """Bookkeeping of a write the drive acknowledged, whichever path (rotate, trajectory, modbusvalues) made it"""
+        self.shadow.update(side, address, vals)
+        if address == self.config.ANALOG_MODBUS_CNTRL_REGISTER:
+            i = 0 if side == "left" else 1
+            self.last_modbuscntrl[i] = vals[0]
+            self.last_target_revs[i] = self.config.POS_MIN_REVS + vals[0] / self.config.MODBUSCTRL_MAX * (self.config.POS_MAX_REVS - self.config.POS_MIN_REVS)
+        elif address == self.config.HOST_POSITION_REGISTER:
+            self.last_target_revs[0 if side == "left" else 1] = convert_to_revs(vals)
+
+    def _record_rtt(self, started):
+        rtt = perf_counter() - started
+        self.modbus_rtt = rtt if not self.rtt_samples else self.modbus_rtt + RTT_ALPHA * (rtt - self.modbus_rtt)
+        self.max_modbus_rtt = max(self.max_modbus_rtt, rtt)
+        self.rtt_samples += 1
+
+    def get_rtt_stats(self) -> dict:
+        return {"rtt_s": self.modbus_rtt, "max_rtt_s": self.max_modbus_rtt, "samples": self.rtt_samples}
+
+    async def _write_registers_left(self, address, vals):
+        return await self._write_registers("left", address, vals)
+    async def _write_registers_right(self, address, vals):
+        return await self._write_registers("right", address, vals)
+    async def _read_registers_left(self, address, count):
+        started = perf_counter()
+        with span("modbus.read"):
+            response = await self.client_left.read_holding_registers(
+                    address=address,
+                    count=count,
+                    slave=self.config.SLAVE_ID
+                )
+        if not response.isError():
+            self._record_rtt(started)
+        return response
     async def _read_registers_right(self, address, count):
-        return await self.client_right.read_holding_registers(
-                address=address,
-                count=count,
-                slave=self.config.SLAVE_ID
-            )
+        started = perf_counter()
+        with span("modbus.read"):
+            response = await self.client_right.read_holding_registers(
+                    address=address,
+                    count=count,
+                    slave=self.config.SLAVE_ID
+                )
+        if not response.isError():
+            self._record_rtt(started)
+        return response
     def check_gather_result(self, results):
         left_result, right_result = results
-        success_left = False
-        success_right = False
-        
-        if not isinstance(left_result, Exception):
-            success_left = True
-
-        if not isinstance(right_result, Exception):
-            success_right = True
-        return success_left, success_right 
-
-    async def retry_wrapper(self, func, description, address, vals, max_retries=5):
-            success = False
-            attempt=0
-            while max_retries > attempt:
-                if not success:
-                    # response_left = await self._write_registers_left(vals=left_vals, address=address)
-                    response = await func(address=address, vals=vals)
-
-                if response.isError():
-                    attempt += 1
-                    self.logger.error(f"Failed to {description}. Attempt {attempt}")
-                else:
-                    success = True
+        return self._is_success(left_result), self._is_success(right_result)
 
-                if success:
-                    self.logger.info(f"succesfully {description} motor!")
-                    return True
-                
-                # Delay between retries
-                await asyncio.sleep(self.retry_delay)     
-            self.logger.error(f"Failed to {description}")
-            return False
+    def get_retry_stats(self) -> dict:
+        return {name: policy.get_stats() for name, policy in self.retry_policies.items()}
+
+    def _is_success(self, result) -> bool:
+        return not isinstance(result, Exception) and not result.isError()
 
-    async def _write_left_wrapper(self, left_vals, address, description="write to left motors"):
-            return await self.retry_wrapper(self._write_registers_left, description=description, address=address, vals=left_vals)
+    async def retry_wrapper(self, func, description, address, vals, policy="config"):
+        async def attempt():
+            return self._is_success(await func(address=address, vals=vals))
+        return await self.retry_policies[policy].run(attempt, description)
 
-    async def _write_right_wrapper(self, right_vals, address, description="write to right motors"):
-        return await self.retry_wrapper(self._write_registers_right, description=description, address=address, vals=right_vals)
+    async def _write_left_wrapper(self, left_vals, address, description="write to left motors", policy="config"):
+            return await self.retry_wrapper(self._write_registers_left, description=description, address=address, vals=left_vals, policy=policy)
+
+    async def _write_right_wrapper(self, right_vals, address, description="write to right motors", policy="config"):
+        return await self.retry_wrapper(self._write_registers_right, description=description, address=address, vals=right_vals, policy=policy)
+
+    @timed("MotorApi._write_both")
+    async def _write_both(self, address, description, left_vals=None, right_vals=None, policy="config") -> bool:
+        """Writes to both motors in parallel, on failure only the failed
+        side is retried according to the operation classes retry policy"""
+        pending = {side: vals for side, vals in (("left", left_vals), ("right", right_vals)) if vals is not None}
+
+        async def attempt():
+            sides = list(pending)
+            results = await asyncio.gather(*(self._write_registers(side, address, pending[side]) for side in sides), return_exceptions=True)
+            for side, result in zip(sides, results):
+                if self._is_success(result):
+                    del pending[side]
+            return not pending
 
-    async def _write_both(self, address, description, left_vals=None, right_vals=None) -> bool:
         try:
-            ### tries to _write_both to both registers in parallel first
-            results = await asyncio.gather(self._write_registers_left(address, vals=left_vals), self._write_registers_right(address=address, vals=right_vals), return_exceptions=True)
-            success_left, success_right = self.check_gather_result(results)
-            if success_left and success_right:
-                return True
-            
-            r_result = await self.retry_wrapper(self._write_registers_right, address=address, vals=right_vals, description=f"Failed to {description} on right motor")
-            l_result = await self.retry_wrapper(self._write_registers_left, address=address, vals=right_vals, description=f"Failed to {description} on left motor")
-            if not r_result or not l_result:
-                return False
+            return await self.retry_policies[policy].run(attempt, description)
+        except Exception as e:
+            self.logger.error(f"Unexpected error while {description}: {str(e)}")
+            return False
+
+    def _is_pipelined(self) -> bool:
+        return hasattr(self.client_left, "submit_write") and hasattr(self.client_right, "submit_write")
+
+    async def _write_batch(self, writes, description) -> bool:
+        """Writes independent (address, left_vals, right_vals) writes to both motors.
+        With a pipelined transport all of them are submitted at once and only
+        the failed ones are retried, otherwise they are written one after another"""
+        if not self._is_pipelined():
+            for address, left_vals, right_vals in writes:
+                if not await self._write_both(address=address, left_vals=left_vals, right_vals=right_vals, description=description):
+                    return False
+            return True
+
+        try:
+            self._check_connection_generation()
+            pending = []
+            for address, left_vals, right_vals in writes:
+                for side, client, vals in (("left", self.client_left, left_vals), ("right", self.client_right, right_vals)):
+                    if self.shadow.matches(side, address, vals):
+                        continue
+                    pending.append((side, address, vals, client.submit_write(address, vals, slave=self.config.SLAVE_ID)))
+            results = await asyncio.gather(*(future for _, _, _, future in pending), return_exceptions=True)
+
+            for (side, address, vals, _), result in zip(pending, results):
+                if isinstance(result, Exception) or result.isError():
+                    write_func = self._write_registers_left if side == "left" else self._write_registers_right
+                    if not await self.retry_wrapper(write_func, address=address, vals=vals, description=f"{description} on {side} motor"):
+                        return False
+                else:
+                    self._written(side, address, vals)
             return True
         except Exception as e:
             self.logger.error(f"Unexpected error while {description}: {str(e)}")
             return False
-    async def _read(self, address, description, count=2, log=True) -> Union[tuple, bool]:
+
+    @timed("MotorApi._read")
+    async def _read(self, address, description, count=2, log=True, policy="read") -> Union[tuple, bool]:
         """Reads the specified register addresses values and returns them
         as a tuple (left, right) or False if the operation was not successful"""
         try:
-            attempt_left = 0
-            attempt_right = 0
-            success_left = False
-            success_right = False
-            max_retries = self.max_retries
-
-            ### tries to _read to both registers in parallel first
-            results = await asyncio.gather(self._read_registers_left(address, count=count), self._read_registers_right(address=address, count=count), return_exceptions=True)
-            success_left, success_right = self.check_gather_result(results)
-            if success_left and success_right:
-                if log:
-                    self.logger.info(f"Successfully {description} both motors")
-                left_vals, right_vals = get_register_values(results)
-                if count==1:
-                    return (left_vals[0], right_vals[0])
-                else:
-                    return (left_vals, right_vals)
-
-            while max_retries > attempt_left and max_retries > attempt_right:
-                # _write_both to left motor if not yet successful
-                if not success_left:
-                    response_left = await self._read_registers_left(address=address, count=count)
-                    if response_left.isError():
-                        attempt_left += 1
-                        self.logger.error(f"Failed to {description} on left motor. Attempt {attempt_left}/{max_retries}")
-                    else:
-                        success_left = True
-                        if log:
-                            self.logger.info(f"Successfully {description} on left motor")
-
-                # _read from right motor if not yet successful
-                if not success_right:
-                    response_right = await self._read_registers_right(address=address, count=count)
-                    if response_right.isError():
-                        attempt_right += 1
-                        self.logger.error(f"Failed to {description} on right motor. Attempt {attempt_right}/{max_retries}")
-                    else:
-                        success_right = True
-                        if log:
-                            self.logger.info(f"Successfully {description} on right motor")
-
-                # Break if both are successful
-                if success_left and success_right:
-                    break
-
-                # Delay between retries
-                await asyncio.sleep(self.retry_delay)
-
-            if not success_left or not success_right:
-                self.logger.error(f"Failed to {description} on both motors. Left: {success_left}, Right: {success_right}")
+            responses = {}
+
+            ### reads both motors in parallel, retries only the side that failed
+            async def attempt():
+                sides = [side for side in ("left", "right") if side not in responses]
+                reads = [self._read_registers_left(address=address, count=count) if side == "left" else self._read_registers_right(address=address, count=count) for side in sides]
+                results = await asyncio.gather(*reads, return_exceptions=True)
+                for side, result in zip(sides, results):
+                    if self._is_success(result):
+                        responses[side] = result
+                return len(responses) == 2
+
+            if not await self.retry_policies[policy].run(attempt, description):
+                self.logger.error(f"Failed to {description} on both motors. Left: {'left' in responses}, Right: {'right' in responses}")
                 return False
 
             if log:
                 self.logger.info(f"Successfully {description} on both motors")
-            
-            
-            left_vals, right_vals = get_register_values((response_left, response_right))
+
+            left_vals, right_vals = get_register_values((responses["left"], responses["right"]))
+            self.shadow.update("left", address, left_vals)
+            self.shadow.update("right", address, right_vals)
             if count==1:
                 return (left_vals[0], right_vals[0])
             else:
@@ -172,12 +274,47 @@ class MotorApi():
         except Exception as e:
             self.logger.error(f"Unexpected error while reading motor REVS: {str(e)}")
             return False
+
+    def _get_read_plan(self, registers):
+        key = tuple(sorted(registers.items()))
+        plan = self._read_plans.get(key)
+        if plan is None:
+            plan = plan_reads(registers, max_gap=self.config.READ_PLANNER_MAX_GAP)
+            self._read_plans[key] = plan
+        return plan
+
+    async def _read_planned(self, registers, description, log=True) -> Union[dict, bool]:
+        """Reads the named registers {name: (address, count)} from both motors
+        with as few block reads as possible. Returns {name: (left, right)} where
+        single register values are ints and multi register values lists,
+        or False if any of the block reads was not successful"""
+        plan = self._get_read_plan(registers)
+        results = await asyncio.gather(*(self._read(address=block.address, count=block.count, description=description, log=log) for block in plan))
+
+        values = {}
+        for block, vals in zip(plan, results):
+            if not vals:
+                return False
+            left_vals, right_vals = vals
+            if block.count == 1:
+                left_vals, right_vals = [left_vals], [right_vals]
+
+            left_slices = slice_block(block, left_vals)
+            right_slices = slice_block(block, right_vals)
+            for name, _, count in block.members:
+                if count == 1:
+                    values[name] = (left_slices[name][0], right_slices[name][0])
+                else:
+                    values[name] = (left_slices[name], right_slices[name])
+        return values
     async def reset_motors(self) -> bool:
         """ 
         Removes all temporary settings from both motors
         and goes back to default ones
         """
-        return await self._write_both(address=self.config.SYSTEM_COMMAND_REGISTER, left_vals=[self.config.RESTART_VALUE], right_vals=[self.config.RESTART_VALUE], description="force a software power-on restart of the drive")
+        result = await self._write_both(address=self.config.SYSTEM_COMMAND_REGISTER, left_vals=[self.config.RESTART_VALUE], right_vals=[self.config.RESTART_VALUE], description="force a software power-on restart of the drive")
+        self.invalidate_shadow("motors reset")
+        return result
     async def get_recent_fault(self, count=1) -> tuple[Optional[int], Optional[int]]:
         """
         _read fault registers from both clients.
@@ -218,7 +355,7 @@ class MotorApi():
         Attempts to stop both motors by writing to the IEG_MOTION_REGISTER register.
         Returns True if successful, False if failed after retries.
         """
-        return await self._write_both(address=self.config.IEG_MOTION_REGISTER, left_vals=[self.config.STOP_VALUE],right_vals=[self.config.STOP_VALUE], description="Stop motors")
+        return await self._write_both(address=self.config.IEG_MOTION_REGISTER, left_vals=[self.config.STOP_VALUE],right_vals=[self.config.STOP_VALUE], description="Stop motors", policy="stop")
     
     async def continue_motors(self) -> bool:
         """
@@ -230,11 +367,11 @@ class MotorApi():
     async def home(self) -> bool:
         try:
             ### Reset IEG_MOTION_REGISTER bit to 0 so we can trigger rising edge with our home command
-            if not await self._write_both(address=self.config.IEG_MOTION_REGISTER, left_vals=[0],right_vals=[0], description="reset IEG_MOTION_REGISTER to 0"):
+            if not await self._write_both(address=self.config.IEG_MOTION_REGISTER, left_vals=[0],right_vals=[0], description="reset IEG_MOTION_REGISTER to 0", policy="homing"):
                 return False
                 
             ### Initiate homing command
-            if not await self._write_both(left_vals=[self.config.HOME_VALUE],right_vals=[self.config.HOME_VALUE], address=self.config.IEG_MOTION_REGISTER, description="initiate homing command"): 
+            if not await self._write_both(left_vals=[self.config.HOME_VALUE],right_vals=[self.config.HOME_VALUE], address=self.config.IEG_MOTION_REGISTER, description="initiate homing command", policy="homing"): 
                 return False
             
             ### homing order was success for both motos make a poller coroutine to poll when the homing is done.
@@ -256,7 +393,7 @@ class MotorApi():
                 # Success
                 if ishomed_right and ishomed_left:
                     self.logger.info(f"Both motors homes successfully:")
-                    await self._write_both(address=self.config.IEG_MOTION_REGISTER, left_vals=[0], right_vals=[0], description="reset IEG_MOTION_REGISTER to 0")
+                    await self._write_both(address=self.config.IEG_MOTION_REGISTER, left_vals=[0], right_vals=[0], description="reset IEG_MOTION_REGISTER to 0", policy="homing")
                     return True
                 
                 await asyncio.sleep(1)
@@ -400,7 +537,7 @@ class MotorApi():
             Returns False if the operation is not successful.
         """
         return await self._read(address=self.config.PFEEDBACK_POSITION_REGISTER, description="_read current REVS", count=2)
-    async def set_analog_modbus_cntrl(self, values: Tuple[int, int]) -> bool:
+    async def set_analog_modbus_cntrl(self, values: Tuple[int, int], policy="setpoint") -> bool:
         """
         Sets the analog input Modbus control value for both motors,
         where 0 makes the motor go to the analog_pos_min position
@@ -416,13 +553,13 @@ class MotorApi():
         assert value_left >= 0 and value_left <= 10000, "Modbus control value needs between 0-10000"
         assert value_right >= 0 and value_right <= 10000, "Modbus control value needs between 0-10000"
 
-        return await self._write_both(right_vals=[value_right], left_vals=[value_left], description="Set analog modbus control value", address=self.config.ANALOG_MODBUS_CNTRL_REGISTER)
+        return await self._write_both(right_vals=[value_right], left_vals=[value_left], description="Set analog modbus control value", address=self.config.ANALOG_MODBUS_CNTRL_REGISTER, policy=policy)
     async def set_host_position(self, values: Tuple[List,List]) -> bool:
             """
             Sets the host position values for both motors. 
             """
             values_left, values_right = values
-            return await self._write_both(different_values=True, right_vals=values_right, left_vals=values_left, description="Set host position values", address=self.config.HOST_POSITION_REGISTER)
+            return await self._write_both(right_vals=values_right, left_vals=values_left, description="Set host position values", address=self.config.HOST_POSITION_REGISTER, policy="setpoint")
     async def set_host_current(self, value: int) -> bool:
         """
         Sets the host maxium current that will override IPEAK_REGISTER value(15A as long as its below it) UCUR16 - 9.7.
@@ -498,7 +635,10 @@ class MotorApi():
         Returns:
             bool: True if successful for both motors, False otherwise.
         """
-        return await self._write_both(description="set IEG_MODE_REGISTER", left_vals=[IEG_MODE_bitmask_default(value)], right_vals=[IEG_MODE_bitmask_default(value)], address=self.config.IEG_MODE_REGISTER)
+        result = await self._write_both(description="set IEG_MODE_REGISTER", left_vals=[IEG_MODE_bitmask_default(value)], right_vals=[IEG_MODE_bitmask_default(value)], address=self.config.IEG_MODE_REGISTER)
+        if value & self.config.RESET_FAULT_VALUE:
+            self.invalidate_shadow("fault reset")
+        return result
     async def get_modbuscntrl_val(self) -> Union[tuple, bool]:
         """
         Gets the current revolutions of both motors and calculates with linear interpolation
@@ -548,26 +688,25 @@ class MotorApi():
         homed = await self.home()
         # homed = True
         if homed: 
-            ## Prepare motor parameters for operation
-            ### MAX POSITION LIMITS FOR BOTH MOTORS | 147 mm
-            if not await self.set_analog_pos_max(self.config.MAX_POS_DECIMAL, self.config.MAX_POS_WHOLE):
-                return False
-
-            ### MIN POSITION LIMITS FOR BOTH MOTORS || 2 mm
-            if not await self.set_analog_pos_min(self.config.MIN_POS_DECIMAL, self.config.MIN_POS_WHOLE):
-                return False
-
-            vals = convert_vel_rpm_revs(self.config.MAX_VEL)
-            if not await self.set_analog_vel_max(left_vals=vals, right_vals=vals):
-                return False
+            ### Read the current parameters so the ones already set on the drive are not written again
+            await self._read_planned(self.analog_parameter_registers, description="read analog operation parameters")
 
+            ## Prepare motor parameters for operation
+            ## these dont depend on each other so they are written as one batch
+            vel_vals = convert_vel_rpm_revs(self.config.MAX_VEL)
             ### UACC32 whole number split in 12.4 format
-            vals = convert_acc_rpm_revs(self.config.MAX_ACC)
-            if not await self.set_analog_acc_max(left_vals=vals, right_vals=vals):
-                return False
-
-            ## Analog input channel set to use modbusctrl (2)
-            if not await self.set_analog_input_channel(self.config.ANALOG_MODBUS_CNTRL_VALUE):
+            acc_vals = convert_acc_rpm_revs(self.config.MAX_ACC)
+            writes = [
+                ### MAX POSITION LIMITS FOR BOTH MOTORS | 147 mm
+                (self.config.ANALOG_POSITION_MAXIMUM_REGISTER, [self.config.MAX_POS_DECIMAL, self.config.MAX_POS_WHOLE], [self.config.MAX_POS_DECIMAL, self.config.MAX_POS_WHOLE]),
+                ### MIN POSITION LIMITS FOR BOTH MOTORS || 2 mm
+                (self.config.ANALOG_POSITION_MINIMUM_REGISTER, [self.config.MIN_POS_DECIMAL, self.config.MIN_POS_WHOLE], [self.config.MIN_POS_DECIMAL, self.config.MIN_POS_WHOLE]),
+                (self.config.ANALOG_VEL_MAXIMUM_REGISTER, vel_vals, vel_vals),
+                (self.config.ANALOG_ACCELERATION_MAXIMUM_REGISTER, acc_vals, acc_vals),
+                ## Analog input channel set to use modbusctrl (2)
+                (self.config.ANALOG_INPUT_CHANNEL_REGISTER, [self.config.ANALOG_MODBUS_CNTRL_VALUE], [self.config.ANALOG_MODBUS_CNTRL_VALUE]),
+            ]
+            if not await self._write_batch(writes, description="set analog operation parameters"):
                 return False
 
             response = await self.get_modbuscntrl_val()
@@ -576,7 +715,7 @@ class MotorApi():
             (position_client_left, position_client_right) = response
 
             # modbus cntrl 0-10k
-            if not await self.set_analog_modbus_cntrl((position_client_left, position_client_right)):
+            if not await self.set_analog_modbus_cntrl((position_client_left, position_client_right), policy="config"):
                 return False
 
             # # Finally - Ready for operation
@@ -627,7 +766,7 @@ class MotorApi():
                 return False
 
             ### set host current limit
-            if not await self.set_host_current(value=convert_val_into_format(5, format="9.7")):
+            if not await self.set_host_current(value=UCUR16.encode(5)):
                 return False
 
             # # Finally - Ready for operation
@@ -639,71 +778,121 @@ class MotorApi():
                 return False
             return True
         
-    async def rotate(self, pitch, roll):
+    async def rotate(self, pitch, roll, trace=None):
+        """trace is an optional dict that gets the perf_counter
+        timestamps after the kinematics and after the write"""
         if self.analog_mode: 
-            await self.rotate_analog(pitch, roll)
+            await self.rotate_analog(pitch, roll, trace)
         else:
-            await self.rotate_host(pitch, roll)
+            await self.rotate_host(pitch, roll, trace)
 
-    async def rotate_analog(self, pitch_value, roll_value):
+    async def rotate_analog(self, pitch_value, roll_value, trace=None):
         try:
             revs = calculate_target_revs(self,pitch_value=pitch_value, roll_value=roll_value)
-            modbuscntrl_left, modbuscntrl_right = calculate_motor_modbuscntrl_vals(self, left_revs=revs[0],
-                                                                                    right_revs=revs[1])            
-
-            await self.set_analog_modbus_cntrl((modbuscntrl_left, modbuscntrl_right))
+            await self._rotate_revs(revs, trace)
         except Exception as e:
             self.logger.error(f"Something went wrong trying to rotate the platform: {e}")
 
-    async def rotate_host(self, pitch_value, roll_value):
+    async def rotate_host(self, pitch_value, roll_value, trace=None):
         try:
             revs = calculate_target_revs(self,pitch_value=pitch_value, roll_value=roll_value)
-            positions = clamp_target_revs(revs[0], revs[1], config=self.config)
-            left_pos, right_pos = positions
-            await self.set_host_position((left_pos, right_pos))
+            await self._rotate_revs(revs, trace)
             self.previous_revs = revs
         except Exception as e:
             self.logger.error(f"Something went wrong trying to rotate the platform: {e}")
-            
+
+    async def _rotate_revs(self, revs, trace=None):
+        """Writes the rotate target revs, only to the drives that pass the deadband"""
+        if self.deadband is None:
+            await self._write_rotate_sides(revs, [True, True], trace)
+            return
+        ### serialized with the deadband flush of held targets
+        async with self.deadband.lock:
+            await self._write_rotate_sides(revs, self.deadband.filter(revs), trace)
+
+    async def _write_rotate_sides(self, revs, sides, trace):
+        if trace is not None:
+            trace["kinematics"] = perf_counter()
+        ### all suppressed counts as done, the deadband flushes a held target later
+        success = await self.write_revs_sides(revs, sides) if any(sides) else True
+        if self.deadband is not None:
+            if success:
+                self.deadband.written(sides, revs)
+            else:
+                self.deadband.failed(sides, revs)
+        if trace is not None:
+            trace["written"] = perf_counter()
+            trace["success"] = success
+
+    async def write_revs_sides(self, revs, sides) -> bool:
+        """Writes [left, right] target revs to the drives that are True in sides with the active command mode"""
+        left_revs, right_revs = revs
+        if self.analog_mode:
+            values = calculate_motor_modbuscntrl_vals(self, left_revs=left_revs, right_revs=right_revs)
+            address, description = self.config.ANALOG_MODBUS_CNTRL_REGISTER, "Set analog modbus control value"
+            left_vals, right_vals = [values[0]], [values[1]]
+        else:
+            address, description = self.config.HOST_POSITION_REGISTER, "Set host position values"
+            left_vals, right_vals = clamp_target_revs(left_revs, right_revs, config=self.config)
+        return await self._write_both(address=address, description=description, policy="setpoint",
+                                      left_vals=left_vals if sides[0] else None,
+                                      right_vals=right_vals if sides[1] else None)
+
+    async def write_revs_setpoint(self, left_revs, right_revs) -> bool:
+        """Writes actuator targets given in revs with the active command mode"""
+        try:
+            return await self.write_revs_sides((left_revs, right_revs), (True, True))
+        except Exception as e:
+            self.logger.error(f"Something went wrong writing the revs setpoint: {e}")
+            return False
+
+    async def get_attitude(self) -> Union[dict, bool]:
+        """Actual platform pitch/roll from the position feedback and the
+        tracking error against the last written target, in degrees"""
+        response = await self.get_current_revs()
+        if not response:
+            return False
+        left_revs, right_revs = convert_to_revs(response[0]), convert_to_revs(response[1])
+        pitch, roll = self.forward_kinematics.solve(left_revs, right_revs)
+        attitude = {"pitch": pitch, "roll": roll, "left_revs": left_revs, "right_revs": right_revs}
+        if None not in self.last_target_revs:
+            target_pitch, target_roll = self.forward_kinematics.solve(*self.last_target_revs)
+            attitude.update({"target_pitch": target_pitch, "target_roll": target_roll,
+                             "error_pitch": target_pitch - pitch, "error_roll": target_roll - roll})
+        return attitude
+
+    def get_deadband_stats(self) -> dict:
+        return self.deadband.get_stats() if self.deadband is not None else {}
+
     async def get_telemetry_data(self) -> Union[tuple, bool]:
         """Reads the motors current board tempereature,
         actuator temperature, continuous current and present VBUS voltage
         Returns:
             ((left_board_tmp, right_board_tmp), (left_actuator_tmp, right_actuator_tmp), (left_IC, right_IC), (left_VBUS, right_VBUS))
         """
-        vals = await self._read(address=self.config.BOARD_TMP, description="_read board temperature", count=1)
+        vals = await self._read_planned(self.telemetry_registers, description="_read telemetry registers")
         if not vals:
             return False
+
         ### 11.5
-        left_board_tmp, right_board_tmp = vals
+        left_board_tmp, right_board_tmp = vals["board_tmp"]
         left_board_tmp = bit_high_low_both(left_board_tmp, 5, "high")
         right_board_tmp = bit_high_low_both(right_board_tmp, 5, "high")
 
-        vals = await self._read(address=self.config.ACTUATOR_TMP, description="_read actuator temperature", count=1)
-        if not vals:
-            return False
         ### 13.3
-        left_actuator_tmp, right_actuator_tmp = vals
+        left_actuator_tmp, right_actuator_tmp = vals["actuator_tmp"]
         left_actuator_tmp = bit_high_low_both(left_actuator_tmp, 3, "high")
         right_actuator_tmp = bit_high_low_both(right_actuator_tmp, 3, "high")
 
-        vals = await self._read(address=self.config.ICONTINUOUS, description="_read present current ", count=2)
-        if not vals:
-            return False
-        
-        left_IC, right_IC = vals
-        left_VBUS = registers_convertion(left_IC, "9.23")
-        right_VBUS = registers_convertion(right_VBUS, "9.23")
-
-        vals = await self._read(address=self.config.VBUS, description="_read present VBUS voltage ", count=2)
-        ### 11.21
-        if not vals:
-            return False
-        left_VBUS, right_VBUS = vals
+        ### 9.23
+        left_IC, right_IC = vals["icontinuous"]
+        left_IC = UCUR32.decode(left_IC)
+        right_IC = UCUR32.decode(right_IC)
 
         ### Extract the high value part and deccimal part 11.21
-        left_VBUS = registers_convertion(left_VBUS, "11.21", signed=True)
-        right_VBUS = registers_convertion(right_VBUS, "11.21", signed=True)
+        left_VBUS, right_VBUS = vals["vbus"]
+        left_VBUS = VOLT32.decode(left_VBUS)
+        right_VBUS = VOLT32.decode(right_VBUS)
         
         return ((left_board_tmp, right_board_tmp), (left_actuator_tmp, right_actuator_tmp), (left_IC, right_IC), (left_VBUS, right_VBUS))
     
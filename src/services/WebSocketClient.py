@@ -2,11 +2,15 @@ import asyncio
 import websockets
 from websockets.exceptions import ConnectionClosed
 from settings.config import Config
+from utils.utils import extract_part
+from utils.binary_frames import encode_rotate
+from time import perf_counter
 
 config = Config()
 
 class WebSocketClient():
-    def __init__(self, logger, identity="unknown", uri=f"ws://localhost:{config.WEBSOCKET_SRV_PORT}", on_message=None, reconnect_interval=2.5, max_reconnect_attempt=10):
+    def __init__(self, logger, identity="unknown", uri=f"ws://localhost:{config.WEBSOCKET_SRV_PORT}", on_message=None, reconnect_interval=2.5, max_reconnect_attempt=10, binary_frames=False):
+        """binary_frames=True asks the server for binary rotate frames at identify"""
         self.uri = uri
         self.socket = None
         self.is_running = False
@@ -17,6 +21,8 @@ class WebSocketClient():
         self.reconnect_count = 0
         self.logger = logger
         self.identity = identity
+        self.binary_frames = binary_frames
+        self.binary = False
         self._connection_lock = asyncio.Lock()
         
     async def connect(self):
@@ -33,7 +39,8 @@ class WebSocketClient():
                     ping_interval=None,  # Disable automatic ping
                     ping_timeout=None    # Disable ping timeout
                 )
-                await self.socket.send(f"action=identify|identity={self.identity}|")
+                self.binary = False
+                await self.socket.send(f"action=identify|identity={self.identity}|" + ("binary=1|" if self.binary_frames else ""))
                 self.is_running = True
                 self.reconnect_count = 0
                 self.logger.info(f"client connected to server: {self.uri}")
@@ -67,6 +74,8 @@ class WebSocketClient():
             while self.is_running and self.socket:
                 try:
                     response = await self.socket.recv()
+                    if response.startswith("event=protocol|"):
+                        self.binary = extract_part("binary=", response) == "1"
                     if self.on_message:
                         self.on_message(response)
                 except ConnectionClosed:
@@ -108,6 +117,12 @@ class WebSocketClient():
             await self._handle_connection_failure(f"Send error: {e}")
             return False
 
+    async def send_rotate(self, pitch, roll, seq=0, timestamp=None):
+        """Binary rotate frame once the server has confirmed binary frames, text rotate otherwise"""
+        if self.binary:
+            return await self.send(encode_rotate(pitch, roll, seq, timestamp or perf_counter()))
+        return await self.send(f"action=rotate|pitch={pitch}|roll={roll}|" + (f"seq={seq}|" if seq else ""))
+
     async def _cleanup_connection(self):
         """Clean up existing connection and tasks."""
         # Cancel and wait for listen task
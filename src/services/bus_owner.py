@@ -0,0 +1,286 @@
+import asyncio
+from collections import deque
+from time import monotonic
+from constants.bus_priority import SAFETY_STOP, SETPOINT, FAULT_POLL, TELEMETRY, BUS_PRIORITIES
+from services.modbus_transport import (ModbusResponse, split_frames, decode_request, encode_read_response,
+                                       encode_write_response, encode_exception_response, READ_HOLDING_REGISTERS,
+                                       WRITE_SINGLE_REGISTER, WRITE_MULTIPLE_REGISTERS, ILLEGAL_FUNCTION,
+                                       SERVER_DEVICE_FAILURE, SERVER_DEVICE_BUSY)
+from utils.utils import setup_logger
+from utils.instrumentation import span
+
+SIDES = ("left", "right")
+SPAN_NAMES = {priority: f"bus.{name.replace(' ', '_')}" for priority, name in BUS_PRIORITIES.items()}
+
+class BusRequest():
+    __slots__ = ("priority", "is_write", "address", "data", "slave", "future", "enqueued_at")
+
+    def __init__(self, priority, is_write, address, data, slave, future):
+        self.priority = priority
+        self.is_write = is_write
+        self.address = address
+        self.data = data
+        self.slave = slave
+        self.future = future
+        self.enqueued_at = monotonic()
+
+class BusOwner():
+    """
+    Owns the modbus connections to both drives and serves the requests
+    of every component in priority order:
+    safety stop -> rotate setpoints -> fault polling -> telemetry.
+    Each priority has its own queue depth limit and a request that has
+    waited longer than BUS_STARVATION_TIME is served before higher priorities.
+    """
+    def __init__(self, modbus_clients, motor_config, config, logger=None):
+        self.modbus_clients = modbus_clients
+        self.motor_config = motor_config
+        self.config = config
+        self.logger = setup_logger(logger)
+        self.depth_limits = config.BUS_QUEUE_DEPTHS
+        self.starvation_time = config.BUS_STARVATION_TIME
+        self.max_in_flight = config.MAX_IN_FLIGHT if config.PIPELINED_TRANSPORT else 1
+        self.queues = {side: [deque() for _ in BUS_PRIORITIES] for side in SIDES}
+        self._wakeups = {side: asyncio.Event() for side in SIDES}
+        self._tasks = []
+        self.served = [0] * len(BUS_PRIORITIES)
+        self.rejected = [0] * len(BUS_PRIORITIES)
+        self.promoted = [0] * len(BUS_PRIORITIES)
+
+    async def start(self):
+        for side in SIDES:
+            self._tasks.append(asyncio.create_task(self._dispatch(side)))
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        for side in SIDES:
+            for queue in self.queues[side]:
+                while queue:
+                    request = queue.popleft()
+                    if not request.future.done():
+                        request.future.set_exception(ConnectionError("Bus owner stopped"))
+
+    def classify(self, is_write, address, data) -> int:
+        """Maps a request to its bus priority by the register it touches,
+        IEG_MOTION writes by the stop bit (continue and home are not stops)"""
+        config = self.motor_config
+        if is_write:
+            if address == config.IEG_MOTION_REGISTER:
+                return SAFETY_STOP if data[0] & config.STOP_VALUE else FAULT_POLL
+            if address in (config.ANALOG_MODBUS_CNTRL_REGISTER, config.HOST_POSITION_REGISTER):
+                return SETPOINT
+            if address == config.IEG_MODE_REGISTER:
+                return FAULT_POLL
+            return TELEMETRY
+        if address in (config.OEG_STATUS_REGISTER, config.OEG_MOTION_REGISTER, config.PRESENT_FAULT_REGISTER, config.RECENT_FAULT_REGISTER):
+            return FAULT_POLL
+        return TELEMETRY
+
+    def submit(self, side, is_write, address, data, slave=1, priority=None) -> asyncio.Future:
+        """Queues a read (data=count) or write (data=values) for one drive.
+        Returns a future that resolves to the drives response"""
+        if priority is None:
+            priority = self.classify(is_write, address, data)
+        future = asyncio.get_running_loop().create_future()
+        queue = self.queues[side][priority]
+        if priority == SAFETY_STOP:
+            self._drop_motion_writes(side)
+
+        if len(queue) >= self.depth_limits[priority]:
+            self.rejected[priority] += 1
+            function_code = WRITE_MULTIPLE_REGISTERS if is_write else READ_HOLDING_REGISTERS
+            busy = ModbusResponse(function_code, exception_code=SERVER_DEVICE_BUSY)
+            if priority != SETPOINT:
+                future.set_result(busy)
+                return future
+            ### only the newest setpoint matters, drop the oldest queued one
+            oldest = queue.popleft()
+            if not oldest.future.done():
+                oldest.future.set_result(busy)
+
+        queue.append(BusRequest(priority, is_write, address, data, slave, future))
+        self._wakeups[side].set()
+        return future
+
+    def _drop_motion_writes(self, side):
+        """A stop supersedes the continue and home writes still queued for the drive,
+        served after the stop they would release it"""
+        for queue in self.queues[side][SAFETY_STOP + 1:]:
+            for request in [request for request in queue if request.is_write and request.address == self.motor_config.IEG_MOTION_REGISTER]:
+                queue.remove(request)
+                if not request.future.done():
+                    request.future.set_result(ModbusResponse(WRITE_MULTIPLE_REGISTERS, exception_code=SERVER_DEVICE_BUSY))
+
+    def _next_request(self, side):
+        queues = self.queues[side]
+        now = monotonic()
+        ### starvation protection, lowest priorities are checked first
+        for priority in range(len(queues) - 1, 0, -1):
+            queue = queues[priority]
+            if queue and now - queue[0].enqueued_at >= self.starvation_time:
+                if any(queues[higher] for higher in range(priority)):
+                    self.promoted[priority] += 1
+                return queue.popleft()
+
+        for queue in queues:
+            if queue:
+                return queue.popleft()
+        return None
+
+    async def _dispatch(self, side):
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+        wakeup = self._wakeups[side]
+        while True:
+            await semaphore.acquire()
+            request = self._next_request(side)
+            ### requests whose caller already gave up are not sent
+            while request is None or request.future.done():
+                if request is None:
+                    wakeup.clear()
+                    await wakeup.wait()
+                request = self._next_request(side)
+            asyncio.create_task(self._execute(side, request, semaphore))
+
+    async def _execute(self, side, request, semaphore):
+        try:
+            client = getattr(self.modbus_clients, f"client_{side}")
+            with span(SPAN_NAMES[request.priority]):
+                if request.is_write:
+                    response = await client.write_registers(address=request.address, values=request.data, slave=request.slave)
+                else:
+                    response = await client.read_holding_registers(address=request.address, count=request.data, slave=request.slave)
+            self.served[request.priority] += 1
+            if not request.future.done():
+                request.future.set_result(response)
+        except Exception as e:
+            if not request.future.done():
+                request.future.set_exception(e)
+        finally:
+            semaphore.release()
+
+    def get_stats(self) -> dict:
+        return {
+            name: {
+                "served": self.served[priority],
+                "rejected": self.rejected[priority],
+                "promoted": self.promoted[priority],
+                "queued": sum(len(self.queues[side][priority]) for side in SIDES),
+            }
+            for priority, name in BUS_PRIORITIES.items()
+        }
+
+class BusClient():
+    """Drive client that routes one drives requests through the bus owner"""
+    def __init__(self, bus_owner: BusOwner, side):
+        self.bus_owner = bus_owner
+        self.side = side
+
+    @property
+    def connected(self) -> bool:
+        client = getattr(self.bus_owner.modbus_clients, f"client_{self.side}")
+        return client is not None and client.connected
+
+    async def connect(self) -> bool:
+        return self.connected
+
+    def close(self):
+        pass
+
+    def submit_read(self, address, count, slave=1) -> asyncio.Future:
+        return self.bus_owner.submit(self.side, False, address, count, slave)
+
+    def submit_write(self, address, values, slave=1) -> asyncio.Future:
+        return self.bus_owner.submit(self.side, True, address, list(values), slave)
+
+    async def read_holding_registers(self, address, count, slave=1):
+        return await self.submit_read(address, count, slave)
+
+    async def write_registers(self, address, values, slave=1):
+        return await self.submit_write(address, values, slave)
+
+class BusClients():
+    """ModbusClients counterpart for MotorApi inside the bus owner process"""
+    def __init__(self, bus_owner: BusOwner):
+        self.bus_owner = bus_owner
+        self.client_left = BusClient(bus_owner, "left")
+        self.client_right = BusClient(bus_owner, "right")
+
+    @property
+    def connection_generation(self) -> int:
+        return self.bus_owner.modbus_clients.connection_generation
+
+class BusGateway():
+    """
+    Serves the bus owner to the other processes as one Modbus TCP server
+    per drive on BUS_OWNER_PORT_LEFT and BUS_OWNER_PORT_RIGHT. on_write(side,
+    address, values) is called for every write of the other processes the
+    drive acknowledged, so the hub can follow them.
+    """
+    def __init__(self, bus_owner: BusOwner, config, logger=None, on_write=None):
+        self.bus_owner = bus_owner
+        self.on_write = on_write
+        self.config = config
+        self.logger = setup_logger(logger)
+        self.servers = []
+
+    async def start(self) -> bool:
+        try:
+            loop = asyncio.get_running_loop()
+            for side, port in (("left", self.config.BUS_OWNER_PORT_LEFT), ("right", self.config.BUS_OWNER_PORT_RIGHT)):
+                server = await loop.create_server(lambda side=side: _GatewayProtocol(self.bus_owner, side, self.on_write),
+                                                  self.config.BUS_OWNER_HOST, port)
+                self.servers.append(server)
+            self.logger.info(f"Bus owner gateway listening on {self.config.BUS_OWNER_HOST}:{self.config.BUS_OWNER_PORT_LEFT}/{self.config.BUS_OWNER_PORT_RIGHT}")
+            return True
+        except OSError as e:
+            self.logger.error(f"Could not start bus owner gateway: {e}")
+            return False
+
+    def stop(self):
+        for server in self.servers:
+            server.close()
+        self.servers = []
+
+class _GatewayProtocol(asyncio.Protocol):
+    def __init__(self, bus_owner: BusOwner, side, on_write=None):
+        self.bus_owner = bus_owner
+        self.side = side
+        self.on_write = on_write
+        self.transport = None
+        self.buffer = bytearray()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self.buffer.extend(data)
+        split_frames(self.buffer, self._on_frame)
+
+    def _on_frame(self, frame):
+        tid, unit, function_code, address, data = decode_request(frame)
+        if function_code not in (READ_HOLDING_REGISTERS, WRITE_SINGLE_REGISTER, WRITE_MULTIPLE_REGISTERS):
+            self._send(encode_exception_response(tid, unit, function_code, ILLEGAL_FUNCTION))
+            return
+        is_write = function_code != READ_HOLDING_REGISTERS
+        future = self.bus_owner.submit(self.side, is_write, address, data, unit)
+        future.add_done_callback(lambda future: self._respond(future, tid, unit, function_code, address, data))
+
+    def _respond(self, future, tid, unit, function_code, address, data):
+        if future.cancelled() or future.exception() is not None:
+            self._send(encode_exception_response(tid, unit, function_code, SERVER_DEVICE_FAILURE))
+            return
+        response = future.result()
+        if response.isError():
+            self._send(encode_exception_response(tid, unit, function_code, response.exception_code or SERVER_DEVICE_FAILURE))
+        elif function_code == READ_HOLDING_REGISTERS:
+            self._send(encode_read_response(tid, unit, response.registers))
+        else:
+            self._send(encode_write_response(tid, unit, function_code, address, data))
+            if self.on_write:
+                self.on_write(self.side, address, data)
+
+    def _send(self, frame):
+        if self.transport and not self.transport.is_closing():
+            self.transport.write(frame)
@@ -0,0 +1,72 @@
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+from utils.utils import setup_logger, convert_to_revs
+
+COLUMNS = ("time", "left_modbuscntrl", "right_modbuscntrl", "left_revs", "right_revs", "pitch", "roll")
+DTYPES = {"left_modbuscntrl": np.int32, "right_modbuscntrl": np.int32}
+
+class CalibrationRecorder():
+    """
+    Captures kinematics calibration samples: the modbuscntrl values last
+    written to the drives, the position feedback revs read when the sample
+    is taken and the pitch/roll the client measured with the IMU. A capture
+    is saved column by column into a compressed .npz file in directory.
+    """
+    def __init__(self, motor_api, logger=None, directory="calibration"):
+        self.motor_api = motor_api
+        self.logger = setup_logger(logger)
+        self.directory = Path(directory)
+        self.path = None
+        self.capturing = False
+        self._columns = None
+        self._started = None
+
+    @property
+    def samples(self) -> int:
+        return len(self._columns["time"]) if self._columns else 0
+
+    def start(self, name=None):
+        if self.capturing:
+            raise ValueError("A calibration capture is already running")
+        name = name or datetime.now().strftime("capture_%Y%m%d_%H%M%S")
+        self.path = self.directory / f"{Path(name).stem}.npz"
+        self._columns = {column: [] for column in COLUMNS}
+        self._started = datetime.now().timestamp()
+        self.capturing = True
+
+    async def sample(self, pitch, roll):
+        """Records one sample, returns the sample count or False if the feedback couldn't be read"""
+        if not self.capturing:
+            raise ValueError("No calibration capture running")
+        response = await self.motor_api.get_current_revs()
+        if not response:
+            return False
+        left_modbuscntrl, right_modbuscntrl = (-1 if value is None else value for value in self.motor_api.last_modbuscntrl)
+        values = (datetime.now().timestamp() - self._started, left_modbuscntrl, right_modbuscntrl,
+                  convert_to_revs(response[0]), convert_to_revs(response[1]), float(pitch), float(roll))
+        for column, value in zip(COLUMNS, values):
+            self._columns[column].append(value)
+        return self.samples
+
+    def stop(self) -> Path:
+        """Saves the capture and returns its path"""
+        if not self.capturing:
+            raise ValueError("No calibration capture running")
+        self.capturing = False
+        self.directory.mkdir(parents=True, exist_ok=True)
+        np.savez_compressed(self.path, **{column: np.asarray(values, dtype=DTYPES.get(column, np.float64))
+                                          for column, values in self._columns.items()})
+        self.logger.info(f"Saved {self.samples} calibration samples to {self.path}")
+        return self.path
+
+    def get_stats(self) -> dict:
+        return {"capturing": self.capturing, "samples": self.samples, "file": str(self.path) if self.path else None}
+
+def load_captures(paths) -> dict:
+    """Columns of one or more capture files concatenated"""
+    captures = []
+    for path in paths:
+        with np.load(path) as capture:
+            captures.append({column: capture[column] for column in COLUMNS})
+    return {column: np.concatenate([capture[column] for capture in captures]) for column in COLUMNS}
@@ -0,0 +1,94 @@
+import asyncio
+from dataclasses import dataclass, field
+from time import perf_counter
+from utils.utils import setup_logger
+from utils import instrumentation
+
+QUEUES = ("motion", "control", "query")
+
+@dataclass
+class WorkItem:
+    """One parsed action waiting for its worker"""
+    action: str
+    kwargs: dict
+    wsclient: object = None
+    enqueued_at: float = field(default_factory=perf_counter)
+
+class CommandQueues():
+    """
+    Bounded asyncio queue and worker task per command class, motion (rotates
+    and other setpoints), control (faults, trajectory, shutdown...) and query
+    (stats, telemetry, attitude). The websocket receive loop only parses and
+    puts work items, each worker runs its items in order with execute, so a
+    slow query or control command never delays the motion commands. Each
+    client gets its own queues, so one clients burst never fills another's.
+    """
+    def __init__(self, execute, depths=(64, 16, 16), logger=None):
+        self.execute = execute
+        self.logger = setup_logger(logger)
+        self._queues = {name: asyncio.Queue(maxsize=depth) for name, depth in zip(QUEUES, depths)}
+        self._tasks = {}
+        self._running = set()
+        self._closing = False
+        self.stats = {name: {"processed": 0, "rejected": 0, "failed": 0, "max_depth": 0, "max_wait_s": 0.0} for name in QUEUES}
+
+    def start(self):
+        if not self._tasks:
+            self._closing = False
+            self._tasks = {name: asyncio.create_task(self._run(name)) for name in QUEUES}
+
+    def stop(self):
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks = {}
+
+    def close(self):
+        """Drops the queued items and stops the workers, an item already running is let finish"""
+        self._closing = True
+        for queue in self._queues.values():
+            while not queue.empty():
+                queue.get_nowait()
+                queue.task_done()
+        for name, task in self._tasks.items():
+            if name not in self._running:
+                task.cancel()
+        self._tasks = {}
+
+    def put(self, queue, item) -> bool:
+        """False when the queue is full"""
+        stats = self.stats[queue]
+        try:
+            self._queues[queue].put_nowait(item)
+        except asyncio.QueueFull:
+            stats["rejected"] += 1
+            return False
+        stats["max_depth"] = max(stats["max_depth"], self._queues[queue].qsize())
+        return True
+
+    async def join(self):
+        """Waits until every queued item has been run"""
+        for queue in self._queues.values():
+            await queue.join()
+
+    async def _run(self, name):
+        queue = self._queues[name]
+        stats = self.stats[name]
+        span = f"queue.{name}.wait"
+        while not self._closing:
+            item = await queue.get()
+            self._running.add(name)
+            try:
+                wait = perf_counter() - item.enqueued_at
+                stats["max_wait_s"] = max(stats["max_wait_s"], wait)
+                instrumentation.record(span, wait)
+                await self.execute(item)
+                stats["processed"] += 1
+            except Exception as e:
+                stats["failed"] += 1
+                self.logger.error(f"Error while running {item.action} from the {name} queue: {e}")
+            finally:
+                self._running.discard(name)
+                queue.task_done()
+
+    def get_stats(self) -> dict:
+        return {name: {"depth": self._queues[name].qsize(), **stats} for name, stats in self.stats.items()}
@@ -0,0 +1,126 @@
+import asyncio
+from time import perf_counter
+from helpers.motor_api_helper import calc_delta_revs, validate_dead_bandwidth, update_previous_revs
+from utils.utils import setup_logger
+
+SIDES = ("left", "right")
+UNCHANGED_REVS = 1e-6 # held targets closer than this to the written value are not flushed
+
+class DeadbandFilter():
+    """
+    Per drive deadband with hysteresis in the rotate path. A drive that is
+    holding its position is only written once its target moves more than
+    DEADBANDREVS from the last written value, while it is tracking every
+    change above DEADBAND_RELEASE_REVS is written. A suppressed target that
+    differs from the written one is flushed after DEADBAND_MAX_HOLD seconds
+    so the final pose is always reached. write_sides(revs, sides) is the
+    coroutine that writes the given sides of [left, right] revs. The rotate
+    path holds lock while it filters and writes, the flush takes the same
+    lock so it never races a rotate write. The rotate path reports the write
+    with written or, when it failed, with failed, which holds the target again
+    so the flush retries it.
+    """
+    def __init__(self, config, write_sides, logger=None):
+        self.config = config
+        self.write_sides = write_sides
+        self.logger = setup_logger(logger)
+        self.previous_revs = [None, None] # last written revs, left, right
+        self.tracking = [False, False]
+        self.held = [None, None] # suppressed target revs
+        self.held_since = [None, None]
+        self._hold_task = None
+        self.lock = asyncio.Lock()
+        self.issued = [0, 0]
+        self.suppressed = [0, 0]
+        self.hold_flushes = [0, 0]
+
+    def reset(self):
+        """Forgets the written values, e.g. after something else moved the drives"""
+        self.previous_revs = [None, None]
+        self.tracking = [False, False]
+        self.held = [None, None]
+        self.held_since = [None, None]
+
+    def filter(self, revs) -> list:
+        """Returns [left, right], True for the drives the target revs should be written to"""
+        delta_revs = calc_delta_revs(self, revs)
+        bandwidths = [self.config.DEADBAND_RELEASE_REVS if tracking else self.config.DEADBANDREVS for tracking in self.tracking]
+        should_write = validate_dead_bandwidth(self, delta_revs, bandwidths)
+        now = perf_counter()
+        for i in range(2):
+            ### tracking and the hold of a written side change once the write is done
+            if should_write[i]:
+                continue
+            self.tracking[i] = False
+            self.suppressed[i] += 1
+            if delta_revs[i] > UNCHANGED_REVS:
+                self.held[i] = revs[i]
+                if self.held_since[i] is None:
+                    self.held_since[i] = now
+            else:
+                self.held[i] = self.held_since[i] = None
+        self._start_flush()
+        return should_write
+
+    def written(self, should_write, revs, tracking=True):
+        """The drives in should_write reached revs, tracking False for the flush of a held target"""
+        update_previous_revs(self, should_write, revs)
+        for i in range(2):
+            if should_write[i]:
+                self.tracking[i] = tracking
+                self.issued[i] += tracking
+                self.held[i] = self.held_since[i] = None
+
+    def failed(self, should_write, revs):
+        """The write of should_write failed, the targets are held so the flush retries them after DEADBAND_MAX_HOLD"""
+        now = perf_counter()
+        for i in range(2):
+            if should_write[i]:
+                self.tracking[i] = False
+                self.held[i] = revs[i]
+                self.held_since[i] = now
+        self._start_flush()
+
+    def _start_flush(self):
+        if any(since is not None for since in self.held_since) and self._hold_task is None:
+            self._hold_task = asyncio.create_task(self._flush_held())
+
+    async def _flush_held(self):
+        """Writes targets that have been held back for DEADBAND_MAX_HOLD"""
+        try:
+            while any(since is not None for since in self.held_since):
+                deadline = min(since for since in self.held_since if since is not None) + self.config.DEADBAND_MAX_HOLD
+                await asyncio.sleep(max(0.0, deadline - perf_counter()))
+                async with self.lock:
+                    ### a rotate written while waiting for the lock cleared the hold of its sides
+                    now = perf_counter()
+                    due = [since is not None and now - since >= self.config.DEADBAND_MAX_HOLD for since in self.held_since]
+                    if not any(due):
+                        continue
+                    revs = [self.held[i] if due[i] else self.previous_revs[i] for i in range(2)]
+                    if await self.write_sides(revs, due):
+                        self.written(due, revs, tracking=False)
+                        for i in range(2):
+                            self.hold_flushes[i] += due[i]
+                    else:
+                        self.failed(due, revs)
+        except Exception as e:
+            self.logger.error(f"Deadband failed to flush the held setpoint: {e}")
+        finally:
+            self._hold_task = None
+
+    def get_stats(self) -> dict:
+        stats = {
+            "deadband_revs": self.config.DEADBANDREVS,
+            "release_revs": self.config.DEADBAND_RELEASE_REVS,
+            "max_hold_s": self.config.DEADBAND_MAX_HOLD,
+        }
+        for i, side in enumerate(SIDES):
+            total = self.issued[i] + self.suppressed[i]
+            stats[side] = {
+                "issued": self.issued[i] + self.hold_flushes[i],
+                "suppressed": self.suppressed[i],
+                "hold_flushes": self.hold_flushes[i],
+                "suppressed_ratio": self.suppressed[i] / total if total else 0.0,
+            }
+        return stats
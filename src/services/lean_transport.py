@@ -0,0 +1,175 @@
+import asyncio
+import struct
+from typing import Optional
+from services.modbus_transport import (ModbusResponse, encode_write_request, MBAP_HEADER_SIZE, READ_HOLDING_REGISTERS,
+                                       WRITE_MULTIPLE_REGISTERS, EXCEPTION_BIT, MAX_TID)
+from utils.utils import setup_logger
+
+### preallocated frame layouts, only the changing fields are packed per request
+READ_FRAME = struct.Struct(">HHHBBHH") # tid, protocol, length, unit, fc3, address, count
+WRITE_ONE_FRAME = struct.Struct(">HHHBBHHBH") # tid, protocol, length, unit, fc16, address, count=1, byte count=2, value
+TID_FIELD = struct.Struct(">H")
+READ_FIELDS = struct.Struct(">HH") # address, count
+WRITE_ONE_FIELDS = struct.Struct(">H") # value
+READ_FIELDS_OFFSET = MBAP_HEADER_SIZE + 1
+WRITE_ADDRESS_OFFSET = MBAP_HEADER_SIZE + 1
+WRITE_VALUE_OFFSET = MBAP_HEADER_SIZE + 6
+RECEIVE_BUFFER_SIZE = 512 # largest FC3 response is 7 + 2 + 250 bytes
+
+### unpackers for the register counts MotorApi reads, others are built on first use
+_REGISTER_UNPACKERS = {count: struct.Struct(f">{count}H") for count in range(1, 9)}
+
+def _get_unpacker(count) -> struct.Struct:
+    unpacker = _REGISTER_UNPACKERS.get(count)
+    if unpacker is None:
+        unpacker = _REGISTER_UNPACKERS[count] = struct.Struct(f">{count}H")
+    return unpacker
+
+class LeanModbusProtocol(asyncio.BufferedProtocol):
+    """Receives straight into one preallocated buffer and hands
+    each complete frame to on_frame as a memoryview slice of it"""
+    def __init__(self, on_frame, on_connection_lost):
+        self.transport = None
+        self._buffer = bytearray(RECEIVE_BUFFER_SIZE)
+        self._view = memoryview(self._buffer)
+        self._filled = 0
+        self._on_frame = on_frame
+        self._on_connection_lost = on_connection_lost
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def get_buffer(self, sizehint):
+        return self._view[self._filled:]
+
+    def buffer_updated(self, nbytes):
+        self._filled += nbytes
+        start = 0
+        while self._filled - start >= MBAP_HEADER_SIZE:
+            end = start + 6 + ((self._buffer[start + 4] << 8) | self._buffer[start + 5])
+            if end > self._filled:
+                break
+            self._on_frame(self._view[start:end])
+            start = end
+        if start:
+            ### keep the partial frame at the start of the buffer
+            remaining = self._filled - start
+            self._buffer[:remaining] = self._buffer[start:self._filled]
+            self._filled = remaining
+
+    def connection_lost(self, exc):
+        self.transport = None
+        self._on_connection_lost(exc)
+
+class LeanModbusClient():
+    """
+    Modbus TCP client for the setpoint hot path. The FC3 read frame and the
+    single register FC16 write frame (ANALOG_MODBUS_CNTRL) are allocated once
+    and only their tid, address, count and value fields are packed per request.
+    Responses are parsed from a memoryview of the receive buffer without
+    copying the frame. One request is in flight at a time, like the pymodbus
+    client, which also guarantees the shared frames are not rewritten while
+    the transport still holds them. Multi register writes fall back to the
+    generic encoder so the client can replace AsyncModbusTcpClient in MotorApi.
+    """
+    def __init__(self, host, port=502, timeout=1.0, logger=None):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.logger = setup_logger(logger)
+        self._protocol: Optional[LeanModbusProtocol] = None
+        self._lock = asyncio.Lock()
+        self._future: Optional[asyncio.Future] = None
+        self._tid = 0
+        self._read_frame = bytearray(READ_FRAME.size)
+        self._write_one_frame = bytearray(WRITE_ONE_FRAME.size)
+        self._prepared_unit = None
+
+    @property
+    def connected(self) -> bool:
+        return self._protocol is not None and self._protocol.transport is not None
+
+    async def connect(self) -> bool:
+        if self.connected:
+            return True
+        try:
+            loop = asyncio.get_running_loop()
+            _, self._protocol = await asyncio.wait_for(
+                loop.create_connection(lambda: LeanModbusProtocol(self._on_frame, self._on_connection_lost), self.host, self.port),
+                timeout=self.timeout * 3)
+            return True
+        except (OSError, asyncio.TimeoutError) as e:
+            self.logger.debug(f"Lean client could not connect to {self.host}:{self.port}: {e}")
+            self._protocol = None
+            return False
+
+    def close(self):
+        if self.connected:
+            self._protocol.transport.close()
+        self._fail(ConnectionError(f"Connection to {self.host}:{self.port} closed"))
+        self._protocol = None
+
+    def _prepare_frames(self, unit):
+        """Fills the constant fields of the preallocated frames"""
+        READ_FRAME.pack_into(self._read_frame, 0, 0, 0, 6, unit, READ_HOLDING_REGISTERS, 0, 0)
+        WRITE_ONE_FRAME.pack_into(self._write_one_frame, 0, 0, 0, 9, unit, WRITE_MULTIPLE_REGISTERS, 0, 1, 2, 0)
+        self._prepared_unit = unit
+
+    async def read_holding_registers(self, address, count, slave=1) -> ModbusResponse:
+        async with self._lock:
+            if slave != self._prepared_unit:
+                self._prepare_frames(slave)
+            frame = self._read_frame
+            READ_FIELDS.pack_into(frame, READ_FIELDS_OFFSET, address, count)
+            return await self._request(frame)
+
+    async def write_registers(self, address, values, slave=1) -> ModbusResponse:
+        async with self._lock:
+            if len(values) != 1:
+                return await self._request(encode_write_request(0, slave, address, values))
+            if slave != self._prepared_unit:
+                self._prepare_frames(slave)
+            frame = self._write_one_frame
+            READ_FIELDS.pack_into(frame, WRITE_ADDRESS_OFFSET, address, 1)
+            WRITE_ONE_FIELDS.pack_into(frame, WRITE_VALUE_OFFSET, values[0])
+            return await self._request(frame)
+
+    async def _request(self, frame) -> ModbusResponse:
+        if not self.connected:
+            raise ConnectionError(f"Not connected to {self.host}:{self.port}")
+        self._tid = self._tid + 1 if self._tid < MAX_TID else 1
+        if isinstance(frame, bytearray):
+            TID_FIELD.pack_into(frame, 0, self._tid)
+        else:
+            frame = TID_FIELD.pack(self._tid) + frame[2:]
+        self._future = asyncio.get_running_loop().create_future()
+        self._protocol.transport.write(frame)
+        try:
+            return await asyncio.wait_for(self._future, self.timeout)
+        except asyncio.TimeoutError:
+            raise asyncio.TimeoutError(f"No response from {self.host}:{self.port} for transaction {self._tid}")
+        finally:
+            self._future = None
+
+    def _on_frame(self, frame: memoryview):
+        future = self._future
+        if future is None or future.done() or TID_FIELD.unpack_from(frame, 0)[0] != self._tid:
+            self.logger.debug("Dropped unexpected response frame")
+            return
+        function_code = frame[MBAP_HEADER_SIZE]
+        if function_code & EXCEPTION_BIT:
+            future.set_result(ModbusResponse(function_code & ~EXCEPTION_BIT, exception_code=frame[MBAP_HEADER_SIZE + 1]))
+        elif function_code == READ_HOLDING_REGISTERS:
+            count = frame[MBAP_HEADER_SIZE + 1] // 2
+            future.set_result(ModbusResponse(function_code, registers=_get_unpacker(count).unpack_from(frame, MBAP_HEADER_SIZE + 2)))
+        else:
+            future.set_result(ModbusResponse(function_code))
+
+    def _on_connection_lost(self, exc):
+        if exc is not None:
+            self.logger.warning(f"Lost connection to {self.host}:{self.port}: {exc}")
+        self._fail(ConnectionError(f"Connection to {self.host}:{self.port} lost"))
+
+    def _fail(self, exc):
+        if self._future is not None and not self._future.done():
+            self._future.set_exception(exc)
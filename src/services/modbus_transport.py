@@ -0,0 +1,253 @@
+import asyncio
+import struct
+from collections import deque
+from typing import Dict, List, Optional, Union
+from utils.utils import setup_logger
+
+### Modbus TCP framing
+MBAP_HEADER = struct.Struct(">HHHB") # transaction id, protocol id, length, unit id
+MBAP_HEADER_SIZE = 7
+READ_HOLDING_REGISTERS = 3
+WRITE_SINGLE_REGISTER = 6
+WRITE_MULTIPLE_REGISTERS = 16
+EXCEPTION_BIT = 0x80
+MAX_TID = 65535
+ILLEGAL_FUNCTION = 1
+ILLEGAL_DATA_ADDRESS = 2
+SERVER_DEVICE_FAILURE = 4
+SERVER_DEVICE_BUSY = 6
+
+class ModbusResponse():
+    """Response object with the same surface MotorApi uses from pymodbus responses"""
+    __slots__ = ("function_code", "registers", "exception_code")
+
+    def __init__(self, function_code, registers=None, exception_code=None):
+        self.function_code = function_code
+        self.registers = registers if registers is not None else []
+        self.exception_code = exception_code
+
+    def isError(self) -> bool:
+        return self.exception_code is not None
+
+    def __repr__(self):
+        if self.isError():
+            return f"ModbusResponse(fc={self.function_code}, exception={self.exception_code})"
+        return f"ModbusResponse(fc={self.function_code}, registers={self.registers})"
+
+def encode_read_request(tid, unit, address, count) -> bytes:
+    return struct.pack(">HHHBBHH", tid, 0, 6, unit, READ_HOLDING_REGISTERS, address, count)
+
+def encode_write_request(tid, unit, address, values) -> bytes:
+    count = len(values)
+    return struct.pack(f">HHHBBHHB{count}H", tid, 0, 7 + 2 * count, unit, WRITE_MULTIPLE_REGISTERS, address, count, 2 * count, *values)
+
+def decode_response(frame) -> tuple[int, ModbusResponse]:
+    """Decodes a complete response frame (MBAP header included).
+    Returns:
+        (tid, ModbusResponse)
+    """
+    tid, _, _, _ = MBAP_HEADER.unpack_from(frame, 0)
+    function_code = frame[MBAP_HEADER_SIZE]
+    if function_code & EXCEPTION_BIT:
+        return tid, ModbusResponse(function_code & ~EXCEPTION_BIT, exception_code=frame[MBAP_HEADER_SIZE + 1])
+
+    if function_code == READ_HOLDING_REGISTERS:
+        byte_count = frame[MBAP_HEADER_SIZE + 1]
+        registers = list(struct.unpack_from(f">{byte_count // 2}H", frame, MBAP_HEADER_SIZE + 2))
+        return tid, ModbusResponse(function_code, registers=registers)
+
+    return tid, ModbusResponse(function_code)
+
+def decode_request(frame) -> tuple[int, int, int, int, Union[int, List[int]]]:
+    """Decodes a complete request frame (MBAP header included).
+    Returns:
+        (tid, unit, function_code, address, count for reads or values for writes)
+    """
+    tid, _, _, unit = MBAP_HEADER.unpack_from(frame, 0)
+    function_code = frame[MBAP_HEADER_SIZE]
+    if function_code == READ_HOLDING_REGISTERS:
+        address, count = struct.unpack_from(">HH", frame, MBAP_HEADER_SIZE + 1)
+        return tid, unit, function_code, address, count
+    if function_code == WRITE_SINGLE_REGISTER:
+        address, value = struct.unpack_from(">HH", frame, MBAP_HEADER_SIZE + 1)
+        return tid, unit, function_code, address, [value]
+    if function_code == WRITE_MULTIPLE_REGISTERS:
+        address, count = struct.unpack_from(">HH", frame, MBAP_HEADER_SIZE + 1)
+        values = list(struct.unpack_from(f">{count}H", frame, MBAP_HEADER_SIZE + 6))
+        return tid, unit, function_code, address, values
+    return tid, unit, function_code, 0, 0
+
+def encode_read_response(tid, unit, registers) -> bytes:
+    count = len(registers)
+    return struct.pack(f">HHHBBB{count}H", tid, 0, 3 + 2 * count, unit, READ_HOLDING_REGISTERS, 2 * count, *registers)
+
+def encode_write_response(tid, unit, function_code, address, values) -> bytes:
+    if function_code == WRITE_SINGLE_REGISTER:
+        return struct.pack(">HHHBBHH", tid, 0, 6, unit, function_code, address, values[0])
+    return struct.pack(">HHHBBHH", tid, 0, 6, unit, function_code, address, len(values))
+
+def encode_exception_response(tid, unit, function_code, exception_code) -> bytes:
+    return struct.pack(">HHHBBB", tid, 0, 3, unit, function_code | EXCEPTION_BIT, exception_code)
+
+def split_frames(buffer: bytearray, on_frame):
+    """Calls on_frame for every complete frame in the buffer
+    and removes them from it, partial frames are left in place"""
+    start = 0
+    buffered = len(buffer)
+    while buffered - start >= MBAP_HEADER_SIZE:
+        length = (buffer[start + 4] << 8) | buffer[start + 5]
+        end = start + 6 + length
+        if end > buffered:
+            break
+        on_frame(bytes(buffer[start:end]))
+        start = end
+    if start:
+        del buffer[:start]
+
+class ModbusTcpProtocol(asyncio.Protocol):
+    def __init__(self, on_frame, on_connection_lost):
+        self.transport = None
+        self._buffer = bytearray()
+        self._on_frame = on_frame
+        self._on_connection_lost = on_connection_lost
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self._buffer.extend(data)
+        split_frames(self._buffer, self._on_frame)
+
+    def connection_lost(self, exc):
+        self.transport = None
+        self._on_connection_lost(exc)
+
+class PipelinedModbusClient():
+    """
+    Modbus TCP client that keeps up to max_in_flight requests outstanding
+    on one socket and matches the responses to requests by their transaction id.
+    Requests over the in flight limit wait in a FIFO until a response frees a slot.
+    submit_read and submit_write return futures, read_holding_registers and
+    write_registers await them so the client can be used in place of
+    pymodbus AsyncModbusTcpClient in MotorApi.
+    """
+    def __init__(self, host, port=502, max_in_flight=4, timeout=1.0, logger=None):
+        self.host = host
+        self.port = port
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.logger = setup_logger(logger)
+        self._protocol: Optional[ModbusTcpProtocol] = None
+        self._in_flight: Dict[int, tuple] = {} # tid -> (future, timeout_handle)
+        self._waiting = deque() # (tid, frame, future)
+        self._next_tid = 0
+
+    @property
+    def connected(self) -> bool:
+        return self._protocol is not None and self._protocol.transport is not None
+
+    async def connect(self) -> bool:
+        if self.connected:
+            return True
+        try:
+            loop = asyncio.get_running_loop()
+            _, self._protocol = await asyncio.wait_for(
+                loop.create_connection(lambda: ModbusTcpProtocol(self._on_frame, self._on_connection_lost), self.host, self.port),
+                timeout=self.timeout * 3)
+            return True
+        except (OSError, asyncio.TimeoutError) as e:
+            self.logger.debug(f"Pipelined client could not connect to {self.host}:{self.port}: {e}")
+            self._protocol = None
+            return False
+
+    def close(self):
+        if self.connected:
+            self._protocol.transport.close()
+        self._fail_all(ConnectionError(f"Connection to {self.host}:{self.port} closed"))
+        self._protocol = None
+
+    def in_flight(self) -> int:
+        return len(self._in_flight)
+
+    def submit_read(self, address, count, slave=1) -> asyncio.Future:
+        """Queues an FC3 read and returns a future that resolves to a ModbusResponse"""
+        tid = self._get_next_tid()
+        return self._submit(tid, encode_read_request(tid, slave, address, count))
+
+    def submit_write(self, address, values, slave=1) -> asyncio.Future:
+        """Queues an FC16 write and returns a future that resolves to a ModbusResponse"""
+        tid = self._get_next_tid()
+        return self._submit(tid, encode_write_request(tid, slave, address, values))
+
+    async def read_holding_registers(self, address, count, slave=1) -> ModbusResponse:
+        return await self.submit_read(address, count, slave)
+
+    async def write_registers(self, address, values, slave=1) -> ModbusResponse:
+        return await self.submit_write(address, values, slave)
+
+    def _get_next_tid(self) -> int:
+        ### skip ids that are still waiting for a response
+        while True:
+            self._next_tid = self._next_tid + 1 if self._next_tid < MAX_TID else 1
+            if self._next_tid not in self._in_flight:
+                return self._next_tid
+
+    def _submit(self, tid, frame) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        if not self.connected:
+            future.set_exception(ConnectionError(f"Not connected to {self.host}:{self.port}"))
+            return future
+
+        if len(self._in_flight) < self.max_in_flight:
+            self._send(tid, frame, future)
+        else:
+            self._waiting.append((tid, frame, future))
+        return future
+
+    def _send(self, tid, frame, future):
+        timeout_handle = asyncio.get_running_loop().call_later(self.timeout, self._on_timeout, tid)
+        self._in_flight[tid] = (future, timeout_handle)
+        self._protocol.transport.write(frame)
+
+    def _send_waiting(self):
+        while self._waiting and len(self._in_flight) < self.max_in_flight and self.connected:
+            tid, frame, future = self._waiting.popleft()
+            if not future.done():
+                self._send(tid, frame, future)
+
+    def _on_frame(self, frame):
+        tid, response = decode_response(frame)
+        entry = self._in_flight.pop(tid, None)
+        if entry is None:
+            self.logger.debug(f"Dropped response with unknown transaction id {tid}")
+            return
+        future, timeout_handle = entry
+        timeout_handle.cancel()
+        if not future.done():
+            future.set_result(response)
+        self._send_waiting()
+
+    def _on_timeout(self, tid):
+        entry = self._in_flight.pop(tid, None)
+        if entry is None:
+            return
+        future, _ = entry
+        if not future.done():
+            future.set_exception(asyncio.TimeoutError(f"No response from {self.host}:{self.port} for transaction {tid}"))
+        self._send_waiting()
+
+    def _on_connection_lost(self, exc):
+        if exc is not None:
+            self.logger.warning(f"Lost connection to {self.host}:{self.port}: {exc}")
+        self._fail_all(ConnectionError(f"Connection to {self.host}:{self.port} lost"))
+
+    def _fail_all(self, exc):
+        for future, timeout_handle in self._in_flight.values():
+            timeout_handle.cancel()
+            if not future.done():
+                future.set_exception(exc)
+        self._in_flight.clear()
+        while self._waiting:
+            _, _, future = self._waiting.popleft()
+            if not future.done():
+                future.set_exception(exc)
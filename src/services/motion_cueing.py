@@ -0,0 +1,242 @@
+import asyncio
+import copy
+import json
+import math
+import os
+from time import perf_counter
+from settings.washout_config import WashoutConfig
+from utils.utils import setup_logger
+
+AXES = 2 # pitch, roll
+UNCHANGED_DEG = 1e-4 # outputs closer than this to the last forwarded one are not forwarded
+
+class Biquad():
+    """Second order IIR section, transposed direct form II with its state preallocated per axis"""
+    __slots__ = ("b0", "b1", "b2", "a1", "a2", "z1", "z2")
+
+    def __init__(self, coefficients):
+        self.z1 = [0.0] * AXES
+        self.z2 = [0.0] * AXES
+        self.set_coefficients(coefficients)
+
+    def set_coefficients(self, coefficients):
+        """Filter state is kept, so coefficients can change while streaming"""
+        self.b0, self.b1, self.b2, self.a1, self.a2 = coefficients
+
+    def reset(self, value, axis):
+        """Settles the state to a constant input of value"""
+        gain = (self.b0 + self.b1 + self.b2) / (1 + self.a1 + self.a2)
+        output = gain * value
+        self.z1[axis] = output - self.b0 * value
+        self.z2[axis] = self.b2 * value - self.a2 * output
+
+    def step(self, x, axis) -> float:
+        y = self.b0 * x + self.z1[axis]
+        self.z1[axis] = self.b1 * x - self.a1 * y + self.z2[axis]
+        self.z2[axis] = self.b2 * x - self.a2 * y
+        return y
+
+def _biquad_coefficients(kind, cutoff, rate, q) -> tuple:
+    """RBJ cookbook low/high pass, normalized by a0"""
+    if not 0 < cutoff < rate / 2:
+        raise ValueError(f"Cutoff {cutoff} Hz must be between 0 and half the filter rate {rate / 2} Hz")
+    w0 = 2 * math.pi * cutoff / rate
+    cos_w0 = math.cos(w0)
+    alpha = math.sin(w0) / (2 * q)
+    a0 = 1 + alpha
+    if kind == "lowpass":
+        b0 = b2 = (1 - cos_w0) / 2 / a0
+        b1 = (1 - cos_w0) / a0
+    else:
+        b0 = b2 = (1 + cos_w0) / 2 / a0
+        b1 = -(1 + cos_w0) / a0
+    return (b0, b1, b2, -2 * cos_w0 / a0, (1 - alpha) / a0)
+
+class MotionCueingFilter():
+    """
+    Washout stage in front of the kinematics. Raw pitch/roll from the
+    clients goes through a high passed onset channel that washes back to
+    neutral, a low passed tilt coordination channel limited to
+    TILT_RATE_LIMIT deg/s that renders the sustained attitude, and a low pass
+    on their sum. The filters run at a fixed rate on the newest input and
+    pass the cued pose to the downstream setpoint sink (MotorApi or the
+    interpolator). Parameters reload when the json file changes or through
+    set_parameters, without losing filter state. After reset the filters idle
+    until the next input and settle on the attitude read with feedback (async,
+    dict with pitch and roll) so they continue from where the platform is.
+    """
+    def __init__(self, downstream, logger=None, rate=100, params=None, params_file=None, reload_interval=1.0, feedback=None):
+        self.downstream = downstream
+        self.logger = setup_logger(logger)
+        self.rate = rate
+        self.period = 1.0 / rate
+        self.params = params or WashoutConfig()
+        self.params_file = params_file
+        self.reload_interval = reload_interval
+        self.feedback = feedback
+        self._params_mtime = None
+        self.highpass = Biquad((1.0, 0.0, 0.0, 0.0, 0.0))
+        self.tilt = Biquad((1.0, 0.0, 0.0, 0.0, 0.0))
+        self.smoothing = Biquad((1.0, 0.0, 0.0, 0.0, 0.0))
+        self._configure(self.params)
+        self._input = None
+        self._tilt_output = [0.0] * AXES
+        self._output = [0.0] * AXES
+        self._forwarded = None
+        self._reseed = False
+        self._event = asyncio.Event()
+        self._task = None
+        self.ticks = 0
+        self.forwarded = 0
+        self.unchanged = 0
+        self.reloads = 0
+        self.last_reload_error = None
+
+    def _configure(self, params):
+        coefficients = (_biquad_coefficients("highpass", params.HP_CUTOFF, self.rate, params.Q),
+                        _biquad_coefficients("lowpass", params.TILT_CUTOFF, self.rate, params.Q),
+                        _biquad_coefficients("lowpass", params.OUTPUT_CUTOFF, self.rate, params.Q))
+        self.highpass.set_coefficients(coefficients[0])
+        self.tilt.set_coefficients(coefficients[1])
+        self.smoothing.set_coefficients(coefficients[2])
+
+    def set_parameters(self, values: dict) -> bool:
+        """Applies the parameters only if all of them are valid"""
+        try:
+            params = copy.copy(self.params)
+            params.update(values)
+            self._configure(params)
+            self.params = params
+            self.reloads += 1
+            self.last_reload_error = None
+            return True
+        except Exception as e:
+            self.last_reload_error = str(e)
+            self.logger.error(f"Invalid washout parameters {values}: {e}")
+            return False
+
+    def _reload_file(self):
+        try:
+            mtime = os.path.getmtime(self.params_file)
+        except OSError:
+            return
+        if mtime == self._params_mtime:
+            return
+        self._params_mtime = mtime
+        try:
+            with open(self.params_file) as file:
+                values = json.load(file)
+        except Exception as e:
+            self.last_reload_error = str(e)
+            self.logger.error(f"Could not read washout parameters from {self.params_file}: {e}")
+            return
+        if self.set_parameters(values):
+            self.logger.info(f"Reloaded washout parameters from {self.params_file}")
+
+    def start(self):
+        if self.params_file:
+            self._reload_file()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def reset(self):
+        """Idles the filters until the next input, others are about to move the drives"""
+        running = self._task is not None
+        self.stop()
+        self._input = None
+        self._forwarded = None
+        self._reseed = self.feedback is not None
+        self._event.clear()
+        if running:
+            self.start()
+
+    async def rotate(self, pitch, roll, trace=None):
+        """Takes the newest raw attitude, the trace is acknowledged once it is accepted"""
+        if trace is not None:
+            trace["kinematics"] = trace["written"] = perf_counter()
+            trace["success"] = True
+        if self._input is None and not self._reseed:
+            self._settle(pitch, roll)
+        self._input = (float(pitch), float(roll))
+        self._event.set()
+
+    def _settle(self, pitch, roll):
+        """Starts from a sustained attitude so the first input is not a step"""
+        for axis, value in enumerate((pitch, roll)):
+            self.highpass.reset(value, axis)
+            self.tilt.reset(value, axis)
+            self._tilt_output[axis] = self.params.TILT_GAIN * value
+            self.smoothing.reset(self._tilt_output[axis], axis)
+            self._output[axis] = self._tilt_output[axis]
+
+    def step(self, pitch, roll) -> list:
+        """One filter step at the filter rate, returns the cued [pitch, roll]"""
+        params = self.params
+        max_tilt_step = params.TILT_RATE_LIMIT * self.period
+        for axis, value in enumerate((pitch, roll)):
+            onset = params.HP_GAIN * self.highpass.step(value, axis)
+            tilt = params.TILT_GAIN * self.tilt.step(value, axis)
+            previous = self._tilt_output[axis]
+            tilt = min(max(tilt, previous - max_tilt_step), previous + max_tilt_step)
+            self._tilt_output[axis] = tilt
+            self._output[axis] = self.smoothing.step(onset + tilt, axis)
+        return self._output
+
+    async def _seed_from_feedback(self):
+        self._reseed = False
+        try:
+            attitude = await self.feedback()
+        except Exception as e:
+            self.logger.error(f"Washout stage failed to read the attitude: {e}")
+            attitude = False
+        if attitude:
+            self._settle(attitude["pitch"], attitude["roll"])
+        else:
+            self._settle(*self._input)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        await self._event.wait()
+        if self._reseed:
+            await self._seed_from_feedback()
+        next_tick = loop.time()
+        next_reload = loop.time() + self.reload_interval
+        while True:
+            pitch, roll = self.step(*self._input)
+            self.ticks += 1
+            forwarded = self._forwarded
+            if forwarded is None or abs(pitch - forwarded[0]) > UNCHANGED_DEG or abs(roll - forwarded[1]) > UNCHANGED_DEG:
+                self._forwarded = (pitch, roll)
+                try:
+                    await self.downstream.rotate(pitch, roll)
+                    self.forwarded += 1
+                except Exception as e:
+                    self.logger.error(f"Washout stage failed to forward setpoint: {e}")
+            else:
+                self.unchanged += 1
+
+            if self.params_file and loop.time() >= next_reload:
+                next_reload = loop.time() + self.reload_interval
+                self._reload_file()
+
+            next_tick += self.period
+            if next_tick <= loop.time():
+                ### downstream slower than the filter rate, skip the missed ticks
+                next_tick = loop.time() + self.period
+            await asyncio.sleep(next_tick - loop.time())
+
+    def get_stats(self) -> dict:
+        return {
+            "rate_hz": self.rate,
+            "ticks": self.ticks,
+            "forwarded": self.forwarded,
+            "unchanged": self.unchanged,
+            "reloads": self.reloads,
+            "last_reload_error": self.last_reload_error,
+            "params": vars(self.params),
+        }
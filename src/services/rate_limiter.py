@@ -0,0 +1,98 @@
+import asyncio
+from time import perf_counter
+
+class RotateRateLimiter():
+    """
+    Token bucket rate limit of one clients rotates, rate setpoints per second
+    in bursts of up to burst. A rotate over the limit waits in a single pending
+    slot and is posted as soon as a token is free, a newer rotate replaces it
+    so the client loses stale poses instead of its newest one. Replaced
+    setpoints are counted and reported to on_summary at most once per
+    summary_interval as on_summary(coalesced, rate, burst), traced ones
+    also to on_dropped.
+    """
+    def __init__(self, post, rate, burst=1, on_dropped=None, on_summary=None, summary_interval=1.0):
+        self.post = post
+        self.on_dropped = on_dropped
+        self.on_summary = on_summary
+        self.summary_interval = summary_interval
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = self.burst
+        self._updated = perf_counter()
+        self._pending = None
+        self._release_handle = None
+        self._summary_handle = None
+        self._summary_coalesced = 0
+        self.passed = 0
+        self.released = 0
+        self.coalesced = 0
+
+    def set_limits(self, rate, burst=1):
+        self._refill(perf_counter())
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = min(self.tokens, self.burst)
+
+    def stop(self):
+        for handle in (self._release_handle, self._summary_handle):
+            if handle is not None:
+                handle.cancel()
+        self._release_handle = None
+        self._summary_handle = None
+        self._pending = None
+
+    def submit(self, pitch, roll, trace=None) -> bool:
+        """Posts the setpoint, or keeps it pending until a token is free. Returns True when it was posted right away"""
+        self._refill(perf_counter())
+        if self._pending is None and self.tokens >= 1:
+            self.tokens -= 1
+            self.passed += 1
+            self.post(pitch, roll, trace)
+            return True
+        if self._pending is not None:
+            self._coalesce(self._pending[2])
+        self._pending = (pitch, roll, trace)
+        if self._release_handle is None:
+            self._schedule_release()
+        return False
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _schedule_release(self):
+        self._release_handle = asyncio.get_running_loop().call_later((1 - self.tokens) / self.rate, self._release)
+
+    def _release(self):
+        self._release_handle = None
+        if self._pending is None:
+            return
+        self._refill(perf_counter())
+        ### timers may fire a little early
+        if self.tokens < 1:
+            self._schedule_release()
+            return
+        self.tokens -= 1
+        self.released += 1
+        pitch, roll, trace = self._pending
+        self._pending = None
+        self.post(pitch, roll, trace)
+
+    def _coalesce(self, trace):
+        self.coalesced += 1
+        self._summary_coalesced += 1
+        if trace is not None and self.on_dropped:
+            self.on_dropped(trace)
+        if self._summary_handle is None and self.on_summary:
+            self._summary_handle = asyncio.get_running_loop().call_later(self.summary_interval, self._summarize)
+
+    def _summarize(self):
+        self._summary_handle = None
+        coalesced = self._summary_coalesced
+        self._summary_coalesced = 0
+        self.on_summary(coalesced, self.rate, self.burst)
+
+    def get_stats(self) -> dict:
+        return {"rate": self.rate, "burst": self.burst, "passed": self.passed,
+                "released": self.released, "coalesced": self.coalesced}
@@ -0,0 +1,39 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+### Modbus FC3 can return at most 125 holding registers per request
+MAX_READ_REGISTERS = 125
+
+@dataclass
+class ReadBlock:
+    address: int
+    count: int
+    members: List[Tuple[str, int, int]] = field(default_factory=list) # (name, offset, count)
+
+def plan_reads(registers: Dict[str, Tuple[int, int]], max_gap=8, max_count=MAX_READ_REGISTERS) -> List[ReadBlock]:
+    """Merges the named (address, count) registers into as few FC3 block reads as possible.
+    Two registers share a block if the unread gap between them is at most max_gap
+    registers and the merged block stays within max_count registers.
+    Returns:
+        list[ReadBlock] sorted by address
+    """
+    blocks = []
+    for name, (address, count) in sorted(registers.items(), key=lambda item: item[1][0]):
+        if count < 1 or count > max_count:
+            raise ValueError(f"Invalid register count {count} for {name}")
+
+        if blocks:
+            block = blocks[-1]
+            block_end = block.address + block.count
+            merged_end = max(block_end, address + count)
+            if address - block_end <= max_gap and merged_end - block.address <= max_count:
+                block.count = merged_end - block.address
+                block.members.append((name, address - block.address, count))
+                continue
+
+        blocks.append(ReadBlock(address=address, count=count, members=[(name, 0, count)]))
+    return blocks
+
+def slice_block(block: ReadBlock, values) -> Dict[str, list]:
+    """Slices a block reads register values back into the named registers"""
+    return {name: values[offset:offset + count] for name, offset, count in block.members}
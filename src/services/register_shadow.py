@@ -0,0 +1,49 @@
+from typing import Iterable
+
+SIDES = ("left", "right")
+
+class RegisterShadow():
+    """
+    Per drive memory of the last value written to or read from each register.
+    Writes to shadowed registers whose values match the cached ones can be
+    skipped. Only registers that hold state belong here, command registers
+    like IEG_MOTION act on every write and must never be elided.
+    """
+    def __init__(self, shadowed_addresses: Iterable[int]):
+        self.shadowed = frozenset(shadowed_addresses)
+        self.values = {side: {} for side in SIDES}
+        self.elided = 0
+        self.issued = 0
+        self.invalidations = 0
+
+    def matches(self, side, address, values) -> bool:
+        """Returns True if the write can be elided and counts it"""
+        if address not in self.shadowed:
+            self.issued += 1
+            return False
+        cached = self.values[side]
+        for i, value in enumerate(values):
+            if cached.get(address + i) != value:
+                self.issued += 1
+                return False
+        self.elided += 1
+        return True
+
+    def update(self, side, address, values):
+        cached = self.values[side]
+        for i, value in enumerate(values):
+            cached[address + i] = value
+
+    def invalidate(self):
+        for side in SIDES:
+            self.values[side].clear()
+        self.invalidations += 1
+
+    def get_stats(self) -> dict:
+        total = self.elided + self.issued
+        return {
+            "issued": self.issued,
+            "elided": self.elided,
+            "elided_ratio": self.elided / total if total else 0.0,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,114 @@
+import asyncio
+import random
+from abc import ABC, abstractmethod
+from time import monotonic
+from typing import Optional
+from utils.utils import setup_logger
+
+class RetryPolicy(ABC):
+    """
+    Runs an attempt coroutine function that returns True on success
+    and decides if and when a failed attempt is retried.
+    Subclasses implement next_delay, returning None gives up.
+    """
+    def __init__(self, name, logger=None):
+        self.name = name
+        self.logger = setup_logger(logger)
+        self.calls = 0
+        self.retries = 0
+        self.give_ups = 0
+
+    @abstractmethod
+    def next_delay(self, attempts, elapsed) -> Optional[float]:
+        """Seconds to wait before the next attempt, None gives up"""
+
+    def attempt_timeout(self, elapsed) -> Optional[float]:
+        """Upper bound for a single attempt, None waits for the transports own timeout"""
+        return None
+
+    def on_give_up(self, description):
+        self.logger.error(f"Gave up on {description} ({self.name} policy)")
+
+    async def run(self, attempt, description) -> bool:
+        self.calls += 1
+        start = monotonic()
+        attempts = 0
+        while True:
+            attempts += 1
+            try:
+                timeout = self.attempt_timeout(monotonic() - start)
+                if timeout is None:
+                    success = await attempt()
+                else:
+                    success = await asyncio.wait_for(attempt(), timeout=timeout)
+            except Exception as e:
+                self.logger.error(f"Attempt {attempts} to {description} raised: {e}")
+                success = False
+
+            if success:
+                return True
+
+            delay = self.next_delay(attempts, monotonic() - start)
+            if delay is None:
+                self.give_ups += 1
+                self.on_give_up(description)
+                return False
+
+            self.retries += 1
+            self.logger.warning(f"Failed to {description}. Attempt {attempts}, retrying in {delay:.3f}s")
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    def get_stats(self) -> dict:
+        return {"calls": self.calls, "retries": self.retries, "give_ups": self.give_ups}
+
+class DeadlinePolicy(RetryPolicy):
+    """For setpoints, retries only while the value is still fresh
+    and then gives up so the next setpoint can win"""
+    def __init__(self, deadline, retry_delay=0.005, logger=None):
+        super().__init__("deadline", logger)
+        self.deadline = deadline
+        self.retry_delay = retry_delay
+
+    def attempt_timeout(self, elapsed) -> Optional[float]:
+        return max(0.0, self.deadline - elapsed)
+
+    def next_delay(self, attempts, elapsed) -> Optional[float]:
+        if elapsed + self.retry_delay >= self.deadline:
+            return None
+        return self.retry_delay
+
+    def on_give_up(self, description):
+        self.logger.warning(f"Dropped stale setpoint, {description} did not succeed within {self.deadline}s")
+
+class BackoffPolicy(RetryPolicy):
+    """For configuration and homing, exponential backoff with jitter"""
+    def __init__(self, base_delay=0.05, max_delay=1.0, max_retries=10, jitter=0.25, logger=None):
+        super().__init__("backoff", logger)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retries = max_retries
+        self.jitter = jitter
+
+    def next_delay(self, attempts, elapsed) -> Optional[float]:
+        if attempts > self.max_retries:
+            return None
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+class EscalatePolicy(RetryPolicy):
+    """For stop, retries right away a few times and escalates if that does not help"""
+    def __init__(self, immediate_retries=2, on_escalate=None, logger=None):
+        super().__init__("escalate", logger)
+        self.immediate_retries = immediate_retries
+        self.on_escalate = on_escalate
+
+    def next_delay(self, attempts, elapsed) -> Optional[float]:
+        if attempts > self.immediate_retries:
+            return None
+        return 0.0
+
+    def on_give_up(self, description):
+        self.logger.critical(f"Failed to {description} after {self.immediate_retries} immediate retries, escalating!")
+        if self.on_escalate:
+            self.on_escalate(description)
@@ -0,0 +1,225 @@
+import asyncio
+import math
+from time import perf_counter
+from helpers.motor_api_helper import calculate_target_revs
+from utils.utils import setup_logger, convert_to_revs
+
+LINEAR = "linear"
+HERMITE = "hermite"
+SETTLED_REVS = 0.001 # output counts as having reached a keyframe within this
+STATS_ALPHA = 0.1 # smoothing of the measured output interval and latency
+MIN_STEP = 0.001 # s
+
+class SetpointInterpolator():
+    """
+    Upsamples sparse rotate setpoints (keyframes) to a fixed control rate.
+    Stands in for MotorApi in the SetpointMailbox: rotate() only turns the
+    pose into actuator revs and starts a new segment from the current output
+    to it, the control loop then writes one interpolated revs setpoint every
+    1/rate seconds. Segments last the measured keyframe interval, so the
+    interpolation adds about one keyframe interval of latency. Linear
+    segments are straight ramps, hermite segments are cubic and continuous
+    in velocity with the finite difference slope of the keyframes as the end
+    velocity. The output is limited to MAX_VEL/MAX_ACC (rpm, rpm/s) and the
+    POS_MIN/MAX_REVS position limits, it brakes early enough not to
+    overshoot the newest keyframe.
+    """
+    def __init__(self, motor_api, logger=None, rate=100, mode=HERMITE, max_interval=0.2):
+        if mode not in (LINEAR, HERMITE):
+            raise ValueError(f"Unknown interpolation mode: {mode}")
+        self.motor_api = motor_api
+        self.config = motor_api.config
+        self.logger = setup_logger(logger)
+        self.period = 1.0 / rate
+        self.mode = mode
+        self.max_interval = max_interval
+        self.max_vel = self.config.MAX_VEL / 60
+        self.max_acc = self.config.MAX_ACC / 60
+        self.interval = min(0.05, max_interval) # estimated keyframe interval
+        self.position = None # [left, right] revs of the last output
+        self.velocity = [0.0, 0.0]
+        self._segment = None
+        self._last_keyframe = None
+        self._keyframe_at = None
+        self._last_write = None
+        self._event = asyncio.Event()
+        self._task = None
+        self.keyframes = 0
+        self.writes = 0
+        self.failed_writes = 0
+        self.vel_limited = 0
+        self.acc_limited = 0
+        self.output_interval = 0.0
+        self.added_latency = 0.0
+        self.max_added_latency = 0.0
+        self.superseded = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def reset(self):
+        """Drops the segment and the output position, others (trajectory playback, modbusvalues)
+        are about to move the drives. The next keyframe starts again from the position feedback"""
+        running = self._task is not None
+        self.stop()
+        self._segment = None
+        self._last_keyframe = None
+        self._keyframe_at = None
+        self.position = None
+        self.velocity = [0.0, 0.0]
+        self._event.clear()
+        if running:
+            self.start()
+
+    async def rotate(self, pitch, roll, trace=None):
+        """Takes a new keyframe, the trace is acknowledged once the keyframe is accepted"""
+        revs = calculate_target_revs(self.motor_api, pitch_value=pitch, roll_value=roll)
+        if revs is None:
+            return
+        now = perf_counter()
+        if trace is not None:
+            trace["kinematics"] = now
+        self._add_keyframe([revs[0], revs[1]], now)
+        if trace is not None:
+            trace["written"] = perf_counter()
+            trace["success"] = True
+
+    def _add_keyframe(self, target, now):
+        self.keyframes += 1
+        if self._last_keyframe is not None:
+            gap = now - self._last_keyframe[1]
+            ### idle gaps are not keyframe intervals
+            if gap <= self.max_interval:
+                self.interval += STATS_ALPHA * (max(gap, self.period) - self.interval)
+            slope = [(target[i] - self._last_keyframe[0][i]) / max(gap, self.period) for i in range(2)] if gap <= self.max_interval else [0.0, 0.0]
+        else:
+            slope = [0.0, 0.0]
+        self._last_keyframe = (target, now)
+        if self._keyframe_at is not None:
+            self.superseded += 1
+        self._keyframe_at = now
+        start = self.position if self.position is not None else target
+        self._segment = (list(start), list(self.velocity), target, slope, now, self.interval)
+        self._event.set()
+
+    def _sample(self, now) -> list:
+        """Position the segment asks for at now"""
+        p0, v0, p1, v1, t0, duration = self._segment
+        s = min(1.0, (now - t0) / duration)
+        if self.mode == LINEAR:
+            return [p0[i] + (p1[i] - p0[i]) * s for i in range(2)]
+        s2 = s * s
+        s3 = s2 * s
+        h00 = 2*s3 - 3*s2 + 1
+        h10 = s3 - 2*s2 + s
+        h01 = -2*s3 + 3*s2
+        h11 = s3 - s2
+        return [h00*p0[i] + h10*duration*v0[i] + h01*p1[i] + h11*duration*v1[i] for i in range(2)]
+
+    def _limit(self, desired, dt) -> list:
+        """Moves the output towards desired within the velocity, acceleration and position limits"""
+        target = self._segment[2]
+        position = []
+        for i in range(2):
+            velocity = (desired[i] - self.position[i]) / dt
+            if abs(velocity) > self.max_vel:
+                velocity = math.copysign(self.max_vel, velocity)
+                self.vel_limited += 1
+            change = velocity - self.velocity[i]
+            if abs(change) > self.max_acc * dt:
+                velocity = self.velocity[i] + math.copysign(self.max_acc * dt, change)
+                self.acc_limited += 1
+            ### never pass the newest keyframe, brake in time to stop on it
+            remaining = target[i] - self.position[i]
+            if velocity * remaining > 0:
+                velocity = math.copysign(min(abs(velocity), math.sqrt(2 * self.max_acc * abs(remaining)), abs(remaining) / dt), velocity)
+            new_position = min(max(self.position[i] + velocity * dt, self.config.POS_MIN_REVS), self.config.POS_MAX_REVS)
+            self.velocity[i] = (new_position - self.position[i]) / dt
+            position.append(new_position)
+        return position
+
+    def _reached(self) -> bool:
+        target = self._segment[2]
+        return all(abs(target[i] - self.position[i]) < SETTLED_REVS for i in range(2))
+
+    def _settled(self) -> bool:
+        return self._reached() and all(abs(velocity) < SETTLED_REVS for velocity in self.velocity)
+
+    async def _initial_position(self):
+        """Starts from the drives position feedback, or the first keyframe if it can't be read"""
+        result = await self.motor_api.get_current_revs()
+        if result:
+            self.position = [convert_to_revs(result[0]), convert_to_revs(result[1])]
+        else:
+            self.position = list(self._segment[2])
+        self._segment = (list(self.position), [0.0, 0.0]) + self._segment[2:]
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._event.wait()
+            self._event.clear()
+            if self._segment is None:
+                continue
+            if self.position is None:
+                await self._initial_position()
+
+            ### drift free control ticks until the output settles on the newest keyframe,
+            ### never faster than the control rate
+            last_write = self._last_write
+            if last_write is not None and loop.time() - last_write < self.period:
+                await asyncio.sleep(last_write + self.period - loop.time())
+            next_tick = loop.time()
+            while True:
+                now = loop.time()
+                dt = min(max(MIN_STEP, now - last_write), self.period) if last_write is not None else self.period
+                position = self._limit(self._sample(perf_counter()), dt)
+                self.position = position
+                try:
+                    if not await self.motor_api.write_revs_setpoint(position[0], position[1]):
+                        self.failed_writes += 1
+                except Exception as e:
+                    self.failed_writes += 1
+                    self.logger.error(f"Interpolator failed to write setpoint: {e}")
+                self.writes += 1
+                if last_write is not None and now - last_write < self.max_interval:
+                    self.output_interval += STATS_ALPHA * (now - last_write - self.output_interval)
+                last_write = self._last_write = now
+
+                ### added latency: keyframe arrival until the output reaches it
+                if self._keyframe_at is not None and self._reached():
+                    latency = perf_counter() - self._keyframe_at
+                    self.added_latency += STATS_ALPHA * (latency - self.added_latency)
+                    self.max_added_latency = max(self.max_added_latency, latency)
+                    self._keyframe_at = None
+                if self._settled():
+                    self.velocity = [0.0, 0.0]
+                    break
+
+                next_tick += self.period
+                if next_tick <= loop.time():
+                    ### writes slower than the control rate, skip the missed ticks
+                    next_tick = loop.time() + self.period
+                await asyncio.sleep(next_tick - loop.time())
+
+    def get_stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "rate_hz": 1.0 / self.period,
+            "output_rate_hz": 1.0 / self.output_interval if self.output_interval else 0.0,
+            "keyframe_interval_s": self.interval,
+            "added_latency_s": self.added_latency,
+            "max_added_latency_s": self.max_added_latency,
+            "keyframes": self.keyframes,
+            "superseded": self.superseded,
+            "writes": self.writes,
+            "failed_writes": self.failed_writes,
+            "vel_limited": self.vel_limited,
+            "acc_limited": self.acc_limited,
+        }
@@ -0,0 +1,78 @@
+import asyncio
+from time import monotonic, perf_counter
+from utils.utils import setup_logger
+
+class SetpointMailbox():
+    """
+    Latest value wins mailbox for rotate setpoints. Posting overwrites the
+    single pending slot and one actuator task always writes the newest
+    setpoint, so at most one write is in progress and one is waiting
+    no matter how fast the client sends. Overwritten setpoints are
+    counted as coalesced. Setpoints posted with a trace dict get their
+    stage timestamps filled in and are reported to on_done or on_dropped.
+    """
+    def __init__(self, motor_api, logger=None, on_done=None, on_dropped=None):
+        self.motor_api = motor_api
+        self.logger = setup_logger(logger)
+        self.on_done = on_done
+        self.on_dropped = on_dropped
+        self._pending = None
+        self._event = asyncio.Event()
+        self._task = None
+        self.posted = 0
+        self.executed = 0
+        self.coalesced = 0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._pending = None
+
+    def post(self, pitch, roll, trace=None):
+        self.posted += 1
+        if self._pending is not None:
+            self.coalesced += 1
+            superseded = self._pending[3]
+            if superseded is not None and self.on_dropped:
+                self.on_dropped(superseded)
+        self._pending = (pitch, roll, monotonic(), trace)
+        self._event.set()
+
+    async def _run(self):
+        while True:
+            await self._event.wait()
+            self._event.clear()
+            pending = self._pending
+            self._pending = None
+            if pending is None:
+                continue
+
+            pitch, roll, posted_at, trace = pending
+            try:
+                if trace is not None:
+                    trace["dequeued"] = perf_counter()
+                await self.motor_api.rotate(pitch, roll, trace)
+                self.executed += 1
+                self.last_latency = monotonic() - posted_at
+                self.max_latency = max(self.max_latency, self.last_latency)
+                if trace is not None and self.on_done:
+                    self.on_done(trace)
+            except Exception as e:
+                self.logger.error(f"Actuator task failed to write setpoint: {e}")
+
+    def get_stats(self) -> dict:
+        return {
+            "posted": self.posted,
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "pending": self._pending is not None,
+            "last_latency_s": self.last_latency,
+            "max_latency_s": self.max_latency,
+        }
@@ -0,0 +1,119 @@
+import math
+from collections import deque
+from time import perf_counter
+from utils.utils import setup_logger
+
+AXES = 2 # pitch, roll
+MAX_GAP = 0.25 # s, a longer pause between setpoints restarts the history
+MIN_DET = 1e-18
+STATS_ALPHA = 0.05 # smoothing of the reported correction
+
+class SetpointPredictor():
+    """
+    Latency compensation in front of the kinematics. Fits the velocity (and
+    with order 2 the acceleration) of the clients pitch/roll to the last
+    history setpoints by least squares and extrapolates each setpoint
+    forward by the pipeline latency: the live modbus round trip of the
+    motor_api plus extra_latency for the websocket and drive response and
+    the time since the hub received it, at most max_horizon seconds and
+    clamp degrees. The predicted pose goes
+    to the downstream setpoint sink.
+    """
+    def __init__(self, downstream, motor_api, logger=None, extra_latency=0.01, max_horizon=0.1, clamp=2.0, history=5, order=2):
+        if order not in (1, 2):
+            raise ValueError(f"Prediction order must be 1 or 2, not {order}")
+        self.downstream = downstream
+        self.motor_api = motor_api
+        self.logger = setup_logger(logger)
+        self.extra_latency = extra_latency
+        self.max_horizon = max_horizon
+        self.clamp = clamp
+        self.order = order
+        self._history = deque(maxlen=max(history, order + 1))
+        self.horizon = 0.0
+        self.predicted = 0
+        self.clamped = 0
+        self.resets = 0
+        self.correction = 0.0 # smoothed absolute extrapolation, deg
+
+    def get_horizon(self, age=0.0) -> float:
+        """Pipeline latency plus the age of the newest setpoint, at most max_horizon"""
+        return min(age + self.motor_api.modbus_rtt + self.extra_latency, self.max_horizon)
+
+    async def rotate(self, pitch, roll, trace=None):
+        ### sampled at the hubs receive time, the wait in the rate limiter and mailbox doesn't skew the fit
+        now = perf_counter()
+        received = trace.get("received") if trace is not None else None
+        sampled = received if received is not None else now
+        history = self._history
+        if history and sampled - history[-1][0] > MAX_GAP:
+            history.clear()
+            self.resets += 1
+        history.append((sampled, (float(pitch), float(roll))))
+        pitch, roll = self.predict(self.get_horizon(now - sampled))
+        await self.downstream.rotate(pitch, roll, trace)
+
+    def _fit(self) -> list:
+        """[(velocity, acceleration)] per axis at the newest setpoint, None with too little history"""
+        history = self._history
+        newest = history[-1][0]
+        times = [t - newest for t, _ in history]
+        n = len(times)
+        order = min(self.order, n - 1)
+        if order < 1:
+            return None
+        s1 = sum(times)
+        s2 = sum(t * t for t in times)
+        if order == 2:
+            s3 = sum(t ** 3 for t in times)
+            s4 = sum(t ** 4 for t in times)
+            det = n * (s2 * s4 - s3 * s3) - s1 * (s1 * s4 - s3 * s2) + s2 * (s1 * s3 - s2 * s2)
+            if abs(det) < MIN_DET:
+                order = 1
+        if order == 1:
+            det = n * s2 - s1 * s1
+            if abs(det) < MIN_DET:
+                return None
+
+        fit = []
+        for axis in range(AXES):
+            x = [pose[axis] for _, pose in history]
+            sx = sum(x)
+            stx = sum(t * v for t, v in zip(times, x))
+            if order == 1:
+                fit.append(((n * stx - s1 * sx) / det, 0.0))
+                continue
+            st2x = sum(t * t * v for t, v in zip(times, x))
+            ### Cramer's rule for x = c0 + c1 t + c2 t^2
+            c1 = (n * (stx * s4 - s3 * st2x) - sx * (s1 * s4 - s3 * s2) + s2 * (s1 * st2x - stx * s2)) / det
+            c2 = (n * (s2 * st2x - stx * s3) - s1 * (s1 * st2x - stx * s2) + sx * (s1 * s3 - s2 * s2)) / det
+            fit.append((c1, 2 * c2))
+        return fit
+
+    def predict(self, horizon) -> list:
+        """Newest setpoint extrapolated horizon seconds forward"""
+        pose = list(self._history[-1][1])
+        self.horizon = horizon
+        fit = self._fit()
+        if fit is None or horizon <= 0:
+            return pose
+        self.predicted += 1
+        for axis, (velocity, acceleration) in enumerate(fit):
+            change = velocity * horizon + 0.5 * acceleration * horizon * horizon
+            if abs(change) > self.clamp:
+                change = math.copysign(self.clamp, change)
+                self.clamped += 1
+            self.correction += STATS_ALPHA * (abs(change) - self.correction)
+            pose[axis] += change
+        return pose
+
+    def get_stats(self) -> dict:
+        return {
+            "horizon_s": self.horizon,
+            "modbus_rtt_s": self.motor_api.modbus_rtt,
+            "extra_latency_s": self.extra_latency,
+            "predicted": self.predicted,
+            "clamped": self.clamped,
+            "resets": self.resets,
+            "mean_correction_deg": self.correction,
+        }
@@ -0,0 +1,91 @@
+import asyncio
+from time import perf_counter
+from utils.utils import setup_logger
+
+class TelemetrySubscriptions():
+    """
+    Push subscriptions of telemetry topics. acquire maps a topic to an async
+    function returning a dict of fields (False when the read failed). One
+    acquisition task per topic polls at the highest rate its subscribers asked
+    for, each subscriber gets the samples decimated to its own rate with
+    send(wsclient, message). A topic's task stops with its last subscriber,
+    so nothing is read from the drives while nobody is listening.
+    """
+    def __init__(self, acquire, send, max_rates=None, logger=None):
+        self.acquire = acquire
+        self.send = send
+        self.max_rates = max_rates or {}
+        self.logger = setup_logger(logger)
+        self._subscribers = {topic: {} for topic in acquire}
+        self._tasks = {}
+        self.stats = {topic: {"samples": 0, "failed": 0, "sent": 0} for topic in acquire}
+
+    @property
+    def topics(self) -> tuple:
+        return tuple(self.acquire)
+
+    def subscribe(self, wsclient, topic, rate) -> float:
+        """Returns the rate the subscriber gets, limited to the topics max rate. Rate <= 0 unsubscribes"""
+        if topic not in self.acquire:
+            raise ValueError(f"Unknown topic {topic}, topics: {', '.join(self.acquire)}")
+        rate = min(float(rate), float(self.max_rates.get(topic, rate)))
+        if rate <= 0:
+            self.unsubscribe(wsclient, topic)
+            return 0.0
+        ### next_due of a new subscriber is now, it gets the next sample
+        self._subscribers[topic][wsclient] = {"rate": rate, "next_due": 0.0}
+        if topic not in self._tasks or self._tasks[topic].done():
+            self._tasks[topic] = asyncio.create_task(self._run(topic))
+        return rate
+
+    def unsubscribe(self, wsclient, topic=None):
+        """From one topic or, with topic None, from all of them"""
+        for name in (topic,) if topic else self.topics:
+            self._subscribers[name].pop(wsclient, None)
+            if not self._subscribers[name]:
+                task = self._tasks.pop(name, None)
+                if task is not None:
+                    task.cancel()
+
+    def stop(self):
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks = {}
+        for subscribers in self._subscribers.values():
+            subscribers.clear()
+
+    async def _run(self, topic):
+        subscribers = self._subscribers[topic]
+        stats = self.stats[topic]
+        while subscribers:
+            started = perf_counter()
+            interval = 1 / max(subscriber["rate"] for subscriber in subscribers.values())
+            try:
+                sample = await self.acquire[topic]()
+            except Exception as e:
+                self.logger.error(f"Error while acquiring {topic}: {e}")
+                sample = False
+            if not sample:
+                stats["failed"] += 1
+            else:
+                stats["samples"] += 1
+                now = perf_counter()
+                message = f"event=telemetry|topic={topic}|time={now}|" + "".join(f"{key}={val}|" for key, val in sample.items())
+                sends = []
+                for wsclient, subscriber in subscribers.items():
+                    ### half an acquisition interval of slack so a rate equal to the loop rate gets every sample
+                    if now + interval / 2 < subscriber["next_due"]:
+                        continue
+                    due = subscriber["next_due"] + 1 / subscriber["rate"]
+                    ### a subscriber that fell behind (or just subscribed) restarts its schedule from now
+                    subscriber["next_due"] = due if due > now else now + 1 / subscriber["rate"]
+                    sends.append(self.send(wsclient, message))
+                stats["sent"] += len(sends)
+                await asyncio.gather(*sends)
+            await asyncio.sleep(max(0.0, interval - (perf_counter() - started)))
+
+    def get_stats(self) -> dict:
+        return {topic: {"active": topic in self._tasks, "subscribers": len(self._subscribers[topic]),
+                        "rate": max((subscriber["rate"] for subscriber in self._subscribers[topic].values()), default=0.0),
+                        **self.stats[topic]}
+                for topic in self.topics}
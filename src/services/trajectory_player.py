@@ -0,0 +1,193 @@
+import asyncio
+import numpy as np
+from helpers.batch_kinematics import calculate_motion_batch
+from helpers.motor_api_helper import clamp_target_revs
+from utils.utils import setup_logger
+
+IDLE = "idle"
+LOADED = "loaded"
+PLAYING = "playing"
+PAUSED = "paused"
+FINISHED = "finished"
+ABORTED = "aborted"
+
+class TrajectoryPlayer():
+    """
+    Plays an uploaded timestamped pitch/roll trajectory. The kinematics for
+    every sample are computed once at load, playback writes them against
+    the start time (start + sample time) so sleep overshoot never
+    accumulates. A sample that is already late when the previous write
+    completes is skipped in favour of the newest due one. on_progress gets
+    (state, position_s, duration_s, index) on every state change and every
+    progress_interval seconds while playing. The setpoint stages (washout,
+    interpolator) are reset when playback starts so they don't write during
+    it, they seed from the position feedback on the next rotate.
+    """
+    def __init__(self, motor_api, logger=None, on_progress=None, progress_interval=0.5, max_samples=360000, stages=()):
+        self.motor_api = motor_api
+        self.stages = stages
+        self.logger = setup_logger(logger)
+        self.on_progress = on_progress
+        self.progress_interval = progress_interval
+        self.max_samples = max_samples
+        self.state = IDLE
+        self.times = None
+        self.setpoints = None
+        self.index = 0
+        self.position = 0.0
+        self._upload = []
+        self._task = None
+        self.played = 0
+        self.skipped = 0
+        self.failed_writes = 0
+        self.max_lateness = 0.0
+
+    @property
+    def duration(self) -> float:
+        return float(self.times[-1]) if self.times is not None else 0.0
+
+    def append_samples(self, samples):
+        """samples: flat [t, pitch, roll, t, pitch, roll, ...] chunk of an upload"""
+        if self.state == PLAYING:
+            raise ValueError("Can't upload while a trajectory is playing")
+        chunk = np.asarray(samples, dtype=np.float64)
+        if chunk.size % 3:
+            raise ValueError("Samples must be time, pitch, roll triplets")
+        if sum(len(part) for part in self._upload) + chunk.size // 3 > self.max_samples:
+            self._upload = []
+            raise ValueError(f"Trajectory is longer than {self.max_samples} samples")
+        self._upload.append(chunk.reshape(-1, 3))
+
+    def load(self):
+        """Finishes the upload and precomputes the setpoints of every sample"""
+        if not self._upload:
+            raise ValueError("No samples uploaded")
+        samples = np.concatenate(self._upload)
+        self._upload = []
+        times, pitch, roll = samples[:, 0], samples[:, 1], samples[:, 2]
+        if not np.all(np.isfinite(samples)):
+            raise ValueError("Samples must be finite numbers")
+        if np.any(np.diff(times) < 0):
+            raise ValueError("Sample times must be increasing")
+
+        motion = calculate_motion_batch(pitch, roll, self.motor_api.config)
+        if self.motor_api.analog_mode:
+            setpoints = list(zip(motion["left_modbuscntrl"].tolist(), motion["right_modbuscntrl"].tolist()))
+        else:
+            setpoints = [clamp_target_revs(left, right, self.motor_api.config)
+                         for left, right in zip(motion["left_revs"].tolist(), motion["right_revs"].tolist())]
+        self.times = times - times[0]
+        self.setpoints = setpoints
+        self.index = 0
+        self.position = 0.0
+        self._set_state(LOADED)
+
+    def start(self):
+        """Starts or resumes playback from the current position"""
+        if self.times is None:
+            raise ValueError("No trajectory loaded")
+        if self.state == PLAYING:
+            return
+        if self.state in (FINISHED, ABORTED):
+            self.seek(0.0)
+        ### the rotate deadband compares against values written before the playback
+        if getattr(self.motor_api, "deadband", None) is not None:
+            self.motor_api.deadband.reset()
+        for stage in self.stages:
+            stage.reset()
+        self._task = asyncio.create_task(self._play())
+        self._set_state(PLAYING)
+
+    def pause(self):
+        if self.state != PLAYING:
+            return
+        self._cancel()
+        self._set_state(PAUSED)
+
+    def seek(self, position):
+        if self.times is None:
+            raise ValueError("No trajectory loaded")
+        position = min(max(0.0, float(position)), self.duration)
+        playing = self.state == PLAYING
+        self._cancel()
+        self.index = int(np.searchsorted(self.times, position))
+        self.position = position
+        if playing:
+            self._task = asyncio.create_task(self._play())
+        self._report()
+
+    def abort(self):
+        if self.state in (IDLE, ABORTED):
+            return
+        self._cancel()
+        self.index = 0
+        self.position = 0.0
+        self._set_state(ABORTED)
+
+    def is_playing(self) -> bool:
+        return self.state == PLAYING
+
+    def _cancel(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _write(self, setpoint) -> bool:
+        if self.motor_api.analog_mode:
+            return await self.motor_api.set_analog_modbus_cntrl(setpoint)
+        return await self.motor_api.set_host_position(setpoint)
+
+    async def _play(self):
+        loop = asyncio.get_running_loop()
+        start = loop.time() - self.position
+        next_report = loop.time()
+        times = self.times
+        count = len(times)
+        try:
+            while self.index < count:
+                delay = start + times[self.index] - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                now = loop.time()
+                ### behind schedule -> jump to the newest due sample
+                due = int(np.searchsorted(times, now - start, side="right")) - 1
+                if due > self.index:
+                    self.skipped += due - self.index
+                    self.index = due
+                self.max_lateness = max(self.max_lateness, float(now - start - times[self.index]))
+
+                if not await self._write(self.setpoints[self.index]):
+                    self.failed_writes += 1
+                self.played += 1
+                self.position = float(times[self.index])
+                self.index += 1
+
+                if loop.time() >= next_report:
+                    next_report = loop.time() + self.progress_interval
+                    self._report()
+            self._task = None
+            self._set_state(FINISHED)
+        except Exception as e:
+            self.logger.error(f"Trajectory playback failed: {e}")
+            self._task = None
+            self._set_state(ABORTED)
+
+    def _set_state(self, state):
+        self.state = state
+        self._report()
+
+    def _report(self):
+        if self.on_progress:
+            self.on_progress(self.state, self.position, self.duration, self.index)
+
+    def get_stats(self) -> dict:
+        return {
+            "state": self.state,
+            "samples": len(self.times) if self.times is not None else 0,
+            "position_s": self.position,
+            "duration_s": self.duration,
+            "played": self.played,
+            "skipped": self.skipped,
+            "failed_writes": self.failed_writes,
+            "max_lateness_s": self.max_lateness,
+        }
@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+from pathlib import Path
 
 @dataclass
 class Config:
@@ -21,5 +22,72 @@ class Config:
     LAST_TID: int = 20000
     CONNECTION_TRY_COUNT = 5
 
-    #Motorapi rate limit
-    RATELIMIT = 60
\ No newline at end of file
+    ### Pipelined modbus transport, keeps MAX_IN_FLIGHT requests outstanding per drive
+    PIPELINED_TRANSPORT: bool = False
+    MAX_IN_FLIGHT: int = 4
+
+    ### Lean transport, preallocated frames for the setpoint and feedback hot path.
+    ### Used when the pipelined transport is off
+    LEAN_TRANSPORT: bool = False
+
+    ### Bus owner, the hub owns the drive connections and the other
+    ### processes reach the drives through its gateway ports
+    BUS_OWNER: bool = True
+    USE_BUS_OWNER: bool = False
+    BUS_OWNER_HOST: str = "127.0.0.1"
+    BUS_OWNER_PORT_LEFT: int = 5502
+    BUS_OWNER_PORT_RIGHT: int = 5503
+    BUS_QUEUE_DEPTHS = (8, 4, 16, 16) # safety stop, setpoint, fault poll, telemetry
+    BUS_STARVATION_TIME: float = 0.5
+
+    ### Hub command queues, each served by its own worker so slow commands don't delay the motion
+    COMMAND_QUEUE_DEPTHS = (64, 16, 16) # motion, control, query
+
+    ### Hot path timing spans, served by the stats action. Off costs one flag check per span
+    INSTRUMENTATION: bool = False
+    INSTRUMENTATION_RING_SIZE: int = 1024
+
+    ### Setpoint interpolation, upsamples rotate setpoints to INTERPOLATION_RATE within MAX_VEL/MAX_ACC
+    INTERPOLATION: bool = False
+    INTERPOLATION_RATE: int = 100 # Hz
+    INTERPOLATION_MODE: str = "hermite" # linear | hermite
+
+    ### Washout (motion cueing) of the rotate attitude in front of the kinematics,
+    ### parameters in settings/washout_config.py, WASHOUT_FILE overrides them and is reloaded when it changes
+    WASHOUT: bool = False
+    WASHOUT_RATE: int = 100 # Hz
+    WASHOUT_FILE: str = str(Path(__file__).parent / "washout.json")
+    WASHOUT_RELOAD_INTERVAL: float = 1.0 # s
+
+    ### Latency compensation, extrapolates the rotate setpoints by the measured modbus
+    ### round trip + PREDICTION_EXTRA_LATENCY (websocket, drive response)
+    PREDICTION: bool = False
+    PREDICTION_EXTRA_LATENCY: float = 0.01 # s
+    PREDICTION_MAX_HORIZON: float = 0.1 # s
+    PREDICTION_CLAMP: float = 2.0 # deg
+    PREDICTION_HISTORY: int = 5 # setpoints in the velocity/acceleration fit
+    PREDICTION_ORDER: int = 2 # 1 = velocity, 2 = velocity and acceleration
+
+    ### Rotate deadband, writes that move a drive less than MotorConfig.DEADBANDREVS are skipped
+    DEADBAND: bool = False
+
+    ### Kinematics calibration captures
+    CALIBRATION_DIR: str = str(Path(__file__).parent.parent / "calibration")
+
+    ### Binary rotate frames (utils/binary_frames.py) for clients that ask for them at identify
+    BINARY_FRAMES: bool = True
+
+    ### Telemetry push subscriptions, highest acquisition rate per topic
+    SUBSCRIPTION_MAX_RATES = {"telemetry": 10, "positions": 50, "status": 10}
+
+    ### Trajectory playback
+    TRAJECTORY_PROGRESS_INTERVAL: float = 0.5 # s between progress events while playing
+    TRAJECTORY_MAX_SAMPLES: int = 360000
+
+    #Motorapi rate limit, token bucket of RATELIMIT rotates per second in bursts of RATELIMIT_BURST per client,
+    #rotates over the limit replace the waiting one
+    RATELIMIT = 60
+    RATELIMIT_BURST = 2
+    ### identity -> (rate hz, burst) for clients with their own limits
+    RATELIMIT_IDENTITIES = {}
+    RATELIMIT_SUMMARY_INTERVAL = 1.0 # s, at most one event=ratelimit per client per interval
\ No newline at end of file
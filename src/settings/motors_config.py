@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+from pathlib import Path
 # TODO: jos on on tylsää muokkaa nimiä lisää!
 @dataclass
 class MotorConfig:
@@ -44,6 +45,18 @@ class MotorConfig:
     BOARD_TMP = 11
     VBUS = 570 # 11.21
 
+    ### READ PLANNER
+    ### registers closer than this many unread registers are read in one block
+    READ_PLANNER_MAX_GAP = 8
+
+    ### RETRY POLICIES
+    SETPOINT_DEADLINE = 0.05 # s, after this a setpoint is stale and the next one wins
+    SETPOINT_RETRY_DELAY = 0.005
+    BACKOFF_BASE_DELAY = 0.05
+    BACKOFF_MAX_DELAY = 1.0
+    BACKOFF_JITTER = 0.25
+    STOP_IMMEDIATE_RETRIES = 3
+
     ### OPERATION MODES
     COMMAND_MODE = 4303
     DISABLED = 0
@@ -83,7 +96,15 @@ class MotorConfig:
     
     ### control
     DEADBANDREVS = 0.5
+    ### rotate deadband hysteresis, a tracking drive keeps following changes above DEADBAND_RELEASE_REVS
+    DEADBAND_RELEASE_REVS = 0.05
+    DEADBAND_MAX_HOLD = 0.3 # s a suppressed target waits before it is written anyway
 
-    MAX_ANGLE_COMBO = 5.625
-    
-    
\ No newline at end of file
+    ### rotate angle limits (deg), the actuator limits shape the feasible pose envelope inside them
+    MAX_PITCH = 9
+    MAX_ROLL = 17
+
+    ### kinematics coefficient sets, the hub loads KINEMATICS_VERSION (None = the active one) at startup
+    KINEMATICS_FILE = str(Path(__file__).parent / "kinematics.json")
+    KINEMATICS_VERSION = None
+    KINEMATICS_MODEL = None # loaded KinematicsModel, None = the built in one
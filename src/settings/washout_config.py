@@ -0,0 +1,29 @@
+from dataclasses import dataclass, fields
+
+@dataclass
+class WashoutConfig:
+    ### onset cue, high passed attitude that washes back to neutral
+    HP_CUTOFF: float = 0.3 # Hz
+    HP_GAIN: float = 1.0
+
+    ### tilt coordination, the sustained attitude rendered slowly
+    TILT_CUTOFF: float = 0.3 # Hz
+    TILT_GAIN: float = 1.0
+    TILT_RATE_LIMIT: float = 3.0 # deg/s, keep below the vestibular threshold
+
+    ### output smoothing
+    OUTPUT_CUTOFF: float = 8.0 # Hz
+
+    Q: float = 0.7071 # butterworth
+
+    def update(self, values: dict) -> list:
+        """Sets the known fields from values (json keys are case insensitive), returns the names updated"""
+        names = {field.name for field in fields(self)}
+        updated = []
+        for key, value in values.items():
+            name = key.upper()
+            if name not in names:
+                raise ValueError(f"Unknown washout parameter: {key}")
+            setattr(self, name, float(value))
+            updated.append(name)
+        return updated
@@ -0,0 +1,296 @@
+"""
+Local Modbus TCP simulator of the Tritex II register map used in MotorConfig.
+Serves the left drive on 127.0.0.1 and the right drive on 127.0.0.2, run from the src directory:
+    python -m simulator.tritex_simulator --port 5020 --rtt 0.002 --jitter 0.0005
+and point the hub at it:
+    python CommunicationHub.py --server_left 127.0.0.1 --server_right 127.0.0.2 --port 5020
+"""
+import argparse
+import asyncio
+import random
+from settings.motors_config import MotorConfig
+from constants.fault_codes import ABSOLUTE_FAULTS
+from services.modbus_transport import (split_frames, decode_request, encode_read_response, encode_write_response,
+                                       encode_exception_response, READ_HOLDING_REGISTERS, WRITE_SINGLE_REGISTER,
+                                       WRITE_MULTIPLE_REGISTERS, ILLEGAL_FUNCTION)
+from utils.utils import is_nth_bit_on, setup_logger
+from utils.fixed_point import POS32, VEL32, ACC32, UCUR32, VOLT32
+
+### OEG_STATUS bits
+ENABLED_BIT = 0
+HOMED_BIT = 1
+READY_BIT = 2
+FAULTED_BIT = 3
+STARTUP_COMPLETE_BIT = 12
+### OEG_MOTION bits
+IN_POSITION_BIT = 12
+### IEG bits
+ENABLE_MAINTAINED_BIT = 1
+STOP_BIT = 2
+HOME_BIT = 8
+RESET_FAULT_BIT = 15
+
+MOTION_STEP = 0.001 # s, integration step of the motion model
+MAX_MOTION_STEPS = 5000 # longer idle periods are integrated with coarser steps
+IN_POSITION_WINDOW = 0.001 # revs
+
+def encode_velocity(revs_per_s) -> list:
+    """Signed 8.24 VEL32 as [low, high]"""
+    return VEL32.encode(revs_per_s)
+
+def encode_position(revs) -> list:
+    """16.16 POS32 as [decimal, whole]"""
+    return POS32.encode(max(0.0, revs))
+
+class TritexDrive():
+    """
+    Register bank and motion model of one drive. The model is advanced
+    lazily to the current time on every request, so an idle simulator costs
+    nothing. Homing moves back to 0 revs at homing_vel, analog position mode
+    follows ANALOG_MODBUS_CNTRL between the analog position min and max
+    limited by the analog velocity and acceleration max registers.
+    """
+    def __init__(self, config: MotorConfig, start_revs=10.0, homing_vel=5.0):
+        self.config = config
+        self.homing_vel = homing_vel
+        self.start_revs = start_revs
+        self.registers = {}
+        self.reset(0.0)
+
+    def reset(self, now):
+        """Software power-on restart, everything but the position is lost"""
+        config = self.config
+        position = getattr(self, "position", self.start_revs)
+        self.registers.clear()
+        self.position = position
+        self.velocity = 0.0
+        self.homed = False
+        self.homing = False
+        self.fault = 0
+        self.last_update = now
+        self._write(config.ANALOG_POSITION_MINIMUM_REGISTER, encode_position(config.POS_MIN_REVS))
+        self._write(config.ANALOG_POSITION_MAXIMUM_REGISTER, encode_position(config.POS_MAX_REVS))
+        self._write(config.ANALOG_VEL_MAXIMUM_REGISTER, VEL32.encode(1.0))
+        self._write(config.ANALOG_ACCELERATION_MAXIMUM_REGISTER, ACC32.encode(1.0))
+        self._write(config.BOARD_TMP, [35 << 5])
+        self._write(config.ACTUATOR_TMP, [30 << 3])
+        self._write(config.ICONTINUOUS, UCUR32.encode(0.5))
+        self._write(config.VBUS, VOLT32.encode(48.0))
+        self._update_feedback()
+
+    def _write(self, address, values):
+        for i, value in enumerate(values):
+            self.registers[address + i] = value
+
+    def _read_value(self, address, codec):
+        return codec.decode((self.registers.get(address, 0), self.registers.get(address + 1, 0)))
+
+    def read(self, address, count, now) -> list:
+        self.advance(now)
+        return [self.registers.get(address + i, 0) for i in range(count)]
+
+    def write(self, address, values, now):
+        self.advance(now)
+        config = self.config
+        previous_motion = self.registers.get(config.IEG_MOTION_REGISTER, 0)
+        self._write(address, values)
+
+        if address == config.IEG_MOTION_REGISTER:
+            ### homing starts on the rising edge of the home bit
+            if is_nth_bit_on(HOME_BIT, values[0]) and not is_nth_bit_on(HOME_BIT, previous_motion) and not self.fault:
+                self.homing = True
+                self.homed = False
+        elif address == config.IEG_MODE_REGISTER:
+            if is_nth_bit_on(RESET_FAULT_BIT, values[0]) and self.fault not in ABSOLUTE_FAULTS:
+                self.fault = 0
+                self._write(config.PRESENT_FAULT_REGISTER, [0])
+        elif address == config.SYSTEM_COMMAND_REGISTER and values[0] == config.RESTART_VALUE:
+            self.reset(now)
+        self._update_feedback()
+
+    def inject_fault(self, code, now):
+        """Latches a drive fault, the drive disables and stops where it is"""
+        self.advance(now)
+        self.fault = code
+        self.homing = False
+        self.velocity = 0.0
+        self._write(self.config.PRESENT_FAULT_REGISTER, [code])
+        self._write(self.config.RECENT_FAULT_REGISTER, [code])
+        self._update_feedback()
+
+    def enabled(self) -> bool:
+        return not self.fault and is_nth_bit_on(ENABLE_MAINTAINED_BIT, self.registers.get(self.config.IEG_MODE_REGISTER, 0))
+
+    def target(self):
+        """Analog position target in revs or None if the drive does not follow it"""
+        config = self.config
+        if not self.homed or not self.enabled() or self.registers.get(config.COMMAND_MODE) != config.ANALOG_POSITION_MODE:
+            return None
+        if self.registers.get(config.ANALOG_INPUT_CHANNEL_REGISTER) != config.ANALOG_MODBUS_CNTRL_VALUE:
+            return None
+        pos_min = self._read_value(config.ANALOG_POSITION_MINIMUM_REGISTER, POS32)
+        pos_max = self._read_value(config.ANALOG_POSITION_MAXIMUM_REGISTER, POS32)
+        cntrl = min(self.registers.get(config.ANALOG_MODBUS_CNTRL_REGISTER, 0), config.MODBUSCTRL_MAX)
+        return pos_min + cntrl / config.MODBUSCTRL_MAX * (pos_max - pos_min)
+
+    def advance(self, now):
+        elapsed = now - self.last_update
+        self.last_update = now
+        if elapsed <= 0 or self.fault:
+            return
+        config = self.config
+        ### registers can only change between requests, decode them once per advance
+        stopped = is_nth_bit_on(STOP_BIT, self.registers.get(config.IEG_MOTION_REGISTER, 0))
+        target = None if stopped else self.target()
+        vel_max = self._read_value(config.ANALOG_VEL_MAXIMUM_REGISTER, VEL32)
+        acc_max = max(self._read_value(config.ANALOG_ACCELERATION_MAXIMUM_REGISTER, ACC32), 1e-6)
+        steps = min(MAX_MOTION_STEPS, max(1, round(elapsed / MOTION_STEP)))
+        dt = elapsed / steps
+        for _ in range(steps):
+            if self.homing:
+                self._home_step(dt)
+            else:
+                self._motion_step(dt, target, vel_max, acc_max)
+        self._update_feedback()
+
+    def _home_step(self, dt):
+        self.position = max(0.0, self.position - self.homing_vel * dt)
+        self.velocity = -self.homing_vel if self.position > 0 else 0.0
+        if self.position == 0.0:
+            self.homing = False
+            self.homed = True
+
+    def _motion_step(self, dt, target, vel_max, acc_max):
+        if target is None:
+            desired = 0.0
+        else:
+            distance = target - self.position
+            ### fastest velocity that can still stop at the target
+            desired = min(vel_max, (2 * acc_max * abs(distance)) ** 0.5)
+            desired = desired if distance >= 0 else -desired
+
+        change = max(-acc_max * dt, min(acc_max * dt, desired - self.velocity))
+        self.velocity += change
+        self.position += self.velocity * dt
+        if target is not None and abs(target - self.position) < IN_POSITION_WINDOW and abs(self.velocity) < acc_max * dt:
+            self.position = target
+            self.velocity = 0.0
+
+    def _update_feedback(self):
+        config = self.config
+        enabled = self.enabled()
+        status = (enabled << ENABLED_BIT) | (self.homed << HOMED_BIT) | ((enabled and self.homed) << READY_BIT) \
+            | ((self.fault != 0) << FAULTED_BIT) | (1 << STARTUP_COMPLETE_BIT)
+        target = self.target()
+        in_position = self.velocity == 0.0 and (target is None or abs(target - self.position) < IN_POSITION_WINDOW)
+        self.registers[config.OEG_STATUS_REGISTER] = status
+        self.registers[config.OEG_MOTION_REGISTER] = in_position << IN_POSITION_BIT
+        self._write(config.PFEEDBACK_POSITION_REGISTER, encode_position(self.position))
+        self._write(config.VFEEDBACK_VELOCITY_REGISTER, encode_velocity(self.velocity))
+
+class TritexSimulator():
+    """
+    Modbus TCP server for one simulated drive. Requests are served one at a
+    time with service_time like the real drive, every response is delayed
+    by rtt plus uniform jitter and drop_rate of the requests are never answered.
+    """
+    def __init__(self, host="127.0.0.1", port=5020, rtt=0.002, jitter=0.0, service_time=0.0002,
+                 drop_rate=0.0, config=None, logger=None, **drive_args):
+        self.host = host
+        self.port = port
+        self.rtt = rtt
+        self.jitter = jitter
+        self.service_time = service_time
+        self.drop_rate = drop_rate
+        self.logger = setup_logger(logger)
+        self.drive = TritexDrive(config or MotorConfig(), **drive_args)
+        self.server = None
+        self.request_count = 0
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self.drive.reset(loop.time())
+        self.server = await loop.create_server(lambda: _SimulatorProtocol(self), self.host, self.port)
+        self.logger.info(f"Tritex simulator listening on {self.host}:{self.port}")
+        return self
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+
+    def inject_fault(self, code):
+        self.drive.inject_fault(code, asyncio.get_running_loop().time())
+
+    def handle_request(self, frame, now) -> bytes:
+        self.request_count += 1
+        tid, unit, function_code, address, data = decode_request(frame)
+        if function_code == READ_HOLDING_REGISTERS:
+            return encode_read_response(tid, unit, self.drive.read(address, data, now))
+        if function_code in (WRITE_SINGLE_REGISTER, WRITE_MULTIPLE_REGISTERS):
+            self.drive.write(address, data, now)
+            return encode_write_response(tid, unit, function_code, address, data)
+        return encode_exception_response(tid, unit, function_code, ILLEGAL_FUNCTION)
+
+class _SimulatorProtocol(asyncio.Protocol):
+    def __init__(self, simulator: TritexSimulator):
+        self.simulator = simulator
+        self.transport = None
+        self.buffer = bytearray()
+        self.busy_until = 0.0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self.buffer.extend(data)
+        split_frames(self.buffer, self._on_frame)
+
+    def _on_frame(self, frame):
+        simulator = self.simulator
+        loop = asyncio.get_running_loop()
+        ### drive handles one request at a time, the network delay overlaps
+        self.busy_until = max(loop.time(), self.busy_until) + simulator.service_time
+        response = simulator.handle_request(frame, self.busy_until)
+        if simulator.drop_rate and random.random() < simulator.drop_rate:
+            return
+        delay = simulator.rtt + (random.uniform(0, simulator.jitter) if simulator.jitter else 0.0)
+        loop.call_at(self.busy_until + delay, self._send, response)
+
+    def _send(self, response):
+        if self.transport and not self.transport.is_closing():
+            self.transport.write(response)
+
+async def run(args):
+    drive_args = {"rtt": args.rtt, "jitter": args.jitter, "service_time": args.service_time,
+                  "drop_rate": args.drop_rate, "homing_vel": args.homing_vel}
+    simulators = {"left": await TritexSimulator(host=args.host_left, port=args.port, **drive_args).start(),
+                  "right": await TritexSimulator(host=args.host_right, port=args.port, **drive_args).start()}
+    try:
+        if args.fault:
+            await asyncio.sleep(args.fault_after)
+            simulators[args.fault_side].inject_fault(args.fault)
+            simulators[args.fault_side].logger.warning(f"Injected fault {args.fault} to the {args.fault_side} drive")
+        await asyncio.Event().wait()
+    finally:
+        for simulator in simulators.values():
+            await simulator.stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host_left", type=str, default="127.0.0.1")
+    parser.add_argument("--host_right", type=str, default="127.0.0.2")
+    parser.add_argument("--port", type=int, default=5020)
+    parser.add_argument("--rtt", type=float, default=0.002, help="simulated network round trip in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="max extra uniform random delay in seconds")
+    parser.add_argument("--service_time", type=float, default=0.0002, help="drive processing time per request")
+    parser.add_argument("--drop_rate", type=float, default=0.0, help="share of requests that are never answered")
+    parser.add_argument("--homing_vel", type=float, default=5.0, help="homing velocity in revs/s")
+    parser.add_argument("--fault", type=int, help="fault code to inject, see constants/fault_codes.py")
+    parser.add_argument("--fault_after", type=float, default=10.0, help="seconds before the fault is injected")
+    parser.add_argument("--fault_side", choices=["left", "right"], default="left")
+    args = parser.parse_args()
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        pass
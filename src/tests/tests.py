@@ -4,7 +4,41 @@ from services.MotorApi import MotorApi
 from ModbusClients import ModbusClients
 from settings.config import Config
 from utils.setup_logging import setup_logging
+from services.read_planner import plan_reads, slice_block
+from services.retry_policies import RetryPolicy, DeadlinePolicy, BackoffPolicy, EscalatePolicy
+from services.lean_transport import LeanModbusClient
+from services.modbus_transport import encode_write_request, encode_read_request
+from simulator.tritex_simulator import TritexDrive
+from utils.utils import convert_to_revs
+from utils import instrumentation
+from helpers.motor_api_helper import calculate_target_revs, calculate_motor_modbuscntrl_vals
+from helpers.batch_kinematics import calculate_motion_batch
+from helpers.forward_kinematics import ForwardKinematics
+from helpers.pose_envelope import get_envelope
+from helpers.kinematics_model import DEFAULT_MODEL, KinematicsModel, refit_model, save_model, load_model
+from services.trajectory_player import TrajectoryPlayer
+from services.setpoint_interpolator import SetpointInterpolator
+from services.motion_cueing import MotionCueingFilter
+from services.deadband_filter import DeadbandFilter
+from services.setpoint_predictor import SetpointPredictor
+from services.WebSocketClient import WebSocketClient
+from services.rate_limiter import RotateRateLimiter
+from services.setpoint_mailbox import SetpointMailbox
+from services.telemetry_subscriptions import TelemetrySubscriptions
+from utils.binary_frames import encode_rotate, decode_rotate, ROTATE_FRAME
+from utils.utils import parse_message
+from handlers.dispatch import ACTIONS, Action, dispatch, run
+from services.command_queues import CommandQueues, WorkItem
+from services.bus_owner import BusOwner, _GatewayProtocol
+from services.modbus_transport import SERVER_DEVICE_BUSY, ModbusResponse, WRITE_MULTIPLE_REGISTERS
+from constants.bus_priority import SAFETY_STOP, SETPOINT, FAULT_POLL, TELEMETRY
+from types import SimpleNamespace
+from utils.fixed_point import get_codec
+from utils.utils import registers_convertion, convert_val_into_format
+import random
+import numpy as np
 import asyncio
+from time import perf_counter
 
 def test_urev_clamp():
     ### In range
@@ -36,7 +70,644 @@ def test_urev_clamp():
     assert clamp_target_revs(29.25, -300.01, config) == [[16384, 28], [25801, 0]]
     assert clamp_target_revs(29.99999999999, -300.01, config) == [[61406, 28], [25801, 0]]
     assert clamp_target_revs(29.99999999999, -300.5, config) == [[61406, 28], [32768, 0]]
-    
+
+def test_plan_reads():
+    registers = {"board_tmp": (11, 1), "actuator_tmp": (15, 1), "icontinuous": (564, 2), "vbus": (570, 2)}
+    blocks = plan_reads(registers, max_gap=8)
+    assert [(block.address, block.count) for block in blocks] == [(11, 5), (564, 8)]
+    assert slice_block(blocks[0], [1, 2, 3, 4, 5]) == {"board_tmp": [1], "actuator_tmp": [5]}
+    assert slice_block(blocks[1], list(range(8))) == {"icontinuous": [0, 1], "vbus": [6, 7]}
+
+    ### gap too large or block too long
+    assert len(plan_reads(registers, max_gap=2)) == 4
+    assert len(plan_reads({"a": (0, 100), "b": (100, 30)}, max_gap=8)) == 2
+
+def test_retry_policies():
+    backoff = BackoffPolicy(base_delay=0.1, max_delay=0.3, max_retries=3, jitter=0)
+    assert [backoff.next_delay(attempt, 0) for attempt in range(1, 5)] == [0.1, 0.2, 0.3, None]
+    deadline = DeadlinePolicy(deadline=0.05, retry_delay=0.01)
+    assert deadline.next_delay(1, 0.02) == 0.01
+    assert deadline.next_delay(5, 0.045) is None
+    escalated = []
+    escalate = EscalatePolicy(immediate_retries=2, on_escalate=escalated.append)
+
+    async def fail():
+        return False
+    assert asyncio.run(escalate.run(fail, "stop")) is False
+    assert escalated == ["stop"]
+    assert escalate.get_stats() == {"calls": 1, "retries": 2, "give_ups": 1}
+    ### a policy has to decide its delays
+    try:
+        RetryPolicy("none")
+        assert False
+    except TypeError:
+        pass
+
+def test_lean_frames():
+    client = LeanModbusClient(host="127.0.0.1")
+    sent = []
+
+    async def capture(frame):
+        sent.append(bytes(frame))
+    client._request = capture
+
+    async def requests():
+        await client.write_registers(address=7188, values=[1234], slave=1)
+        await client.read_holding_registers(address=378, count=2, slave=1)
+    asyncio.run(requests())
+    ### tid is packed per request, zero it for the comparison
+    assert sent[0][2:] == encode_write_request(0, 1, 7188, [1234])[2:]
+    assert sent[1][2:] == encode_read_request(0, 1, 378, 2)[2:]
+
+def test_bus_priority():
+    motor_config = MotorConfig()
+    bus_config = Config()
+    bus_config.BUS_QUEUE_DEPTHS = (2, 2, 1, 1)
+    bus_config.BUS_STARVATION_TIME = 0.5
+    async def schedule():
+        owner = BusOwner(None, motor_config, bus_config)
+        ### nothing is dispatched, the scheduler is driven by hand
+        telemetry = owner.submit("left", False, 100, 1)
+        rejected = owner.submit("left", False, 101, 1)
+        fault = owner.submit("left", False, motor_config.OEG_STATUS_REGISTER, 1)
+        setpoints = [owner.submit("left", True, motor_config.ANALOG_MODBUS_CNTRL_REGISTER, [value]) for value in range(3)]
+        stop = owner.submit("left", True, motor_config.IEG_MOTION_REGISTER, [motor_config.STOP_VALUE])
+        ### depth limits, a full queue is busy, a full setpoint queue drops its oldest setpoint
+        assert rejected.result().exception_code == SERVER_DEVICE_BUSY
+        assert setpoints[0].result().exception_code == SERVER_DEVICE_BUSY
+        assert [request.priority for request in owner.queues["left"][SETPOINT]] == [SETPOINT, SETPOINT]
+        assert not telemetry.done() and not fault.done() and not stop.done()
+        order = [owner._next_request("left").priority for _ in range(2)]
+        ### starvation, a telemetry read that waited too long goes before the setpoint
+        owner.queues["left"][TELEMETRY][0].enqueued_at -= 1.0
+        order += [owner._next_request("left").priority for _ in range(3)]
+        assert owner._next_request("left") is None
+        ### continue and home are not stops, a stop drops the ones still queued
+        continued = owner.submit("left", True, motor_config.IEG_MOTION_REGISTER, [0])
+        home = owner.submit("right", True, motor_config.IEG_MOTION_REGISTER, [motor_config.HOME_VALUE])
+        assert [request.priority for request in owner.queues["left"][FAULT_POLL] + owner.queues["right"][FAULT_POLL]] == [FAULT_POLL, FAULT_POLL]
+        owner.submit("left", True, motor_config.IEG_MOTION_REGISTER, [motor_config.STOP_VALUE])
+        assert continued.result().exception_code == SERVER_DEVICE_BUSY and not home.done()
+        assert owner._next_request("left").priority == SAFETY_STOP and owner._next_request("left") is None
+        owner.stop()
+        return owner, order
+    owner, order = asyncio.run(schedule())
+    assert order == [SAFETY_STOP, SETPOINT, TELEMETRY, SETPOINT, FAULT_POLL]
+    assert owner.rejected == [0, 1, 0, 1] and owner.promoted[TELEMETRY] == 1
+
+def test_simulated_drive():
+    config = MotorConfig()
+    drive = TritexDrive(config, start_revs=2.0, homing_vel=4.0)
+    drive.write(config.IEG_MOTION_REGISTER, [config.HOME_VALUE], now=0.0)
+    assert drive.read(config.OEG_STATUS_REGISTER, 1, now=0.25) == [1 << 12]
+    assert drive.read(config.OEG_STATUS_REGISTER, 1, now=0.6)[0] & 2
+
+    ### follows modbuscntrl once enabled in analog position mode
+    drive.write(config.COMMAND_MODE, [config.ANALOG_POSITION_MODE], now=0.6)
+    drive.write(config.ANALOG_INPUT_CHANNEL_REGISTER, [config.ANALOG_MODBUS_CNTRL_VALUE], now=0.6)
+    drive.write(config.ANALOG_MODBUS_CNTRL_REGISTER, [5000], now=0.6)
+    drive.write(config.IEG_MODE_REGISTER, [config.ENABLE_MAINTAINED_VALUE], now=0.6)
+    target = config.POS_MIN_REVS + 0.5 * (config.POS_MAX_REVS - config.POS_MIN_REVS)
+    assert abs(convert_to_revs(drive.read(config.PFEEDBACK_POSITION_REGISTER, 2, now=60.0)) - target) < 0.001
+
+    drive.inject_fault(128, now=60.0)
+    assert drive.read(config.PRESENT_FAULT_REGISTER, 1, now=60.0) == [128]
+    drive.write(config.IEG_MODE_REGISTER, [config.RESET_FAULT_VALUE], now=60.0)
+    assert drive.read(config.PRESENT_FAULT_REGISTER, 1, now=60.0) == [0]
+
+
+def test_instrumentation():
+    instrumentation.reset()
+    instrumentation.configure(enabled=False)
+    with instrumentation.span("off"):
+        pass
+    assert instrumentation.get_stats()["spans"] == {}
+
+    ### histogram percentiles stay within one sub bucket (~3%) of the true value
+    instrumentation.configure(enabled=True, ring_size=8)
+    for value in range(1, 1001):
+        instrumentation.record("span", value / 1e6)
+    stats = instrumentation.get_stats()["spans"]["span"]
+    assert stats["count"] == 1000 and stats["max_us"] == 1000
+    assert abs(stats["p50_us"] - 500) <= 500 * 0.04
+    assert abs(stats["p99_us"] - 990) <= 990 * 0.04
+    assert stats["recent_p50_us"] == 997
+
+    @instrumentation.timed("failing")
+    def failing():
+        return None
+    failing()
+    assert instrumentation.get_stats()["spans"]["failing"]["errors"] == 1
+    instrumentation.configure(enabled=False)
+    instrumentation.reset()
+
+def test_batch_kinematics():
+    config = MotorConfig()
+    motor_api = SimpleNamespace(config=config, logger=None)
+    pitch = np.concatenate([np.linspace(-12, 12, 97), [5.625, -5.625, 6.0, 0.0]])
+    roll = np.concatenate([np.linspace(20, -20, 97), [5.625, -6.0, 1.0, 17.5]])
+    batch = calculate_motion_batch(pitch, roll, config)
+    for i, (p, r) in enumerate(zip(pitch.tolist(), roll.tolist())):
+        left_revs, right_revs = calculate_target_revs(motor_api, p, r)
+        assert batch["left_revs"][i] == left_revs and batch["right_revs"][i] == right_revs
+        assert (batch["left_modbuscntrl"][i], batch["right_modbuscntrl"][i]) == calculate_motor_modbuscntrl_vals(motor_api, left_revs, right_revs)
+
+def test_fixed_point_codecs():
+    rng = random.Random(12)
+    for format, signed, scale in (("16.16", False, 1), ("8.24", True, 60), ("8.24", False, 1), ("12.20", False, 1),
+                                  ("9.23", False, 1), ("11.21", True, 1), ("9.7", False, 1)):
+        codec = get_codec(format, signed, scale)
+        integer_bits = int(format.split(".")[0])
+        registers = []
+        for _ in range(200):
+            value = rng.uniform(0, 2**(integer_bits - 1) - 1)
+            encoded = codec.encode(value)
+            assert encoded == convert_val_into_format(value, format)
+            words = [encoded] if codec.registers == 1 else encoded
+            registers.extend(words)
+            ### round trip within one lsb, decoding matches the old conversion exactly
+            assert 0 <= value * scale - codec.decode(words) < codec.factor
+            raw = [rng.randrange(65536) for _ in range(codec.registers)]
+            assert codec.decode(raw) == registers_convertion(raw, format, signed=signed, scale=scale)
+        assert codec.decode_array(registers).tolist() == [codec.decode(registers[i:i + codec.registers]) for i in range(0, len(registers), codec.registers)]
+
+def test_trajectory_player():
+    written = []
+    async def set_analog_modbus_cntrl(values):
+        written.append(values)
+        return True
+    motor_api = SimpleNamespace(config=MotorConfig(), analog_mode=True, set_analog_modbus_cntrl=set_analog_modbus_cntrl)
+    states, resets = [], []
+    player = TrajectoryPlayer(motor_api, on_progress=lambda state, *progress: states.append(state),
+                              stages=[SimpleNamespace(reset=lambda: resets.append(True))])
+
+    async def play():
+        player.append_samples([1.0, 0, 0, 1.01, 2, 3])
+        player.append_samples([1.02, -2, 4, 1.03, 5, 1])
+        player.load()
+        player.start()
+        while player.state == "playing":
+            await asyncio.sleep(0.005)
+        player.seek(0.02)
+        assert player.index == 2
+    asyncio.run(play())
+
+    assert abs(player.duration - 0.03) < 1e-9
+    assert written == player.setpoints and len(written) == 4
+    assert written[1] == calculate_motor_modbuscntrl_vals(SimpleNamespace(config=motor_api.config), *calculate_target_revs(motor_api, 2.0, 3.0))
+    assert states[0] == "loaded" and states[-2] == "finished"
+    ### the washout and interpolator stages don't write during the playback
+    assert resets == [True]
+
+def test_setpoint_interpolator():
+    config = MotorConfig()
+    config.MAX_VEL = 600 # 10 revs/s
+    config.MAX_ACC = 1500 # 25 revs/s^2
+    written = []
+
+    feedback = [0, 14]
+    async def interpolate():
+        loop = asyncio.get_running_loop()
+        async def write_revs_setpoint(left, right):
+            written.append((loop.time(), left, right))
+            return True
+        async def get_current_revs():
+            return (feedback, feedback)
+        motor_api = SimpleNamespace(config=config, logger=None, write_revs_setpoint=write_revs_setpoint, get_current_revs=get_current_revs)
+        interpolator = SetpointInterpolator(motor_api, rate=200, mode="linear")
+        interpolator.start()
+        await interpolator.rotate(1.0, 0.0)
+        while interpolator.get_stats()["max_added_latency_s"] == 0:
+            await asyncio.sleep(0.01)
+        ### after a reset (trajectory playback moved the drives) the next keyframe starts from the feedback again
+        reached = len(written)
+        interpolator.reset()
+        feedback[1] = 20
+        await interpolator.rotate(1.0, 0.0)
+        await asyncio.sleep(0.02)
+        interpolator.stop()
+        assert abs(written[reached][1] - 20) < 0.1
+        del written[reached:]
+        return calculate_target_revs(motor_api, 1.0, 0.0)
+    target = asyncio.run(interpolate())
+
+    ### ramps from the drives position to the keyframe within the velocity limit
+    assert abs(written[0][1] - 14) < 0.1 and abs(written[-1][1] - target[0]) < 0.001
+    for (t0, left0, _), (t1, left1, _) in zip(written, written[1:]):
+        assert abs(left1 - left0) / (t1 - t0) <= 10 * 1.01
+    assert len(written) > 50
+
+def test_motion_cueing():
+    cueing = MotionCueingFilter(downstream=None, rate=100)
+    cueing._settle(0.0, 0.0)
+    ### a sustained 5 degree pitch step: fast onset cue, then the tilt channel takes over at the tilt rate limit
+    outputs = [cueing.step(5.0, 0.0)[0] for _ in range(500)]
+    assert outputs[10] > 1.0
+    assert abs(outputs[-1] - 5.0) < 0.05
+    assert max(outputs) < 5.0 * 1.5
+    assert all(abs(cueing.step(5.0, 0.0)[1]) < 1e-9 for _ in range(10))
+
+    ### parameters change without resetting the state, invalid ones are rejected as a whole
+    assert cueing.set_parameters({"tilt_gain": 0.5, "hp_cutoff": 0.5})
+    assert cueing.params.TILT_GAIN == 0.5 and abs(cueing.step(5.0, 0.0)[0] - 5.0) < 0.1
+    assert not cueing.set_parameters({"tilt_gain": 2.0, "output_cutoff": 80})
+    assert cueing.params.TILT_GAIN == 0.5
+
+    ### after a reset the filters continue from the measured attitude, not from the new input
+    forwarded = []
+    async def rotate(pitch, roll):
+        forwarded.append(pitch)
+    async def attitude():
+        return {"pitch": 3.0, "roll": 0.0}
+    async def reseed():
+        cueing = MotionCueingFilter(SimpleNamespace(rotate=rotate), rate=100, feedback=attitude)
+        cueing.start()
+        cueing.reset()
+        await cueing.rotate(5.0, 0.0)
+        await asyncio.sleep(0.02)
+        cueing.stop()
+    asyncio.run(reseed())
+    assert abs(forwarded[0] - 3.0) < 0.2
+
+def test_deadband_filter():
+    config = MotorConfig()
+    config.DEADBAND_MAX_HOLD = 0.05
+    written = []
+
+    async def filter_rotates():
+        async def write_sides(revs, sides):
+            written.append((list(revs), list(sides)))
+            return True
+        deadband = DeadbandFilter(config, write_sides)
+        results = []
+        for revs in ([14.0, 14.0], [14.2, 14.0], [14.6, 14.0], [14.7, 14.3], [14.72, 14.3]):
+            sides = deadband.filter(revs)
+            deadband.written(sides, revs)
+            results.append(sides)
+        await asyncio.sleep(0.15)
+        ### holding again, a change that only passes the release threshold stays suppressed
+        results.append(deadband.filter([14.92, 14.3]))
+        return deadband, results
+    deadband, results = asyncio.run(filter_rotates())
+
+    ### a rotate that comes during a slow flush write waits for it, so the older held target never lands last
+    completed = []
+    async def race():
+        async def write_sides(revs, sides):
+            await asyncio.sleep(0.05 if revs[0] == 14.02 else 0)
+            completed.append(revs[0])
+            return True
+        racing = DeadbandFilter(config, write_sides)
+        racing.written(racing.filter([14.0, 14.0]), [14.0, 14.0])
+        racing.filter([14.02, 14.0])
+        await asyncio.sleep(0.07)
+        async with racing.lock:
+            sides = racing.filter([14.6, 14.0])
+            if await racing.write_sides([14.6, 14.0], sides):
+                racing.written(sides, [14.6, 14.0])
+        return racing
+    racing = asyncio.run(race())
+    assert completed == [14.02, 14.6] and racing.previous_revs == [14.6, 14.0]
+
+    ### a failed write leaves the drive holding the target, the flush retries it until it lands
+    attempts = []
+    async def fail_once():
+        async def write_sides(revs, sides):
+            attempts.append(list(sides))
+            return len(attempts) > 2
+        failing = DeadbandFilter(config, write_sides)
+        failing.written(failing.filter([14.0, 14.0]), [14.0, 14.0])
+        sides = failing.filter([14.6, 14.0])
+        if not await failing.write_sides([14.6, 14.0], sides):
+            failing.failed(sides, [14.6, 14.0])
+        assert not failing.tracking[0] and failing.held[0] == 14.6
+        await asyncio.sleep(0.2)
+        return failing
+    failing = asyncio.run(fail_once())
+    assert attempts == [[True, False]] * 3
+    assert failing.previous_revs == [14.6, 14.0] and failing.held == [None, None] and failing.get_stats()["left"]["hold_flushes"] == 1
+
+    ### first write, tracking above the release threshold, then holding inside the deadband
+    assert results == [[True, True], [True, False], [True, False], [True, False], [False, False], [False, False]]
+    ### the held targets are flushed after the max hold time
+    assert written == [([14.72, 14.3], [True, True])]
+    assert deadband.previous_revs == [14.72, 14.3]
+    stats = deadband.get_stats()
+    assert stats["left"]["suppressed"] == 2 and stats["left"]["issued"] == 5 and stats["left"]["hold_flushes"] == 1
+    assert stats["right"]["suppressed"] == 5 and stats["right"]["issued"] == 2
+def test_setpoint_predictor():
+    motor_api = SimpleNamespace(modbus_rtt=0.03)
+    predictor = SetpointPredictor(downstream=None, motor_api=motor_api, extra_latency=0.01, max_horizon=0.1, clamp=2.0)
+    assert abs(predictor.get_horizon() - 0.04) < 1e-12
+    motor_api.modbus_rtt = 0.5
+    assert predictor.get_horizon() == 0.1
+
+    ### a quadratic pitch and a linear roll are extrapolated exactly
+    for t in (0.0, 0.016, 0.035, 0.05, 0.066):
+        predictor._history.append((t, (1 + 2*t + 3*t*t, -4*t)))
+    pitch, roll = predictor.predict(0.04)
+    t = 0.106
+    assert abs(pitch - (1 + 2*t + 3*t*t)) < 1e-9 and abs(roll + 4*t) < 1e-9
+
+    ### the extrapolation is clamped
+    predictor._history.append((0.08, (10.0, 0.0)))
+    pitch, _ = predictor.predict(0.1)
+    assert pitch == 12.0 and predictor.clamped >= 1
+
+    forwarded = []
+    async def rotate(pitch, roll, trace=None):
+        forwarded.append((pitch, roll))
+    predictor = SetpointPredictor(downstream=SimpleNamespace(rotate=rotate), motor_api=motor_api)
+    asyncio.run(predictor.rotate(1.0, 2.0))
+    assert forwarded == [(1.0, 2.0)]
+
+    ### setpoints handed over together are fitted at the times the hub received them
+    motor_api.modbus_rtt = 0.0
+    predictor = SetpointPredictor(downstream=SimpleNamespace(rotate=rotate), motor_api=motor_api, extra_latency=0.0, clamp=10.0)
+    async def burst():
+        received = perf_counter() - 0.02
+        for i in range(3):
+            await predictor.rotate(float(i), 0.0, {"received": received + 0.01 * i})
+    asyncio.run(burst())
+    assert abs(forwarded[-1][0] - 2.0) < 0.1
+
+def test_forward_kinematics():
+    config = MotorConfig()
+    motor_api = SimpleNamespace(config=config, logger=None)
+    solver = ForwardKinematics(config)
+    pitch = np.linspace(-7, 7, 41)
+    roll = np.linspace(15, -15, 41)
+    pitch, roll = np.meshgrid(pitch, roll)
+    inside = np.vectorize(get_envelope(config).is_feasible)(pitch, roll)
+    pitch, roll = pitch[inside], roll[inside]
+    left, right = zip(*(calculate_target_revs(motor_api, p, r) for p, r in zip(pitch.tolist(), roll.tolist())))
+
+    ### inverts calculate_target_revs, the batch solve gives the scalar results
+    batch_pitch, batch_roll = solver.solve_batch(left, right)
+    assert np.max(np.abs(batch_pitch - pitch)) < 1e-9 and np.max(np.abs(batch_roll - roll)) < 1e-9
+    for i in range(0, len(left), 37):
+        p, r = solver.solve(left[i], right[i])
+        assert abs(p - batch_pitch[i]) < 1e-12 and abs(r - batch_roll[i]) < 1e-12
+
+def test_pose_envelope():
+    config = MotorConfig()
+    envelope = get_envelope(config)
+    assert envelope.project(2.0, -3.0) == (2.0, -3.0)
+
+    ### infeasible poses land on the envelope edge, at the nearest point of a dense sample of the envelope
+    pitch, roll = np.meshgrid(np.linspace(-9, 9, 721), np.linspace(-17, 17, 1361), indexing="ij")
+    feasible = np.vectorize(envelope.is_feasible)(pitch, roll)
+    feasible_pitch, feasible_roll = pitch[feasible], roll[feasible]
+    rng = random.Random(3)
+    for _ in range(50):
+        p, r = rng.uniform(-9, 9), rng.uniform(-17, 17)
+        projected = envelope.project(p, r)
+        left, right = calculate_target_revs(SimpleNamespace(config=config, logger=None), p, r)
+        assert config.POS_MIN_REVS - 1e-6 <= min(left, right) and max(left, right) <= config.POS_MAX_REVS + 1e-6
+        nearest = np.min(np.hypot(feasible_pitch - p, feasible_roll - r))
+        assert np.hypot(projected[0] - p, projected[1] - r) <= nearest + 0.01
+
+    batch_pitch, batch_roll = envelope.project_batch([8.0, -8.0, 1.0, 20.0], [12.0, -16.0, 1.0, -30.0])
+    assert [(p, r) for p, r in zip(batch_pitch.tolist(), batch_roll.tolist())] == [envelope.project(8.0, 12.0), envelope.project(-8.0, -16.0), (1.0, 1.0), envelope.project(20.0, -30.0)]
+
+def test_kinematics_model(tmp_path):
+    ### the compiled default model is the regression the platform shipped with
+    for pitch, roll in ((0.0, 0.0), (3.5, -7.25), (-6.0, 11.0)):
+        left, right = DEFAULT_MODEL.revs(pitch, roll)
+        assert abs(left - (13.6775 + 1.8464*pitch - 0.8026*roll + 0.0053*pitch**2 - 0.0050*pitch*roll + 0.0011*roll**2)) < 1e-12
+        assert abs(right - (13.6775 + 1.8464*pitch + 0.8026*roll + 0.0053*pitch**2 + 0.0050*pitch*roll + 0.0011*roll**2)) < 1e-12
+
+    ### a third order refit of noise free samples recovers the coefficients
+    true_model = KinematicsModel([13.0, 1.9, -0.8, 0.005, -0.004, 0.001, 0.0002, 0.0, -0.0001, 0.00003],
+                                 [13.2, 1.8, 0.81, 0.006, 0.005, 0.0012, 0.0, 0.0001, 0.0, 0.0], order=3)
+    rng = np.random.default_rng(4)
+    pitch, roll = rng.uniform(-7, 7, 400), rng.uniform(-15, 15, 400)
+    left, right = true_model.revs(pitch, roll)
+    model = refit_model(pitch, roll, left, right, order=3)
+    assert np.allclose(model.left, true_model.left, atol=1e-9) and np.allclose(model.right, true_model.right, atol=1e-9)
+    assert model.rms_revs < 1e-9
+
+    ### versions are appended to the coefficient file, the active one is loaded by default
+    file = tmp_path / "kinematics.json"
+    assert save_model(file, model) == DEFAULT_MODEL.version + 1
+    assert load_model(file).key == DEFAULT_MODEL.key
+    assert save_model(file, refit_model(pitch, roll, left, right, order=2), activate=True) == DEFAULT_MODEL.version + 2
+    assert load_model(file).order == 2 and load_model(file, DEFAULT_MODEL.version + 1).key == model.key
+
+def test_binary_frames():
+    frame = encode_rotate(3.2, -1.1, seq=7, timestamp=12.5)
+    assert len(frame) == ROTATE_FRAME.size == 24
+    seq, timestamp, pitch, roll = decode_rotate(frame)
+    assert (seq, timestamp) == (7, 12.5) and abs(pitch - 3.2) < 1e-6 and abs(roll + 1.1) < 1e-6
+    for invalid in (b"", frame[:-1], bytes([2]) + frame[1:]):
+        try:
+            decode_rotate(invalid)
+            assert False
+        except ValueError:
+            pass
+
+    ### text rotates until the server confirms binary frames
+    sent = []
+    client = WebSocketClient(setup_logging("test", "test.log", log_to_file=False), binary_frames=True)
+    client.is_running = True
+    client.socket = SimpleNamespace(send=lambda message: asyncio.sleep(0, sent.append(message)))
+    asyncio.run(client.send_rotate(1.5, 2.0, seq=3))
+    client.binary = True
+    asyncio.run(client.send_rotate(1.5, 2.0, seq=4, timestamp=1.0))
+    assert sent[0] == "action=rotate|pitch=1.5|roll=2.0|seq=3|"
+    assert decode_rotate(sent[1]) == (4, 1.0, 1.5, 2.0)
+
+def test_message_dispatch():
+    assert parse_message("action=message|receiver=gui|message=a=b|") == {"action": "message", "receiver": "gui", "message": "a=b"}
+    assert parse_message("|event=error||message=x|pitch=1|pitch=2|tail") == {"event": "error", "message": "x", "pitch": "1"}
+
+    calls, sent = [], []
+    async def handler(self, wsclient, command, more=None, received_at=None):
+        calls.append((command, more, received_at))
+    hub = SimpleNamespace(motors_initialized=False, shutdown=False, logger=setup_logging("test", "test.log", log_to_file=False), wsclients={})
+    class FakeClient:
+        async def send(self, message):
+            sent.append(message)
+    wsclient = FakeClient()
+    async def send_messages():
+        queues = CommandQueues(lambda item: run(hub, item), depths=(1, 16, 16), logger=hub.logger)
+        hub.wsclients[wsclient] = {"command_queues": queues}
+        queues.start()
+        for message in ("action=testaction|command=go|", "action=nope|", "pitch=1|", "initialize",
+                        "action=testaction|", "action=testaction|command=go|", "action=testaction|command=go|extra=1|"):
+            if message == "initialize":
+                hub.motors_initialized = True
+                continue
+            await dispatch(hub, wsclient, parse_message(message), received_at=1.0)
+            await queues.join()
+        ### stop runs inline even when the motion queue is full
+        queues.stop()
+        await dispatch(hub, wsclient, parse_message("action=testmotion|"))
+        await dispatch(hub, wsclient, parse_message("action=testmotion|"))
+        await dispatch(hub, wsclient, parse_message("action=teststop|"))
+        ### messages buffered for a client identify evicted are dropped
+        del hub.wsclients[wsclient]
+        await dispatch(hub, wsclient, parse_message("action=testaction|command=late|"))
+        queues.close()
+    async def stop(self):
+        calls.append("stop")
+    ACTIONS["testaction"] = Action(handler, fields=("command", ("extra", "more")), required=("command",), received_at=True)
+    ACTIONS["testmotion"] = Action(handler, queue="motion")
+    ACTIONS["teststop"] = Action(stop, wsclient=False, queue="inline")
+    try:
+        asyncio.run(send_messages())
+    finally:
+        for name in ("testaction", "testmotion", "teststop"):
+            del ACTIONS[name]
+    assert calls == [("go", None, 1.0), ("go", "1", 1.0), "stop"]
+    assert sent == [
+        "event=error|message=Motors are not initialized or server has been given an order to shutdown|",
+        sent[1], "event=error|message=No action given, example action=<action>|",
+        "event=error|message=action=testaction needs command=<command>|",
+        "event=error|message=The motion queue is full, action=testmotion was dropped|"]
+    assert sent[1].startswith("event=error|message=No action found with name nope")
+
+def test_setpoint_mailbox():
+    rotated, done, dropped = [], [], []
+    async def rotate(pitch, roll, trace=None):
+        await asyncio.sleep(0.02)
+        rotated.append(pitch)
+        if trace is not None:
+            trace["written"] = perf_counter()
+            trace["success"] = True
+    async def post_setpoints():
+        mailbox = SetpointMailbox(SimpleNamespace(rotate=rotate), on_done=done.append, on_dropped=dropped.append)
+        mailbox.start()
+        mailbox.post(1.0, 0.0, {"seq": 1})
+        await asyncio.sleep(0.005)
+        ### the write of 1 is in progress, 3 replaces 2 in the pending slot
+        mailbox.post(2.0, 0.0, {"seq": 2})
+        mailbox.post(3.0, 0.0, {"seq": 3})
+        await asyncio.sleep(0.06)
+        mailbox.stop()
+        return mailbox.get_stats()
+    stats = asyncio.run(post_setpoints())
+    assert rotated == [1.0, 3.0]
+    assert [trace["seq"] for trace in dropped] == [2]
+    assert [trace["seq"] for trace in done] == [1, 3]
+    assert all(trace["dequeued"] <= trace["written"] and trace["success"] for trace in done)
+    assert stats["posted"] == 3 and stats["executed"] == 2 and stats["coalesced"] == 1 and not stats["pending"]
+
+def test_rate_limiter():
+    posted, dropped, summaries = [], [], []
+    async def burst():
+        limiter = RotateRateLimiter(lambda pitch, roll, trace: posted.append(pitch), rate=50, burst=2,
+                                    on_dropped=dropped.append, on_summary=lambda *summary: summaries.append(summary),
+                                    summary_interval=0.05)
+        ### the burst passes, the newest of the rest waits for the next token
+        results = [limiter.submit(float(pitch), 0.0, {"seq": pitch}) for pitch in range(5)]
+        await asyncio.sleep(0.08)
+        limiter.set_limits(1000, 1)
+        results.append(limiter.submit(5.0, 0.0))
+        limiter.stop()
+        return limiter, results
+    limiter, results = asyncio.run(burst())
+    assert results == [True, True, False, False, False, True]
+    assert posted == [0.0, 1.0, 4.0, 5.0]
+    assert [trace["seq"] for trace in dropped] == [2, 3]
+    assert summaries == [(2, 50, 2)]
+    assert limiter.get_stats() == {"rate": 1000, "burst": 1, "passed": 3, "released": 1, "coalesced": 2}
+
+def test_command_queues():
+    done = []
+    async def execute(item):
+        await asyncio.sleep(item.kwargs["delay"])
+        done.append(item.action)
+    async def queue_commands():
+        queues = CommandQueues(execute, depths=(4, 1, 1))
+        queues.start()
+        ### the motion item doesn't wait for the slow query
+        assert queues.put("query", WorkItem("slow", {"delay": 0.05}))
+        assert queues.put("motion", WorkItem("rotate", {"delay": 0}))
+        assert not queues.put("query", WorkItem("rejected", {"delay": 0}))
+        await asyncio.sleep(0.01)
+        assert done == ["rotate"]
+        await queues.join()
+        ### closing drops what is queued but lets the running item finish
+        assert queues.put("query", WorkItem("slow", {"delay": 0.02}))
+        await asyncio.sleep(0)
+        assert queues.put("query", WorkItem("dropped", {"delay": 0}))
+        queues.close()
+        await asyncio.sleep(0.04)
+        assert done == ["rotate", "slow", "slow"]
+        return queues.get_stats()
+    stats = asyncio.run(queue_commands())
+    assert stats["query"]["processed"] == 2 and stats["query"]["rejected"] == 1 and stats["motion"]["processed"] == 1
+
+def test_telemetry_subscriptions():
+    reads, received = [], {"fast": 0, "slow": 0}
+    async def acquire():
+        reads.append(len(reads))
+        return {"value": len(reads)}
+    async def send(wsclient, message):
+        assert message.startswith("event=telemetry|topic=status|")
+        received[wsclient] += 1
+    async def subscribe():
+        subscriptions = TelemetrySubscriptions({"status": acquire}, send, max_rates={"status": 20})
+        ### one acquisition loop at the fastest rate, capped by the max rate
+        assert subscriptions.subscribe("fast", "status", 100) == 20.0
+        assert subscriptions.subscribe("slow", "status", 5) == 5.0
+        await asyncio.sleep(0.52)
+        subscriptions.unsubscribe("fast")
+        subscriptions.unsubscribe("slow", "status")
+        stats = subscriptions.get_stats()["status"]
+        count = len(reads)
+        await asyncio.sleep(0.1)
+        ### nobody subscribed, nothing is read
+        assert len(reads) == count
+        return stats
+    stats = asyncio.run(subscribe())
+    assert 9 <= len(reads) <= 12 and not stats["active"]
+    assert received["fast"] == len(reads) and 2 <= received["slow"] <= 3
+
+
+def test_register_shadow():
+    config = MotorConfig()
+    written = []
+    async def write_registers(address, values, slave=1):
+        written.append((address, list(values)))
+        return ModbusResponse(WRITE_MULTIPLE_REGISTERS)
+    client = SimpleNamespace(write_registers=write_registers)
+    clients = SimpleNamespace(client_left=client, client_right=client, connection_generation=0)
+    motor_api = MotorApi(clients, config=config)
+    async def write_twice():
+        for _ in range(2):
+            assert await motor_api.set_analog_input_channel(config.ANALOG_MODBUS_CNTRL_VALUE)
+        return len(written)
+    ### the second write matches the shadow and is elided
+    assert asyncio.run(write_twice()) == 2
+    assert motor_api.get_shadow_stats()["elided"] == 2
+    ### a reconnect and a fault reset drop the shadow
+    clients.connection_generation = 1
+    assert asyncio.run(write_twice()) == 4
+    asyncio.run(motor_api.set_ieg_mode(config.RESET_FAULT_VALUE))
+    assert asyncio.run(write_twice()) == 8
+    ### the velocity controller process writes ANALOG_VEL_MAXIMUM, it is never elided
+    asyncio.run(motor_api.set_analog_vel_max([1, 2], [1, 2]))
+    asyncio.run(motor_api.set_analog_vel_max([1, 2], [1, 2]))
+    assert len(written) == 12
+
+    ### writes of other processes through the gateway update the shadow and the setpoint bookkeeping
+    gateway = _GatewayProtocol(None, "left", on_write=motor_api.external_write)
+    loop = asyncio.new_event_loop()
+    def respond(address, data):
+        future = loop.create_future()
+        future.set_result(ModbusResponse(WRITE_MULTIPLE_REGISTERS))
+        gateway._respond(future, 1, 1, WRITE_MULTIPLE_REGISTERS, address, data)
+    respond(config.ANALOG_INPUT_CHANNEL_REGISTER, [0])
+    respond(config.ANALOG_MODBUS_CNTRL_REGISTER, [5000])
+    assert motor_api.last_modbuscntrl == [5000, None]
+    ### only the left shadow changed
+    assert asyncio.run(write_twice()) == 13
+    respond(config.IEG_MODE_REGISTER, [config.RESET_FAULT_VALUE])
+    assert asyncio.run(write_twice()) == 15
+    loop.close()
+
 
 # async def _test_analog_velocity():
 #     logger = setup_logging(name="tests", filename="tests.log", extensive_logging=False, log_to_file=False)
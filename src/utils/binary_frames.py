@@ -0,0 +1,21 @@
+"""
+Binary websocket frames for high rate rotates. A client asks for them with
+binary=1| in its identify message and switches once the hub answers
+event=protocol|binary=1|. A rotate frame is one fixed little endian struct:
+opcode (u8), 3 pad bytes, seq (u32, 0 = untraced), client send time
+(f64, perf_counter seconds), pitch and roll (f32 degrees).
+"""
+import struct
+
+OP_ROTATE = 1
+ROTATE_FRAME = struct.Struct("<B3xIdff")
+
+def encode_rotate(pitch, roll, seq=0, timestamp=0.0) -> bytes:
+    return ROTATE_FRAME.pack(OP_ROTATE, seq, timestamp, pitch, roll)
+
+def decode_rotate(frame) -> tuple:
+    """(seq, timestamp, pitch, roll) of a rotate frame, ValueError for anything else"""
+    if len(frame) != ROTATE_FRAME.size or frame[0] != OP_ROTATE:
+        raise ValueError(f"Not a rotate frame: {len(frame)} bytes, opcode {frame[0] if frame else None}")
+    _, seq, timestamp, pitch, roll = ROTATE_FRAME.unpack_from(frame)
+    return seq, timestamp, pitch, roll
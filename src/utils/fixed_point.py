@@ -0,0 +1,89 @@
+"""
+Fixed point register codecs compiled once per format. A format "A.B" has A
+integer and B fractional bits, 16 bit formats live in one register and 32 bit
+formats in two registers with the low word first, like the Tritex drives send them.
+Same results as registers_convertion / convert_val_into_format without parsing
+the format string on every call.
+"""
+import numpy as np
+
+REGISTER_SIZE = 16
+
+class FixedPointCodec():
+    __slots__ = ("format", "integer_bits", "fraction_bits", "signed", "scale", "registers",
+                 "bits", "mask", "sign_bit", "resolution", "factor")
+
+    def __init__(self, format, signed=False, scale=1):
+        formats = format.split(".")
+        if len(formats) != 2:
+            raise ValueError(f"Invalid fixed point format: {format}")
+        self.format = format
+        self.integer_bits = abs(int(formats[0]))
+        self.fraction_bits = abs(int(formats[1]))
+        self.bits = self.integer_bits + self.fraction_bits
+        if self.bits not in (16, 32):
+            raise ValueError(f"Unsupported fixed point format: {format}")
+        self.registers = self.bits // REGISTER_SIZE
+        self.signed = signed
+        self.scale = scale
+        self.mask = (1 << self.bits) - 1
+        self.sign_bit = 1 << (self.bits - 1)
+        self.resolution = 1 / (1 << self.fraction_bits)
+        self.factor = self.resolution * scale
+
+    def raw(self, registers) -> int:
+        """Registers into the raw (signed) integer"""
+        if self.registers == 1:
+            raw = registers[0]
+        else:
+            raw = registers[0] | (registers[1] << REGISTER_SIZE)
+        if self.signed and raw & self.sign_bit:
+            raw -= 1 << self.bits
+        return raw
+
+    def decode(self, registers) -> float:
+        """[value] or [low, high] registers into the scaled value"""
+        return self.raw(registers) * self.factor
+
+    def encode(self, value):
+        """Value (unscaled) into a register value for 16 bit formats and
+        [low, high] for 32 bit formats, the fraction is truncated"""
+        raw = int(value * (1 << self.fraction_bits)) & self.mask
+        if self.registers == 1:
+            return raw
+        return [raw & 0xFFFF, raw >> REGISTER_SIZE]
+
+    def decode_array(self, registers) -> np.ndarray:
+        """Flat register array (n values * registers per value) into n scaled values"""
+        words = np.asarray(registers, dtype=np.uint32)
+        if self.registers == 2:
+            raw = words[0::2] | (words[1::2] << REGISTER_SIZE)
+            if self.signed:
+                raw = raw.view(np.int32)
+        else:
+            raw = words.astype(np.uint16)
+            if self.signed:
+                raw = raw.view(np.int16)
+        return raw * self.factor
+
+    def decode_bytes(self, payload) -> np.ndarray:
+        """Register bytes as they come in a read response (big endian words)"""
+        return self.decode_array(np.frombuffer(payload, dtype=">u2"))
+
+_codecs = {}
+
+def get_codec(format, signed=False, scale=1) -> FixedPointCodec:
+    """Cached codec for the format"""
+    key = (format, signed, scale)
+    codec = _codecs.get(key)
+    if codec is None:
+        codec = _codecs[key] = FixedPointCodec(format, signed, scale)
+    return codec
+
+POS32 = get_codec("16.16") # position feedback and analog position limits, revs
+VEL32 = get_codec("8.24", signed=True) # revs/s
+VEL32_RPM = get_codec("8.24", signed=True, scale=60)
+ACC32 = get_codec("12.20") # revs/s^2
+UCUR16 = get_codec("9.7") # host current, A
+UCUR32 = get_codec("9.23") # continuous current, A
+VOLT32 = get_codec("11.21", signed=True) # VBUS, V
@@ -0,0 +1,168 @@
+"""
+In-process timing spans for the hot path. Every span name gets a fixed size
+ring buffer of its most recent durations and an HDR style log-linear histogram
+of all of them, nothing is logged per sample. While disabled span() returns a
+shared no-op context manager and timed() wrappers only check one flag.
+"""
+import asyncio
+import functools
+from time import perf_counter
+
+SUB_BUCKET_BITS = 5 # 32 sub buckets per power of two, ~3% value resolution
+SUB_BUCKET_HALF = 1 << (SUB_BUCKET_BITS - 1)
+HISTOGRAM_BUCKETS = 512 # covers durations up to ~2^32 us
+PERCENTILES = (0.5, 0.9, 0.99, 0.999)
+
+ENABLED = False
+RING_SIZE = 1024
+_spans = {}
+
+def _bucket_index(value) -> int:
+    if value < (1 << SUB_BUCKET_BITS):
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    return (shift << (SUB_BUCKET_BITS - 1)) + (value >> shift)
+
+def _bucket_value(index) -> int:
+    """Upper edge of the values counted in the bucket"""
+    if index < (1 << SUB_BUCKET_BITS):
+        return index
+    shift = (index >> (SUB_BUCKET_BITS - 1)) - 1
+    return (((index & (SUB_BUCKET_HALF - 1)) + SUB_BUCKET_HALF + 1) << shift) - 1
+
+class Histogram():
+    """Log-linear histogram of integer microsecond values"""
+    def __init__(self):
+        self.counts = [0] * HISTOGRAM_BUCKETS
+        self.count = 0
+
+    def record(self, value):
+        self.counts[min(_bucket_index(value), HISTOGRAM_BUCKETS - 1)] += 1
+        self.count += 1
+
+    def percentile(self, p) -> int:
+        if not self.count:
+            return 0
+        threshold = max(1, round(p * self.count))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= threshold:
+                return _bucket_value(index)
+        return _bucket_value(HISTOGRAM_BUCKETS - 1)
+
+class SpanStats():
+    def __init__(self, ring_size):
+        self.histogram = Histogram()
+        self.ring = [0] * ring_size
+        self.ring_index = 0
+        self.count = 0
+        self.errors = 0
+        self.total_us = 0
+        self.max_us = 0
+
+    def record(self, seconds, error=False):
+        value = int(seconds * 1e6)
+        self.histogram.record(value)
+        self.ring[self.ring_index] = value
+        self.ring_index = (self.ring_index + 1) % len(self.ring)
+        self.count += 1
+        self.total_us += value
+        if value > self.max_us:
+            self.max_us = value
+        if error:
+            self.errors += 1
+
+    def get_stats(self) -> dict:
+        stats = {"count": self.count, "errors": self.errors, "max_us": self.max_us,
+                 "mean_us": self.total_us / self.count if self.count else 0.0}
+        for p in PERCENTILES:
+            stats[f"p{p * 100:g}_us"] = self.histogram.percentile(p)
+        recent = sorted(self.ring[:min(self.count, len(self.ring))])
+        if recent:
+            stats["recent_p50_us"] = recent[len(recent) // 2]
+            stats["recent_p99_us"] = recent[min(len(recent) - 1, int(len(recent) * 0.99))]
+        return stats
+
+class _Span():
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        record(self.name, perf_counter() - self.start, error=exc_type is not None)
+        return False
+
+class _NullSpan():
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+def configure(enabled, ring_size=RING_SIZE):
+    global ENABLED, RING_SIZE
+    RING_SIZE = ring_size
+    ENABLED = enabled
+
+def record(name, seconds, error=False):
+    if not ENABLED:
+        return
+    stats = _spans.get(name)
+    if stats is None:
+        stats = _spans[name] = SpanStats(RING_SIZE)
+    stats.record(seconds, error)
+
+def span(name):
+    """with span("name"): times the block"""
+    if not ENABLED:
+        return _NULL_SPAN
+    return _Span(name)
+
+def timed(name):
+    """Decorator that times every call of a function or coroutine function"""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not ENABLED:
+                    return await func(*args, **kwargs)
+                start = perf_counter()
+                error = True
+                try:
+                    result = await func(*args, **kwargs)
+                    error = result is False
+                    return result
+                finally:
+                    record(name, perf_counter() - start, error)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+            start = perf_counter()
+            error = True
+            try:
+                result = func(*args, **kwargs)
+                error = result is False or result is None
+                return result
+            finally:
+                record(name, perf_counter() - start, error)
+        return wrapper
+    return decorator
+
+def get_stats() -> dict:
+    return {"enabled": ENABLED, "spans": {name: stats.get_stats() for name, stats in sorted(_spans.items())}}
+
+def reset():
+    _spans.clear()
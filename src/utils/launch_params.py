@@ -17,6 +17,19 @@ def handle_launch_params(b_motor_config=False):
     parser.add_argument("--start_tid", type=int, help="start tid")
     parser.add_argument("--end_tid", type=int, help="end tid")
     parser.add_argument("--web_server_port", type=int, help="end tid")
+    parser.add_argument("--pipelined", action="store_true", help="use the pipelined modbus transport")
+    parser.add_argument("--max_in_flight", type=int, help="max outstanding modbus requests per drive")
+    parser.add_argument("--lean", action="store_true", help="use the lean modbus transport")
+    parser.add_argument("--interpolation", type=str, choices=["linear", "hermite"], help="upsample rotate setpoints with this interpolation")
+    parser.add_argument("--control_rate", type=int, help="interpolated setpoint rate in Hz")
+    parser.add_argument("--washout", action="store_true", help="motion cueing filter on the rotate attitude")
+    parser.add_argument("--prediction", action="store_true", help="extrapolate rotate setpoints by the measured latency")
+    parser.add_argument("--prediction_horizon", type=float, help="max prediction horizon in seconds")
+    parser.add_argument("--kinematics_version", type=int, help="kinematics coefficient set version, defaults to the active one")
+    parser.add_argument("--deadband", action="store_true", help="skip rotate writes that move a drive less than the deadband")
+    parser.add_argument("--deadband_revs", type=float, help="rotate deadband in revs")
+    parser.add_argument("--instrumentation", action="store_true", help="record hot path timing spans")
+    parser.add_argument("--bus_owner", action="store_true", help="reach the drives through the hubs bus owner")
 
     config = Config()
     motor_config =  MotorConfig()
@@ -51,6 +64,33 @@ def handle_launch_params(b_motor_config=False):
         config.LAST_TID = args.end_tid
     if (args.web_server_port):
         config.WEB_SERVER_PORT = args.web_server_port
+    if (args.pipelined):
+        config.PIPELINED_TRANSPORT = True
+    if (args.max_in_flight):
+        config.MAX_IN_FLIGHT = args.max_in_flight
+    if (args.lean):
+        config.LEAN_TRANSPORT = True
+    if (args.interpolation):
+        config.INTERPOLATION = True
+        config.INTERPOLATION_MODE = args.interpolation
+    if (args.control_rate):
+        config.INTERPOLATION_RATE = args.control_rate
+    if (args.washout):
+        config.WASHOUT = True
+    if (args.prediction):
+        config.PREDICTION = True
+    if (args.prediction_horizon):
+        config.PREDICTION_MAX_HORIZON = args.prediction_horizon
+    if (args.kinematics_version):
+        motor_config.KINEMATICS_VERSION = args.kinematics_version
+    if (args.deadband):
+        config.DEADBAND = True
+    if (args.deadband_revs):
+        motor_config.DEADBANDREVS = args.deadband_revs
+    if (args.instrumentation):
+        config.INSTRUMENTATION = True
+    if (args.bus_owner):
+        config.USE_BUS_OWNER = True
     if b_motor_config == True:
         return config,motor_config
     return config
\ No newline at end of file
@@ -44,24 +44,9 @@ class ColoredFormatter(logging.Formatter):
 def setup_logging(name, filename,extensive_logging=True, log_to_file=True):
     log_dir = "logs"
     parent_log_dir = os.path.join("C:\liikealusta\logs")
-    if not os.path.exists(parent_log_dir):
-        os.makedirs(parent_log_dir)
     
     log_format = '%(asctime)s - %(levelname)s - MODULE: - %(hyperlink)s - %(message)s'
 
-    # Set up file handler
-    log_file = os.path.join(parent_log_dir, filename)
-    # Set up file handler (plain text, no colors or hyperlinks)
-    file_handler = RotatingFileHandler(
-        log_file,
-        maxBytes=1024*1024,
-        backupCount=1,
-        encoding='utf-8'
-    )
-    file_formatter = logging.Formatter(
-        '%(asctime)s - %(levelname)s - %(module)s:%(lineno)d - %(message)s'
-    )
-    file_handler.setFormatter(file_formatter)
     console_formatter = ColoredFormatter(log_format, use_hyperlinks=True)    
     #setup console
     console_handler = logging.StreamHandler()
@@ -74,7 +59,20 @@ def setup_logging(name, filename,extensive_logging=True, log_to_file=True):
     else:
         logger.setLevel(logging.WARNING)
     if not logger.handlers:
+        ### the log directory and file are only created when logging to a file
         if log_to_file:
+            if not os.path.exists(parent_log_dir):
+                os.makedirs(parent_log_dir)
+            # Set up file handler (plain text, no colors or hyperlinks)
+            file_handler = RotatingFileHandler(
+                os.path.join(parent_log_dir, filename),
+                maxBytes=1024*1024,
+                backupCount=1,
+                encoding='utf-8'
+            )
+            file_handler.setFormatter(logging.Formatter(
+                '%(asctime)s - %(levelname)s - %(module)s:%(lineno)d - %(message)s'
+            ))
             logger.addHandler(file_handler)
         logger.addHandler(console_handler)
 
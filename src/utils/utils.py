@@ -1,6 +1,7 @@
 import math
 import logging
 from pathlib import Path
+from utils.fixed_point import POS32, VEL32, ACC32
 
 FAULT_RESET_BIT = 15
 ENABLE_MAINTAINED_BIT = 1
@@ -147,9 +148,7 @@ def unnormalize_decimal(decimal, max_n):
         return abs(int(decimal * 2**max_n))
 
 def convert_to_revs(pfeedback):
-    decimal = pfeedback[0] / 65536
-    num = pfeedback[1]
-    return num + decimal
+    return POS32.decode(pfeedback)
 
 def extract_part(part, message):
     start_idx = message.find(part)
@@ -163,6 +162,18 @@ def extract_part(part, message):
     
     return  message[start_idx:pipe_idx]
 
+def parse_message(message) -> dict:
+    """
+    Splits a key=value|key=value| message into a dict in one pass,
+    the first occurrence of a key wins like with extract_part
+    """
+    fields = {}
+    for part in message.split("|"):
+        key, separator, value = part.partition("=")
+        if separator and key not in fields:
+            fields[key] = value
+    return fields
+
 def is_nth_bit_on(n, number):
             mask = 1 << n
             return (number & mask) != 0
@@ -227,7 +238,7 @@ def convert_vel_rpm_revs(rpm):
                 rpm = 600
         
         revs = rpm/60.0
-        return convert_val_into_format(revs, format="8.24")
+        return VEL32.encode(revs)
 
 def convert_acc_rpm_revs(rpm):
         """
@@ -245,7 +256,7 @@ def convert_acc_rpm_revs(rpm):
                 rpm = 1500
         
         revs = rpm/60.0
-        return convert_val_into_format(revs, "12.20")
+        return ACC32.encode(revs)
 
 def get_current_path(file):
         return Path(file).parent
@@ -1,4 +1,5 @@
 from utils import utils
+from utils.fixed_point import VEL32, VEL32_RPM
 from time import sleep
 from utils import launch_params
 from ModbusClients import ModbusClients
@@ -31,8 +32,8 @@ class VelocityController():
             self.logger.error(f"Error while starting velocity controller {e}")
     async def get_vel(self):
             (left_vel, right_vel) = await self.motor_api.get_vel()
-            left_vel = abs(utils.registers_convertion(registers=left_vel,format="8.24", signed=True,scale=60))
-            right_vel = abs(utils.registers_convertion(registers=right_vel,format="8.24", signed=True, scale=60))
+            left_vel = abs(VEL32_RPM.decode(left_vel))
+            right_vel = abs(VEL32_RPM.decode(right_vel))
             return left_vel,right_vel
             
     def increment_vel(self):
@@ -48,8 +49,8 @@ class VelocityController():
          return utils.is_nth_bit_on(12,value)  
     
     async def update_vel(self,l_oeg_motion, r_oeg_motion):
-            left_vel_revs = utils.convert_val_into_format((self.max_analog_vel_left / 60) ,"8.24")
-            right_vel_revs = utils.convert_val_into_format((self.max_analog_vel_left / 60) ,"8.24")
+            left_vel_revs = VEL32.encode(self.max_analog_vel_left / 60)
+            right_vel_revs = VEL32.encode(self.max_analog_vel_left / 60)
             # both moving
             if not self.in_position(l_oeg_motion) and not self.in_position(r_oeg_motion):
                 await self.motor_api.set_analog_vel_max(left_vals=left_vel_revs, right_vals=right_vel_revs)